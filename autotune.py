@@ -0,0 +1,212 @@
+import os
+import json
+import math
+import time
+import hashlib
+import multiprocessing
+
+import msrdev
+import profiles
+import zenstates as zs
+
+MSR_PSTATE_CTL = 0xC0010062 # [2:0] PstateCmd
+
+# Deterministic work unit of the stress test, and how many distinct
+# seeds the workers cycle through
+KERNEL_ITERATIONS = 100000
+SEEDS = 8
+
+# Search the VIDs from the current one up to this many steps higher
+# (6.25 mV lower per step), and back off by `margin` steps at the end
+SEARCH_RANGE = 0x20
+MARGIN = 1
+
+# How often a running stress test looks at the thermal guard (in s)
+GUARD_POLL = 0.1
+
+
+# Integer and floating point mixing chained into a hash, so a single
+# wrong bit anywhere shows up in the result
+def kernel(seed, iterations=KERNEL_ITERATIONS):
+    x = seed * 0x9E3779B97F4A7C15 + 1
+    acc = 0.0
+    h = hashlib.sha256()
+    mask = (1 << 64) - 1
+    for i in range(iterations):
+        x = (x * 6364136223846793005 + 1442695040888963407) & mask
+        acc += math.sqrt((x >> 11) & 0xFFFFF) * math.sin(i) / (1.0 + (x & 0xFF))
+        if i & 0x3FF == 0:
+            h.update(x.to_bytes(8, 'little'))
+            h.update(repr(acc).encode())
+    h.update(repr(acc).encode())
+    return h.hexdigest()
+
+
+def reference(seeds=SEEDS):
+    return [kernel(seed) for seed in range(seeds)]
+
+
+def _stressworker(cpu, seconds, expected):
+    try:
+        os.sched_setaffinity(0, [cpu])
+    except OSError:
+        pass
+    deadline = time.monotonic() + seconds
+    rounds = 0
+    while time.monotonic() < deadline:
+        seed = rounds % len(expected)
+        if kernel(seed) != expected[seed]:
+            return cpu, False, rounds, 'seed %d mismatch' % seed
+        rounds += 1
+    return cpu, True, rounds, None
+
+
+# Load every CPU in cpulist with the kernel for `seconds`, checking each
+# result against the reference. Returns (ok, [(cpu, ok, rounds, error), ...]).
+# With a thermal guard the workers are killed as soon as it trips, and
+# ThermalTrip is raised.
+def stress(seconds, cpulist=None, expected=None, guard=None):
+    cpulist = list(msrdev.cpus() if cpulist is None else cpulist)
+    expected = expected or reference()
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(len(cpulist)) as pool:
+        pending = pool.starmap_async(_stressworker, [(cpu, seconds, expected) for cpu in cpulist])
+        timeout = time.monotonic() + seconds * 2 + 30
+        while not pending.ready() and time.monotonic() < timeout:
+            pending.wait(GUARD_POLL)
+            if guard is not None:
+                guard.check()
+        try:
+            results = pending.get(0)
+        except Exception as e:
+            return False, [(None, False, 0, '%s: %s' % (type(e).__name__, e))]
+    return all(ok for _, ok, _, _ in results), results
+
+
+# Search state on disk. Written atomically before every trial, with the
+# VID under test recorded, so that a trial which took the machine down
+# counts as a failure on resume.
+class Checkpoint(object):
+    def __init__(self, path):
+        self.path = path
+        self.targets = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.targets = json.load(f)['targets']
+            for t in self.targets.values():
+                if t.get('testing') is not None:
+                    t['hi'] = t.pop('testing') - 1
+                    t['testing'] = None
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'targets': self.targets}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class Tuner(object):
+    def __init__(self, checkpoint, seconds=60, cpulist=None, searchrange=SEARCH_RANGE, margin=MARGIN, log=print,
+                 guard=None):
+        self.checkpoint = checkpoint
+        self.guard = guard
+        self.seconds = seconds
+        self.cpulist = cpulist
+        self.searchrange = searchrange
+        self.margin = margin
+        self.log = log
+        self.expected = None
+
+    def _target(self, name, current):
+        targets = self.checkpoint.targets
+        if name not in targets:
+            targets[name] = {'lo': current, 'hi': min(current + self.searchrange, zs.VID_MAX - 1),
+                             'original': current, 'testing': None}
+        return targets[name]
+
+    def _setvid(self, name, vid):
+        if name == 'oc':
+            zs.writesmu(zs.SMU_CMD_OC_VID, vid)
+        else:
+            profiles.apply(profiles.Profile({'pstates': {name[1:]: {'vid': vid}}}), cpulist=self.cpulist)
+
+    # A thermal trip aborts the search; the known good VID is restored
+    # without consulting the guard
+    def _trial(self, name, vid):
+        if self.guard is not None:
+            self.guard.check()
+        if name != 'oc':
+            msrdev.writeall(MSR_PSTATE_CTL, int(name[1:]), self.cpulist or msrdev.cpus())
+        self._setvid(name, vid)
+        ok, results = stress(self.seconds, self.cpulist, self.expected, self.guard)
+        for cpu, cpuok, rounds, error in results:
+            if not cpuok:
+                self.log('  CPU %s failed after %d rounds: %s' % (cpu, rounds, error))
+        return ok
+
+    # Binary search for the highest VID (lowest voltage) that passes,
+    # lo is always known good and hi is the highest candidate left
+    def search(self, name, current):
+        t = self._target(name, current)
+        if self.expected is None:
+            self.expected = reference()
+        while t['lo'] < t['hi']:
+            mid = (t['lo'] + t['hi'] + 1) // 2
+            t['testing'] = mid
+            self.checkpoint.save()
+            self.log('%s: trying VID %X (%.5f V), range %X-%X' % (name, mid, zs.vidToVolts(mid), t['lo'], t['hi']))
+            try:
+                ok = self._trial(name, mid)
+            except BaseException:
+                # Not a stability result (a thermal trip, Ctrl-C, an error),
+                # retry on resume
+                t['testing'] = None
+                self.checkpoint.save()
+                raise
+            finally:
+                self._setvid(name, t['lo'])
+            t['testing'] = None
+            if ok:
+                t['lo'] = mid
+            else:
+                t['hi'] = mid - 1
+            self.checkpoint.save()
+        self._setvid(name, t['original'])
+        best = max(t['lo'] - self.margin, t['original'])
+        self.log('%s: stable at VID %X, using %X (%.5f V)' % (name, t['lo'], best, zs.vidToVolts(best)))
+        return best
+
+    # The cores go back to P0 control however the search ends
+    def run(self, pstates=None):
+        result = {}
+        if pstates is None:
+            pstates = [p for p in range(len(zs.PSTATES)) if zs.readmsr(zs.PSTATES[p]) >> 63]
+        try:
+            for p in pstates:
+                result['p%d' % p] = self.search('p%d' % p, zs.getPstateVid(p))
+            if zs.isOcFreqSupported and zs.SMU_CMD_OC_VID and zs.getOcMode():
+                result['oc'] = self.search('oc', zs.getCurrentVid())
+        finally:
+            msrdev.writeall(MSR_PSTATE_CTL, 0, self.cpulist or msrdev.cpus())
+        return result
+
+
+def toProfile(result):
+    data = {}
+    for name, vid in sorted(result.items()):
+        if name == 'oc':
+            data['oc'] = {'enabled': True, 'vid': '0x%X' % vid}
+        else:
+            data.setdefault('pstates', {})[name[1:]] = {'vid': '0x%X' % vid}
+    return data
+
+
+def run(out, checkpoint=None, seconds=60, pstates=None, cpulist=None, searchrange=SEARCH_RANGE, guard=None):
+    tuner = Tuner(Checkpoint(checkpoint or out + '.checkpoint'), seconds, cpulist, searchrange, guard=guard)
+    result = tuner.run(pstates)
+    with open(out, 'w') as f:
+        json.dump(toProfile(result), f, indent=2)
+        f.write('\n')
+    return result
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import argparse
+import subprocess
+from contextlib import redirect_stdout
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p / 100.0), len(samples) - 1)]
+
+
+def reportops(name, samples):
+    print('  %-30s %10.0f ops/s  p50=%9.2fus  p99=%9.2fus' % (
+        name, len(samples) / sum(samples),
+        percentile(samples, 50) * 1e6,
+        percentile(samples, 99) * 1e6))
+
+
+def timeop(fn, iterations):
+    samples = []
+    clock = time.perf_counter
+    for _ in range(iterations):
+        start = clock()
+        fn()
+        samples.append(clock() - start)
+    return samples
+
+
+def report(name, samples, unit=1e3, suffix='ms'):
+    print('%-40s n=%-6d p50=%9.3f%s  p99=%9.3f%s  min=%9.3f%s' % (
+        name, len(samples),
+        percentile(samples, 50) * unit, suffix,
+        percentile(samples, 99) * unit, suffix,
+        min(samples) * unit, suffix))
+
+
+def timeprocess(argv, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.call(argv, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# Run in a fresh interpreter per sample, so imports and hardware detection
+# start cold. The simulator is set up first and then reset, which leaves
+# only the CLI's own lazy detection and register reads in the timed --list.
+STARTUP = '''
+import os, sys, time
+from contextlib import redirect_stdout
+start = time.perf_counter()
+import zenstates as zs
+imported = time.perf_counter() - start
+import sim, smn, msrdev
+with sim.Simulator(sys.argv[1], cpus=int(sys.argv[2])):
+    msrdev.close()
+    smn.close()
+    zs.reset()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        zs.main(['--no-gui', '--list'])
+        listed = time.perf_counter() - start
+print(imported, listed)
+'''
+
+
+def benchStartup(runs, family='matisse', cpus=16):
+    python = sys.executable
+    report('python -c pass', timeprocess([python, '-c', 'pass'], runs))
+    imports, lists = [], []
+    for _ in range(runs):
+        out = subprocess.check_output([python, '-c', STARTUP, family, str(cpus)], cwd=HERE)
+        imported, listed = out.split()
+        imports.append(float(imported))
+        lists.append(float(listed))
+    report('import zenstates', imports)
+    report('--no-gui --list (%s, %d CPUs, sim)' % (family, cpus), lists)
+    report('import + --list', [a + b for a, b in zip(imports, lists)])
+
+
+def benchSim(cpucounts, family, delay, iterations, backend='pci'):
+    import sim
+    import msrdev
+    import zenstates as zs
+
+    devnull = open(os.devnull, 'w')
+    vids = [0x48, 0x49]
+
+    def setPstate():
+        vids.reverse()
+        with redirect_stdout(devnull):
+            zs.setPstateGui(0, 0x88, 8, vids[0])
+
+    def listPstates():
+        with redirect_stdout(devnull):
+            zs.main(['--no-gui', '--list'])
+
+    ops = [
+        ('readmsr', lambda: zs.readmsr(zs.PSTATES[0])),
+        ('readmsr uncached', lambda: zs.readmsr(zs.PSTATES[0], cached=False)),
+        ('writemsr cpu=0', lambda: zs.writemsr(zs.MSR_HWCR, 0, 0)),
+        ('writemsr cpu=-1', lambda: zs.writemsr(zs.MSR_HWCR, 0)),
+        ('msrdev.readall', lambda: msrdev.readall(zs.PSTATES[0])),
+        ('readsmureg', lambda: zs.readsmureg(zs.SMU_RSP_ADDR, cached=False)),
+        ('writesmureg', lambda: zs.writesmureg(zs.SMU_ARG_ADDR, 0)),
+        ('writesmu/smuwaitdone', lambda: zs.writesmu(0x1)),
+        ('setPstateGui', setPstate),
+        ('--list', listPstates),
+    ]
+
+    for n in cpucounts:
+        with sim.Simulator(family, cpus=n, delay=delay, backend=backend):
+            print('%s, %d CPUs, SMU delay %.0fus, %s' % (family, n, delay * 1e6, backend))
+            for name, fn in ops:
+                fn()
+                reportops(name, timeop(fn, iterations))
+    devnull.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ZenStates micro-benchmarks')
+    parser.add_argument('--runs', default=20, type=int, help='Runs per startup benchmark')
+    parser.add_argument('--no-startup', action='store_true', help='Skip the process startup benchmarks')
+    parser.add_argument('--sim', action='store_true', help='Benchmark every access path against the simulator')
+    parser.add_argument('--family', default='matisse', help='Simulated CPU family')
+    parser.add_argument('--cpus', default='8,32,128,256', help='Comma separated simulated CPU counts')
+    parser.add_argument('--smu-delay', default=20, type=float, help='Simulated SMU response delay (in us)')
+    parser.add_argument('--smu-backend', default='pci', choices=['pci', 'ryzen_smu'], help='Simulated SMU access method')
+    parser.add_argument('--iterations', default=200, type=int, help='Iterations per simulated operation')
+    parser.add_argument('--startup-cpus', default=16, type=int, help='Simulated CPU count of the startup benchmark')
+    args = parser.parse_args()
+
+    if not args.no_startup:
+        benchStartup(args.runs, args.family, args.startup_cpus)
+    if args.sim:
+        benchSim([int(n) for n in args.cpus.split(',')], args.family, args.smu_delay / 1e6, args.iterations,
+                 args.smu_backend)
@@ -0,0 +1,530 @@
+#!/usr/bin/env python
+import io
+import os
+import sys
+import json
+import struct
+import argparse
+import tempfile
+import threading
+import traceback
+
+CHECKS = []
+
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+
+def expect(got, want, what):
+    if got != want:
+        raise AssertionError('%s: got %r, expected %r' % (what, got, want))
+
+
+# Byte offsets of the desktop Matisse PM table (0x240903) as published by
+# ryzen_monitor, written into a stand-in blob independently of pmtable's
+# layout descriptors
+MATISSE_REFERENCE = {
+    'PPT_LIMIT': 0x000, 'PPT_VALUE': 0x004, 'TDC_LIMIT': 0x008, 'TDC_VALUE': 0x00C,
+    'THM_LIMIT': 0x010, 'THM_VALUE': 0x014, 'EDC_LIMIT': 0x020, 'EDC_VALUE': 0x024,
+    'CORE_POWER': 0x24C, 'CORE_VOLTAGE': 0x28C, 'CORE_TEMP': 0x2CC, 'CORE_FREQ': 0x38C,
+    'CORE_FREQEFF': 0x3CC, 'CORE_C0': 0x40C, 'CORE_CC6': 0x48C,
+}
+
+
+def matisseBlob(offset=0):
+    import pmtable
+    size = pmtable.LAYOUTS[0x240903][0]
+    blob = bytearray(offset + size)
+    values = {}
+    for i, (name, at) in enumerate(sorted(MATISSE_REFERENCE.items())):
+        count = 16 if name.startswith('CORE_') else 1
+        vals = [float(i * 100 + n) for n in range(count)]
+        struct.pack_into('<%df' % count, blob, offset + at, *vals)
+        values[name] = vals[0] if count == 1 else vals
+    return bytes(blob), values
+
+
+@check
+def pmTableLayouts():
+    import pmtable
+    for version, (size, fields) in pmtable.LAYOUTS.items():
+        used = set()
+        for name, (offset, count) in fields.items():
+            words = set(range(offset // 4, offset // 4 + count))
+            if offset % 4 or (offset + 4 * count) > size:
+                raise AssertionError('0x%X %s outside the table' % (version, name))
+            if used & words:
+                raise AssertionError('0x%X %s overlaps another field' % (version, name))
+            used |= words
+
+
+@check
+def pmTableFixture():
+    import pmtable
+    # Table at an unaligned offset inside the stand-in file, as in /dev/mem
+    offset = 0x1234
+    blob, values = matisseBlob(offset)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(blob)
+        f.flush()
+        table = pmtable.PmTable(offset, 0x240903, f.name)
+        try:
+            got = table.refresh().read(list(values))
+            for name, want in values.items():
+                expect(got[name], want, name)
+            expect(table['CORE_FREQ'][3], values['CORE_FREQ'][3], 'CORE_FREQ[3]')
+        finally:
+            table.close()
+
+
+@check
+def ryzenSmuCommands():
+    import sim
+    import smu
+    import zenstates as zs
+    with sim.Simulator('matisse', cpus=2, backend='ryzen_smu') as s:
+        mailbox = zs.smumailboxes()[0]
+        expect(type(mailbox).__name__, 'SimRyzenSmuMailbox', 'mailbox')
+        # Arguments go out as six little-endian u32 in smu_args, padded
+        # with zeros, and the SMU's values come back from the same file
+        seen = []
+        def handler(args):
+            seen.append(list(args))
+            return smu.SMU_RSP_OK, [a + 1 for a in args]
+        s.handlers[0x50] = handler
+        r = zs.smutransact([(0x50, [7, 0xFFFFFFFE])])[0]
+        expect(seen, [[7, 0xFFFFFFFE, 0, 0, 0, 0]], 'arguments seen by the SMU')
+        expect(r.rsp, smu.SMU_RSP_OK, 'response')
+        expect(r.args, [8, 0xFFFFFFFF, 1, 1, 1, 1], 'arguments read back')
+        expect(r.error, None, 'error')
+        with open(os.path.join(s.driver, 'smu_args'), 'rb') as f:
+            expect(struct.unpack('<6I', f.read()), (8, 0xFFFFFFFF, 1, 1, 1, 1), 'smu_args layout')
+
+        # Error responses map to their exception types
+        s.unknown.add(0x51)
+        s.handlers[0x52] = lambda args: (smu.SMU_RSP_REJECTED_PREREQ, args)
+        s.handlers[0x53] = lambda args: (smu.SMU_RSP_FAILED, args)
+        s.handlers[0x54] = lambda args: (smu.SMU_RSP_REJECTED_BUSY, args)
+        results = zs.smutransact([(0x51, []), (0x52, []), (0x53, []), (0x54, [])])
+        expect([r.rsp for r in results], [smu.SMU_RSP_UNKNOWN_CMD, smu.SMU_RSP_REJECTED_PREREQ,
+                                          smu.SMU_RSP_FAILED, smu.SMU_RSP_REJECTED_BUSY], 'responses')
+        expect([type(r.error) for r in results], [smu.SmuUnknownCommandError, smu.SmuPrereqError,
+                                                  smu.SmuFailedError, smu.SmuBusyError], 'errors')
+        # stoponerror skips what follows a failed command
+        results = mailbox.transact([(0x51, []), (0x50, [1])], stoponerror=True)
+        expect(len(results), 1, 'results after stoponerror')
+        try:
+            zs.readsmu(0x51)
+            raise AssertionError('readsmu of an unknown command did not raise')
+        except smu.SmuUnknownCommandError:
+            pass
+
+        # A write the driver fails (SMU not answering) is a timeout
+        def fail(cmd):
+            raise OSError(110, 'Connection timed out')
+        mailbox._submit = fail
+        r = mailbox.transact([(0x50, [])])[0]
+        expect(type(r.error), smu.SmuTimeoutError, 'error of a failed driver write')
+
+
+@check
+def ryzenSmuFallback():
+    import sim
+    import smu
+    import zenstates as zs
+    # No driver tree: auto uses PCI config space, forcing the driver fails
+    with sim.Simulator('matisse', cpus=2, backend='auto'):
+        smu.RYZEN_SMU_DRV = os.path.join(tempfile.gettempdir(), 'zenstates-no-such-driver')
+        expect(zs.usingRyzenSmu(), False, 'auto without the driver')
+        expect(type(zs.smumailboxes()[0]), smu.Mailbox, 'mailbox without the driver')
+        expect(zs.writesmu(0x1), smu.SMU_RSP_OK, 'PCI mailbox response')
+        zs.SMU_BACKEND = 'ryzen_smu'
+        try:
+            zs.usingRyzenSmu()
+            raise AssertionError('forced ryzen_smu without the driver did not fail')
+        except SystemError:
+            pass
+    # Driver loaded but of another interface version: auto falls back too
+    with sim.Simulator('matisse', cpus=2, backend='ryzen_smu') as s:
+        expect(zs.usingRyzenSmu(), True, 'supported driver')
+        for version, usable in (('0.0.9', False), ('1.0.0', False), ('garbage', False), ('0.1.0', True)):
+            with open(os.path.join(s.driver, 'drv_version'), 'w') as f:
+                f.write(version + '\n')
+            expect(smu.ryzenSmuAvailable(), usable, 'driver version %s' % version)
+        os.remove(os.path.join(s.driver, 'drv_version'))
+        zs.SMU_BACKEND = 'auto'
+        zs.reset()
+        expect(zs.usingRyzenSmu(), False, 'auto with an unversioned driver')
+        expect(type(zs.smumailboxes()[0]), smu.Mailbox, 'mailbox with an unversioned driver')
+
+
+@check
+def superIoSession():
+    import sim
+    import superio
+    chip = sim.SimSuperIo()
+    sio = superio.SuperIo('ite', backend=chip)
+    expect(sio.chipId(), sim.SimSuperIo.CHIP_ID, 'chip ID')
+    expect(chip.entered, True, 'configuration mode after the first access')
+    # Entry key and LDN select happen once per session: a toggle on a
+    # selected LDN is one read and one write of the register
+    expect(sio.qcode(), False, 'Q-Code state')
+    before = chip.accesses
+    expect(sio.toggleQcode(), True, 'Q-Code after toggle')
+    expect(chip.accesses - before, 4, 'port accesses of a toggle in an open session')
+    expect(chip.config[superio.QCODE_LDN][superio.QCODE_REG], superio.QCODE_BIT, 'Q-Code register')
+    expect(sio.toggleQcode(), False, 'Q-Code after second toggle')
+    sio.close()
+    expect(chip.entered, False, 'configuration mode after close')
+
+    # Nuvoton chips have no Q-Code/hardware monitor map: refused, and no
+    # register written
+    chip = sim.SimSuperIo()
+    sio = superio.SuperIo('nuvoton', backend=chip)
+    for fn in (sio.toggleQcode, sio.qcode, sio.hardwareMonitor):
+        try:
+            fn()
+            raise AssertionError('%s on a Nuvoton chip did not raise' % fn.__name__)
+        except ValueError:
+            pass
+    expect(chip.config[superio.QCODE_LDN][superio.QCODE_REG], 0, 'Q-Code register after refused toggle')
+    sio.close()
+
+
+@check
+def superIoHardwareMonitor():
+    import sim
+    import superio
+    chip = sim.SimSuperIo()
+    with superio.SuperIo('ite', backend=chip) as sio:
+        hwmon = sio.hardwareMonitor()
+        sio.exit()
+        before = chip.accesses
+        values = hwmon.poll()
+        expect(chip.accesses - before, 2 * len(hwmon.regs), 'port accesses of a poll')
+        expect(chip.entered, False, 'configuration mode while polling')
+        fans = values['fans']
+        if abs(fans[0] - 1000) > 2 or abs(fans[1] - 1200) > 2 or fans[2:] != [0, 0, 0]:
+            raise AssertionError('fans: got %r' % fans)
+        expect(values['temps'], [40, 35, -5], 'temperatures')
+        expect(values['volts'], [1.2] * len(superio.EC_VOLTAGES), 'voltages')
+
+
+@check
+def renoirLimits():
+    import sim
+    import profiles
+    import zenstates as zs
+    # The Renoir PM table has no PPT/TDC/EDC fields: the limits read back
+    # as unknown and a profile writes every one it sets
+    with sim.Simulator('renoir', cpus=2, backend='ryzen_smu'):
+        profile = profiles.Profile({'limits': {'ppt': 25, 'tdc': 30, 'edc': 45}})
+        plan = profiles.apply(profile, dryrun=True)
+        expect(plan.state.limits, {}, 'limits read back')
+        expect(plan.smucommands, [(zs.SMU_CMD_SET_PPT, [25000]), (zs.SMU_CMD_SET_TDC, [30000]),
+                                  (zs.SMU_CMD_SET_EDC, [45000])], 'SMU commands')
+
+
+@check
+def daemonCliAllowlist():
+    import sim
+    import daemon
+    allowed = (['--list'], ['-l'], ['--ppt=65', '--tdc', '60'], ['-p', '0', '--vid', '0x48'],
+               ['--pstate', '-1'], ['--profile', 'p.json', '--dry-run'], ['--cpus', '0-3', '--thermal-limit', '90'])
+    for argv in allowed:
+        daemon._clicheck(argv)
+    refused = (['--exporter', '9432'], ['--monitor'], ['--measure=out.ndjson'], ['--daemon'],
+               ['--governor', 'g.json'], ['--autotune', 'vids.json'], ['--stress', '10'], ['-l', '-x'])
+    for argv in refused:
+        try:
+            daemon._clicheck(argv)
+            raise AssertionError('%r allowed in the daemon' % (argv,))
+        except ValueError:
+            pass
+    with sim.Simulator('matisse', cpus=4):
+        saved = sys.stdout
+        try:
+            service = daemon.Service()
+            try:
+                service.call('cli', {'argv': ['--exporter', '9432']})
+                raise AssertionError('cli call with a refused flag ran')
+            except ValueError:
+                pass
+        finally:
+            sys.stdout = saved
+
+
+@check
+def daemonCliCapture():
+    import sim
+    import daemon
+    # Concurrent cli() calls each get only what their own thread printed,
+    # everything else keeps going to the daemon's stdout
+    with sim.Simulator('matisse', cpus=8):
+        saved = sys.stdout
+        default = sys.stdout = io.StringIO()
+        try:
+            service = daemon.Service()
+            outputs = {'--list': [], '--topology': []}
+            start = threading.Barrier(5)
+            def run(flag):
+                start.wait()
+                for _ in range(5):
+                    outputs[flag].append(service.cli([flag]))
+            threads = [threading.Thread(target=run, args=(flag,)) for flag in sorted(outputs) * 2]
+            for t in threads:
+                t.start()
+            start.wait()
+            for _ in range(200):
+                print('daemon log line')
+            for t in threads:
+                t.join()
+        finally:
+            sys.stdout = saved
+        expect(len(outputs['--list']) + len(outputs['--topology']), 20, 'cli calls')
+        for out in outputs['--list']:
+            expect(('P0 - ' in out, 'Socket' in out, 'daemon log' in out), (True, False, False), '--list output')
+        for out in outputs['--topology']:
+            expect(('P0 - ' in out, 'Socket' in out, 'daemon log' in out), (False, True, False), '--topology output')
+        log = default.getvalue()
+        expect(log.count('daemon log line'), 200, 'daemon log lines')
+        expect(('P0 - ' in log, 'Socket' in log), (False, False), 'cli output in the daemon log')
+
+
+@check
+def daemonLocking():
+    import sim
+    import smu
+    import daemon
+    import zenstates as zs
+    with sim.Simulator('matisse', cpus=4, backend='ryzen_smu') as s:
+        saved = sys.stdout
+        try:
+            service = daemon.Service()
+        finally:
+            sys.stdout = saved
+        expect(set(service.READ) & set(service.WRITE), set(), 'methods both read and write')
+        for name in service.READ + service.WRITE:
+            expect(callable(getattr(service, name, None)), True, 'method %s' % name)
+        try:
+            service.call('serve', {})
+            raise AssertionError('unknown method ran')
+        except ValueError:
+            pass
+
+        # Reads go ahead while a write holds the lock, writes wait for it
+        def call(method, params, done):
+            done.append(service.call(method, params))
+        with service.writelock:
+            read, write = [], []
+            reader = threading.Thread(target=call, args=('ping', {}, read))
+            writer = threading.Thread(target=call, args=('invalidate', {}, write))
+            reader.start()
+            writer.start()
+            reader.join(5)
+            writer.join(0.2)
+            expect((reader.is_alive(), len(read)), (False, 1), 'read under the write lock')
+            expect(writer.is_alive(), True, 'write waiting for the lock')
+        writer.join(5)
+        expect(writer.is_alive(), False, 'write after the lock was released')
+
+        # A rejected SMU write comes back as an error
+        s.handlers[zs.SMU_CMD_SET_PPT] = lambda args: (smu.SMU_RSP_REJECTED_PREREQ, args)
+        try:
+            service.call('setLimits', {'ppt': 100})
+            raise AssertionError('rejected PPT write reported success')
+        except smu.SmuPrereqError:
+            pass
+        expect(service.call('setLimits', {'tdc': 60})['smuWrites'], 1, 'SMU writes of an accepted limit')
+
+
+@check
+def profilesDryRun():
+    import sim
+    import smu
+    import msrdev
+    import profiles
+    import zenstates as zs
+    data = {'pstates': {'1': {'fid': '0x90', 'vid': '0x40'}}, 'c6': {'package': False}, 'limits': {'ppt': 100}}
+    with sim.Simulator('matisse', cpus=4, backend='ryzen_smu') as s:
+        seen = []
+        def handler(args):
+            seen.append(args[0])
+            return smu.SMU_RSP_OK, args
+        s.handlers[zs.SMU_CMD_SET_PPT] = handler
+        before = msrdev.readmanyall(profiles.STATE_MSRS)
+        plan = profiles.apply(profiles.Profile(data), dryrun=True)
+        expect((plan.msrtransactions(), plan.smutransactions()), (12, 1), 'planned writes')
+        expect(msrdev.readmanyall(profiles.STATE_MSRS), before, 'registers after a dry run')
+        expect(seen, [], 'SMU commands of a dry run')
+
+        # The command line path prints the same plan and writes nothing
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(data, f)
+            f.flush()
+            out = io.StringIO()
+            saved = sys.stdout
+            sys.stdout = out
+            try:
+                zs.main(['--no-gui', '--profile', f.name, '--dry-run'])
+            finally:
+                sys.stdout = saved
+        expect(plan.report() in out.getvalue(), True, '--dry-run output')
+        expect(msrdev.readmanyall(profiles.STATE_MSRS), before, 'registers after --dry-run')
+
+        plan = profiles.apply(profiles.Profile(data))
+        expect(seen, [100000], 'SMU commands applied')
+        for cpu in msrdev.cpus():
+            fid, did, vid = zs.getPstateDetails(msrdev.read(zs.PSTATES[1], cpu))
+            expect((fid, vid), (0x90, 0x40), 'P1 of CPU %d' % cpu)
+            expect(msrdev.read(zs.MSR_PMGT_MISC, cpu) & profiles.C6_PACKAGE_MASK, 0, 'C6 package of CPU %d' % cpu)
+        # Applying it again leaves the registers alone
+        plan = profiles.apply(profiles.Profile(data))
+        expect(plan.msrtransactions(), 0, 'MSR writes of a repeated profile')
+
+        for bad in ({'pstates': {'8': {}}}, {'pstates': {'0': {'fid': 0xFF}}}, {'pstates': {'0': {'did': 0x0E}}},
+                    {'oc': {'vid': zs.VID_MAX}}, {'limits': {'stapm': 10}}):
+            try:
+                profiles.Profile(bad)
+                raise AssertionError('profile %r accepted' % (bad,))
+            except ValueError:
+                pass
+
+
+@check
+def topologySelectors():
+    import sim
+    import msrdev
+    import topology
+    import zenstates as zs
+    with sim.Simulator('matisse', cpus=16, sockets=2) as s:
+        topo = topology.get()
+        expect((topo.sockets(), topo.ccds(), topo.ccxs()), ([0, 1], [0, 1], [0, 1, 2, 3]), 'sockets, CCDs, CCXs')
+        expect(topo.select(), None, 'no selector')
+        expect(topo.select(ccx=[1]), [4, 5, 6, 7], 'CCX 1')
+        expect(topo.select(ccd=[1]), list(range(8, 16)), 'CCD 1')
+        expect(topo.select(socket=[0], ccx=[0, 2]), [0, 1, 2, 3], 'socket 0 and CCX 0 or 2')
+        expect(topo.select(cpus=[1, 9], socket=[1]), [9], 'CPU list on socket 1')
+        try:
+            topo.select(ccx=[9])
+            raise AssertionError('empty selection accepted')
+        except ValueError:
+            pass
+
+        # An offline CPU is left out
+        with open(os.path.join(s.root, 'sys', 'cpu5', 'online'), 'w') as f:
+            f.write('0\n')
+        topology.reset()
+        expect(topology.get().select(ccx=[1]), [4, 6, 7], 'CCX 1 with CPU 5 offline')
+
+        # --pstate with a selector writes only the selected cores
+        before = msrdev.readall(zs.PSTATES[0])
+        before_p1 = msrdev.readall(zs.PSTATES[1])
+        saved = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            zs.main(['--no-gui', '--pstate', '0', '--fid', '0x90', '--ccx', '1'])
+        finally:
+            sys.stdout = saved
+        after = msrdev.readall(zs.PSTATES[0])
+        for cpu, old, new in zip(msrdev.cpus(), before, after):
+            want = zs.setfid(old, 0x90) if cpu in (4, 6, 7) else old
+            expect(new, want, 'P0 of CPU %d' % cpu)
+
+        # --enable and --disable together are refused with or without a
+        # selector
+        saved = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = io.StringIO()
+        try:
+            for selector in ([], ['--cpus', '0']):
+                try:
+                    zs.main(['--no-gui', '--pstate', '1', '--enable', '--disable'] + selector)
+                    raise AssertionError('--enable --disable accepted with %r' % (selector,))
+                except SystemExit as e:
+                    expect(e.code, 2, 'exit code of --enable --disable')
+        finally:
+            sys.stdout, sys.stderr = saved
+        expect(msrdev.readall(zs.PSTATES[1]), before_p1, 'P1 after --enable --disable')
+
+
+@check
+def governorSteps():
+    import sim
+    import smu
+    import governor
+    import zenstates as zs
+
+    class Load(object):
+        value = 0.0
+
+        def sample(self):
+            return self.value
+
+    with sim.Simulator('matisse', cpus=4) as s:
+        seen = []
+        def handler(args):
+            seen.append(args[0])
+            return smu.SMU_RSP_OK, args
+        s.handlers[zs.SMU_CMD_SET_PPT] = handler
+        gov = governor.Governor({'ppt': [50, 150], 'alpha': 1.0, 'hysteresis': 0.1, 'min_write_interval': 2.0})
+        gov.source = load = Load()
+        # (time, load) -> (action, PPT applied, SMU writes so far)
+        steps = (
+            (0.0, 1.0, 'write', 150, [150000]),
+            (0.5, 0.95, 'hold', 150, [150000]),
+            (1.0, 0.0, 'ratelimited', 150, [150000]),
+            (3.0, 0.0, 'write', 50, [150000, 50000]),
+            (6.0, 0.05, 'hold', 50, [150000, 50000]),
+        )
+        for now, value, action, ppt, writes in steps:
+            load.value = value
+            record = gov.step(now)
+            expect((record['action'], record['applied'].get('ppt'), seen), (action, ppt, writes), 'step at %.1f s' % now)
+        expect(gov.step(7.0)['reaction_s'], None, 'reaction time of a hold')
+        try:
+            governor.Governor({'interval': 1.0})
+            raise AssertionError('governor without limits accepted')
+        except ValueError:
+            pass
+
+
+@check
+def thermalGuardClosed():
+    import sim
+    import daemon
+    # A tripped --thermal-limit exits early; its sampling thread must not
+    # outlive the cli call
+    with sim.Simulator('matisse', cpus=4) as s:
+        saved = sys.stdout
+        try:
+            service = daemon.Service()
+            out = service.cli(['--thermal-limit', '10', '--ppt', '5'])
+            s.setTemperature(95.0)
+            out += service.cli(['--thermal-limit', '90', '--profile', os.devnull])
+        finally:
+            sys.stdout = saved
+        expect(out.count('reached the'), 2, 'thermal trips')
+        guards = [t for t in threading.enumerate() if t.name == 'thermal-guard']
+        expect(guards, [], 'guard threads left running')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ZenStates functional checks against the simulator')
+    parser.add_argument('names', nargs='*', help='Only run these checks')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    failed = 0
+    for fn in CHECKS:
+        if args.names and fn.__name__ not in args.names:
+            continue
+        try:
+            fn()
+            print('ok    %s' % fn.__name__)
+        except Exception:
+            failed += 1
+            print('FAIL  %s' % fn.__name__)
+            traceback.print_exc()
+    exit(1 if failed else 0)
@@ -8,6 +8,9 @@ from __future__ import print_function
 import platform
 import os
 import ctypes
+import threading
+from array import array
+from contextlib import contextmanager
 from ctypes import c_uint32, c_int, c_long, c_ulong, c_size_t, c_void_p, POINTER, CFUNCTYPE
 
 # Posix x86_64:
@@ -120,11 +123,14 @@ class CPUID(object):
 
         func_type = CFUNCTYPE(None, POINTER(CPUID_struct), c_uint32, c_uint32)
         self.func_ptr = func_type(self.addr)
+        self.regs = CPUID_struct()
+        self.lock = threading.Lock()
 
     def __call__(self, eax, ecx=0):
-        struct = CPUID_struct()
-        self.func_ptr(struct, eax, ecx)
-        return struct.eax, struct.ebx, struct.ecx, struct.edx
+        with self.lock:
+            regs = self.regs
+            self.func_ptr(regs, eax, ecx)
+            return regs.eax, regs.ebx, regs.ecx, regs.edx
 
     def __del__(self):
         if is_windows:
@@ -138,17 +144,76 @@ class CPUID(object):
             self.libc.free.argtypes = [c_void_p]
             self.libc.free(self.addr)
 
-if __name__ == "__main__":
-    def valid_inputs():
-        cpuid = CPUID()
-        for eax in (0x0, 0x80000000):
-            highest, _, _, _ = cpuid(eax)
-            while eax <= highest:
-                regs = cpuid(eax)
-                yield (eax, regs)
-                eax += 1
+# Process-wide engine: the executable stub and result buffer are set up
+# once, and results are memoized per (leaf, subleaf, cpu). Leaves that
+# report per-core data (APIC IDs, topology) should be queried with an
+# explicit cpu.
+
+_engine = None
+_engine_lock = threading.Lock()
+_cache = {}
+
+
+def engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = CPUID()
+    return _engine
+
+
+def set_engine(func):
+    # Replace the engine with any callable(eax, ecx) -> (eax, ebx, ecx, edx)
+    global _engine
+    with _engine_lock:
+        _engine = func
+        _cache.clear()
+
+
+@contextmanager
+def on_cpu(cpu):
+    if cpu is None:
+        yield
+        return
+    old = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, [cpu])
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, old)
+
+
+def cpuid(eax, ecx=0, cpu=None):
+    key = (eax, ecx, cpu)
+    regs = _cache.get(key)
+    if regs is None:
+        with on_cpu(cpu):
+            regs = _cache[key] = engine()(eax, ecx)
+    return regs
+
+
+# All valid standard and extended leaves (subleaf 0) as a flat array of
+# leaf, eax, ebx, ecx, edx records
+def dump(cpu=None):
+    out = array('I')
+    with on_cpu(cpu):
+        func = engine()
+        for base in (0x0, 0x80000000):
+            highest = func(base, 0)[0]
+            if highest < base or highest - base > 0xFFFF:
+                continue
+            for eax in range(base, highest + 1):
+                regs = func(eax, 0)
+                _cache[(eax, 0, cpu)] = regs
+                out.append(eax)
+                out.extend(regs)
+    return out
+
 
+if __name__ == "__main__":
+    records = dump()
     print(" ".join(x.ljust(8) for x in ("CPUID", "A", "B", "C", "D")).strip())
-    for eax, regs in valid_inputs():
-        print("%08x" % eax, " ".join("%08x" % reg for reg in regs))
+    for i in range(0, len(records), 5):
+        print("%08x" % records[i], " ".join("%08x" % reg for reg in records[i + 1:i + 5]))
 
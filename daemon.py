@@ -0,0 +1,216 @@
+import io
+import os
+import sys
+import json
+import socket
+import threading
+import socketserver
+
+import smu
+import msrdev
+import profiles
+import topology
+import zenstates as zs
+
+SOCKET_PATH = '/run/zenstates.sock'
+
+# Command line flags Service.cli() runs: one-shot reads and writes only.
+# Anything that loops, blocks or changes the daemon's own setup is refused.
+CLI_FLAGS = frozenset((
+    '-h', '--help', '--no-gui', '-l', '--list', '--snapshot', '--pm-table', '--topology',
+    '-p', '--pstate', '--enable', '--disable', '-f', '--fid', '-d', '--did', '-v', '--vid',
+    '--c6-enable', '--c6-disable', '--smu-test-message', '--oc-frequency', '--oc-vid',
+    '--ppt', '--tdc', '--edc', '--profile', '--dry-run', '--thermal-limit',
+    '--cpus', '--ccx', '--ccd', '--socket',
+))
+
+
+def _clicheck(argv):
+    for arg in argv:
+        if not arg.startswith('-') or arg[1:2].isdigit():
+            continue
+        flag = arg.split('=', 1)[0] if arg.startswith('--') else arg[:2]
+        if flag not in CLI_FLAGS:
+            raise ValueError('%s cannot run in the daemon' % flag)
+
+
+# sys.stdout replacement that sends each thread's output to the buffer it
+# set, so cli() captures only what its own thread prints
+class ThreadStdout(object):
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _out(self):
+        return getattr(self.local, 'out', None) or self.default
+
+    def write(self, s):
+        return self._out().write(s)
+
+    def flush(self):
+        self._out().flush()
+
+    def capture(self, out):
+        self.local.out = out
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+def _pstate(val):
+    fid, did, vid = zs.getPstateDetails(val)
+    return {'enabled': bool(val >> 63), 'fid': fid, 'did': did, 'vid': vid, 'raw': val}
+
+
+# Requests handled by the daemon. Read-only methods run concurrently on the
+# connection threads, anything that writes hardware holds the write lock.
+class Service(object):
+    READ = ('ping', 'state', 'pstates', 'smuStats', 'cacheStats', 'topology')
+    WRITE = ('setPstate', 'setC6', 'setOc', 'setLimits', 'applyProfile', 'cli', 'invalidate')
+
+    def __init__(self):
+        self.writelock = threading.Lock()
+        if not isinstance(sys.stdout, ThreadStdout):
+            sys.stdout = ThreadStdout(sys.stdout)
+        self.stdout = sys.stdout
+        zs.detect()
+        zs.smumailboxes()
+
+    def ping(self):
+        return {'version': zs.APP_VERSION, 'cpuid': zs._cpuid, 'pid': os.getpid()}
+
+    def pstates(self, cpu=0):
+        return [_pstate(val) for val in msrdev.readmany(zs.PSTATES, cpu)]
+
+    def state(self, cpu=0):
+        return {
+            'pstates': self.pstates(cpu),
+            'c6': {'core': zs.getC6core(), 'package': zs.getC6package()},
+            'oc': zs.getOcMode() if zs.SMU_CMD_GET_PBO_SCALAR else None,
+        }
+
+    def smuStats(self):
+        return dict(('0x%X' % (cmd or 0), s) for cmd, s in smu.stats().items())
+
+    def cacheStats(self):
+        return {'msr': zs.msrcache.stats(), 'smn': zs.smncache.stats()}
+
+    def invalidate(self):
+        zs.invalidate()
+
+    def topology(self):
+        return [c._asdict() for c in topology.get().cpus]
+
+    # selection holds the optional cpus/ccx/ccd/socket selectors, each a
+    # list of ids
+    def _apply(self, data, dryrun=False, selection=None):
+        cpulist = topology.get().select(**(selection or {}))
+        plan = profiles.apply(profiles.Profile(data), dryrun, cpulist)
+        return {'msrWrites': plan.msrtransactions(), 'smuWrites': plan.smutransactions(), 'plan': plan.report()}
+
+    def setPstate(self, index, selection=None, **fields):
+        return self._apply({'pstates': {str(index): fields}}, selection=selection)
+
+    def setC6(self, selection=None, **fields):
+        return self._apply({'c6': fields}, selection=selection)
+
+    def setOc(self, **fields):
+        return self._apply({'oc': fields})
+
+    def setLimits(self, **limits):
+        return self._apply({'limits': limits})
+
+    def applyProfile(self, profile, dryrun=False, selection=None):
+        return self._apply(profile, dryrun, selection)
+
+    # Run the regular command line in the daemon, returns what it printed
+    def cli(self, argv):
+        _clicheck(argv)
+        out = io.StringIO()
+        self.stdout.capture(out)
+        try:
+            zs.main(list(argv) + ['--no-gui'])
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                print(e.code)
+        finally:
+            self.stdout.capture(None)
+        return out.getvalue()
+
+    def call(self, method, params):
+        if method in self.READ:
+            return getattr(self, method)(**params)
+        if method in self.WRITE:
+            with self.writelock:
+                return getattr(self, method)(**params)
+        raise ValueError('Unknown method %r' % method)
+
+
+# One JSON object per line in both directions:
+#   -> {"id": 1, "method": "setLimits", "params": {"ppt": 142}}
+#   <- {"id": 1, "result": {...}} or {"id": 1, "error": "..."}
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = {}
+            try:
+                request = json.loads(line)
+                reply['id'] = request.get('id')
+                reply['result'] = self.server.service.call(request['method'], request.get('params') or {})
+            except Exception as e:
+                reply['error'] = '%s: %s' % (type(e).__name__, e)
+            self.wfile.write(json.dumps(reply, separators=(',', ':')).encode() + b'\n')
+            self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path=SOCKET_PATH, service=None):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.service = service or Service()
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+        os.chmod(path, 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def serve(path=SOCKET_PATH):
+    server = Server(path)
+    print('Listening on %s' % path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class Client(object):
+    def __init__(self, path=SOCKET_PATH):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+        self.nextid = 0
+
+    def call(self, method, **params):
+        self.nextid += 1
+        request = {'id': self.nextid, 'method': method, 'params': params}
+        self.file.write(json.dumps(request, separators=(',', ':')).encode() + b'\n')
+        self.file.flush()
+        reply = json.loads(self.file.readline())
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
@@ -0,0 +1,86 @@
+import time
+import subprocess
+
+import msrdev
+import topology
+import zenstates as zs
+
+COUNTER_MASK = 0xFFFFFFFF
+
+
+def energyUnit(cpu=0):
+    esu = zs.readmsr(zs.MSR_RAPL_PWR_UNIT, cpu) >> 8 & 0x1f
+    return 1.0 / (1 << esu)
+
+
+# Accumulates the RAPL core and package energy counters. Only one CPU per
+# physical core and per package is read, since SMT siblings share the
+# counters. sample() must run more often than the 32-bit counters wrap
+# (about once a minute is plenty).
+class Meter(object):
+    def __init__(self, cpulist=None):
+        topo = topology.get()
+        selected = None if cpulist is None else set(cpulist)
+        self.cores = {}
+        self.packages = {}
+        for c in topo.cpus:
+            if selected is not None and c.cpu not in selected:
+                continue
+            self.cores.setdefault((c.socket, c.core), c.cpu)
+            self.packages.setdefault(c.socket, c.cpu)
+        self.cpus = sorted(set(self.cores.values()) | set(self.packages.values()))
+        self.unit = energyUnit(self.cpus[0])
+        self.start = time.perf_counter()
+        self.last = self._read()
+        self.elapsed = 0.0
+        self.core_ticks = dict((key, 0) for key in self.cores)
+        self.package_ticks = dict((key, 0) for key in self.packages)
+
+    def _read(self):
+        rows = msrdev.readmanyall((zs.MSR_CORE_ENERGY_STAT, zs.MSR_PKG_ENERGY_STAT), self.cpus)
+        return dict(zip(self.cpus, rows))
+
+    def sample(self):
+        now = self._read()
+        last = self.last
+        for key, cpu in self.cores.items():
+            self.core_ticks[key] += (now[cpu][0] - last[cpu][0]) & COUNTER_MASK
+        for key, cpu in self.packages.items():
+            self.package_ticks[key] += (now[cpu][1] - last[cpu][1]) & COUNTER_MASK
+        self.last = now
+        self.elapsed = time.perf_counter() - self.start
+        return self
+
+    def coreJoules(self):
+        return dict((key, ticks * self.unit) for key, ticks in self.core_ticks.items())
+
+    def packageJoules(self):
+        return dict((key, ticks * self.unit) for key, ticks in self.package_ticks.items())
+
+    def report(self):
+        t = self.elapsed or 1e-9
+        lines = ['Elapsed: %.3f s' % self.elapsed]
+        for (socket, core), joules in sorted(self.coreJoules().items()):
+            lines.append('Socket %d core %d (CPU %d): %10.3f J %8.3f W' % (
+                socket, core, self.cores[(socket, core)], joules, joules / t))
+        total = 0.0
+        for socket, joules in sorted(self.packageJoules().items()):
+            total += joules
+            lines.append('Package %d: %10.3f J %8.3f W' % (socket, joules, joules / t))
+        lines.append('Total: %10.3f J %8.3f W' % (total, total / t))
+        return '\n'.join(lines)
+
+
+# Run argv to completion, sampling every `interval` seconds, returns the
+# meter and the exit status of the command
+def measure(argv, interval=1.0, cpulist=None):
+    meter = Meter(cpulist)
+    proc = subprocess.Popen(argv)
+    while True:
+        try:
+            status = proc.wait(interval)
+            break
+        except subprocess.TimeoutExpired:
+            meter.sample()
+    meter.sample()
+    return meter, status
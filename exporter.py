@@ -0,0 +1,191 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import smn
+import smu
+import msrdev
+import zenstates as zs
+
+# Registers read from every core in one task per scrape
+SCRAPE_MSRS = tuple(zs.PSTATES) + (zs.MSR_HW_PSTATE_STATUS, zs.MSR_PSTATE_STATUS, zs.MSR_CSTATE_CONFIG,
+                                   zs.MSR_PMGT_MISC)
+
+C6_CORE_MASK = (1 << 22) | (1 << 14) | (1 << 6)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _ratio(val):
+    did = val >> 8 & 0x3f
+    return 2.0 * (val & 0xff) / did if did else 0.0
+
+
+# Samples grouped by metric family, as the text format requires
+class Metrics(object):
+    def __init__(self):
+        self.families = {}
+
+    def add(self, name, kind, help, value, **labels):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = ('# HELP %s %s' % (name, help), '# TYPE %s %s' % (name, kind), [])
+        if labels:
+            label = ','.join('%s="%s"' % kv for kv in sorted(labels.items()))
+            family[2].append('%s{%s} %s' % (name, label, repr(float(value))))
+        else:
+            family[2].append('%s %s' % (name, repr(float(value))))
+
+    def text(self):
+        lines = []
+        for help, kind, samples in self.families.values():
+            lines.append(help)
+            lines.append(kind)
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+# One hardware snapshot per `interval`, rendered once and shared by every
+# scrape that arrives while it is fresh. Scrapes that find it stale wait
+# on the lock, and only the first of them collects.
+class Collector(object):
+    def __init__(self, interval=5.0, cpulist=None):
+        zs.detect()
+        self.interval = interval
+        self.cpus = list(msrdev.cpus() if cpulist is None else cpulist)
+        self.lock = threading.Lock()
+        self.body = None
+        self.collected = 0.0
+        self.collections = 0
+        self.collect_seconds = 0.0
+        self.last_collect = 0.0
+        self.scrapes = 0
+        self.cached = 0
+        self.pm_errors = 0
+        self.table = None
+        self.meter = None
+        self.sensors = []
+        try:
+            import thermal
+            self.sensors = [thermal.Sensor(node) for node in smn.nodes()]
+        except OSError:
+            pass
+        try:
+            import pmtable
+            self.table = pmtable.openTable()
+        except (OSError, ValueError, SystemError, smu.SmuError):
+            pass
+        try:
+            import energy
+            self.meter = energy.Meter(self.cpus)
+        except (OSError, ValueError):
+            pass
+
+    def _collect(self):
+        m = Metrics()
+        rows = msrdev.readmanyall(SCRAPE_MSRS, self.cpus)
+        npstates = len(zs.PSTATES)
+        for cpu, row in zip(self.cpus, rows):
+            for p in range(npstates):
+                val = row[p]
+                m.add('zenstates_pstate_enabled', 'gauge', 'P-state enabled', val >> 63, cpu=cpu, pstate=p)
+                if val >> 63:
+                    m.add('zenstates_pstate_ratio', 'gauge', 'P-state core clock ratio', _ratio(val), cpu=cpu, pstate=p)
+                    m.add('zenstates_pstate_vid', 'gauge', 'P-state VID', val >> 14 & 0xff, cpu=cpu, pstate=p)
+                    m.add('zenstates_pstate_volts', 'gauge', 'P-state core voltage',
+                          zs.vidToVolts(val >> 14 & 0xff), cpu=cpu, pstate=p)
+            status, pstate, cstate, pmgt = row[npstates:]
+            m.add('zenstates_current_ratio', 'gauge', 'Current core clock ratio', _ratio(status), cpu=cpu)
+            m.add('zenstates_current_vid', 'gauge', 'Current core VID', status >> 14 & 0xff, cpu=cpu)
+            m.add('zenstates_current_volts', 'gauge', 'Current core voltage',
+                  zs.vidToVolts(status >> 14 & 0xff), cpu=cpu)
+            m.add('zenstates_current_pstate', 'gauge', 'Current P-state', pstate & 0x7, cpu=cpu)
+            m.add('zenstates_c6_core_enabled', 'gauge', 'C6 core state enabled',
+                  cstate & C6_CORE_MASK == C6_CORE_MASK, cpu=cpu)
+            m.add('zenstates_c6_package_enabled', 'gauge', 'C6 package state enabled', pmgt >> 32 & 1, cpu=cpu)
+        values = {}
+        if self.table is not None:
+            # A failed transfer leaves the PM metrics out of this snapshot
+            try:
+                values = self.table.refresh().read()
+            except smu.SmuError:
+                self.pm_errors += 1
+        for name, value in values.items():
+            if isinstance(value, list):
+                for index, v in enumerate(value):
+                    m.add('zenstates_pm_table', 'gauge', 'SMU PM table field', v, field=name, index=index)
+            else:
+                m.add('zenstates_pm_table', 'gauge', 'SMU PM table field', value, field=name)
+        for sensor in self.sensors:
+            reading = sensor.read()
+            temps = [('tctl', reading.tctl), ('tdie', reading.tdie)]
+            temps.extend(('ccd%d' % i, temp) for i, temp in enumerate(reading.ccds))
+            for name, temp in temps:
+                m.add('zenstates_temperature_celsius', 'gauge', 'Die temperature', temp, node=sensor.node, sensor=name)
+        if self.meter is not None:
+            self.meter.sample()
+            for (socket, core), joules in self.meter.coreJoules().items():
+                m.add('zenstates_core_energy_joules_total', 'counter', 'Core energy used', joules,
+                      socket=socket, core=core)
+            for socket, joules in self.meter.packageJoules().items():
+                m.add('zenstates_package_energy_joules_total', 'counter', 'Package energy used', joules,
+                      socket=socket)
+        return m
+
+    def _self(self, m):
+        m.add('zenstates_exporter_collections_total', 'counter', 'Hardware snapshots taken', self.collections)
+        m.add('zenstates_exporter_collect_seconds_total', 'counter', 'Time spent taking snapshots',
+              self.collect_seconds)
+        m.add('zenstates_exporter_last_collect_seconds', 'gauge', 'Duration of the last snapshot', self.last_collect)
+        m.add('zenstates_exporter_scrapes_total', 'counter', 'Scrapes served', self.scrapes)
+        m.add('zenstates_exporter_pm_table_errors_total', 'counter', 'PM table transfers the SMU failed',
+              self.pm_errors)
+        m.add('zenstates_exporter_cached_scrapes_total', 'counter', 'Scrapes served from a shared snapshot',
+              self.cached)
+
+    def scrape(self):
+        with self.lock:
+            self.scrapes += 1
+            now = time.monotonic()
+            if self.body is None or now - self.collected >= self.interval:
+                start = time.perf_counter()
+                m = self._collect()
+                self.last_collect = time.perf_counter() - start
+                self.collect_seconds += self.last_collect
+                self.collections += 1
+                self.collected = now
+                self.body = m.text()
+            else:
+                self.cached += 1
+            m = Metrics()
+            self._self(m)
+            return self.body + m.text()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.collector.scrape().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(address='127.0.0.1', port=9432, interval=5.0, cpulist=None):
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    server.collector = Collector(interval, cpulist)
+    print('Serving metrics on http://%s:%d/metrics' % (address, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,198 @@
+import sys
+import json
+import time
+
+import msrdev
+import zenstates as zs
+
+# Defaults for every setting of a governor config file:
+#
+#   {"ppt": [65, 142], "tdc": [60, 95], "edc": [90, 140], "oc_frequency": [3600, 4300],
+#    "interval": 0.5, "source": "procstat"}
+#
+# A limit without bounds is left alone. Limits scale linearly with the
+# smoothed load; a new value is only sent once it moved by `hysteresis`
+# of its range, and never sooner than `min_write_interval` after the
+# previous SMU write.
+DEFAULTS = {
+    'interval': 0.5,
+    'alpha': 0.5,
+    'hysteresis': 0.1,
+    'min_write_interval': 2.0,
+    'step': 1,
+    'source': 'procstat',
+}
+
+# name -> (SMU command, scale from config units to SMU units)
+LIMITS = (
+    ('ppt', 'SMU_CMD_SET_PPT', 1000),
+    ('tdc', 'SMU_CMD_SET_TDC', 1000),
+    ('edc', 'SMU_CMD_SET_EDC', 1000),
+    ('oc_frequency', 'SMU_CMD_OC_FREQ_ALL_CORES', 1),
+)
+
+
+# Busy fraction of the selected CPUs between calls, from /proc/stat
+class ProcStatLoad(object):
+    def __init__(self, cpulist=None, path='/proc/stat'):
+        self.path = path
+        self.names = None if cpulist is None else set('cpu%d' % c for c in cpulist)
+        self.last = self._read()
+
+    def _read(self):
+        busy = total = 0
+        with open(self.path) as f:
+            for line in f:
+                if not line.startswith('cpu'):
+                    break
+                fields = line.split()
+                name = fields[0]
+                if (self.names is None and name != 'cpu') or (self.names is not None and name not in self.names):
+                    continue
+                values = [int(v) for v in fields[1:]]
+                idle = values[3] + (values[4] if len(values) > 4 else 0)
+                total += sum(values[:8])
+                busy += sum(values[:8]) - idle
+        return busy, total
+
+    def sample(self):
+        busy, total = self._read()
+        dbusy, dtotal = busy - self.last[0], total - self.last[1]
+        self.last = busy, total
+        return dbusy / dtotal if dtotal > 0 else 0.0
+
+
+# Busy fraction from MPERF, which only counts while a core is in C0
+class TelemetryLoad(object):
+    def __init__(self, cpulist=None):
+        self.cpus = list(msrdev.cpus() if cpulist is None else cpulist)
+        self.hz = zs.getRatio(zs.PSTATES[0]) * 100e6
+        self.last = self._read()
+
+    def _read(self):
+        return time.perf_counter(), msrdev.readall(zs.MSR_MPERF, self.cpus)
+
+    def sample(self):
+        now, mperf = self._read()
+        dt = now - self.last[0]
+        busy = sum(m - p for m, p in zip(mperf, self.last[1]))
+        self.last = now, mperf
+        if dt <= 0:
+            return 0.0
+        return min(busy / (self.hz * dt * len(self.cpus)), 1.0)
+
+
+class Governor(object):
+    def __init__(self, config, cpulist=None, log=None):
+        self.config = dict(DEFAULTS)
+        self.config.update(config)
+        zs.detect()
+        self.bounds = {}
+        for name, cmd, scale in LIMITS:
+            if name in self.config and getattr(zs, cmd):
+                low, high = self.config[name]
+                self.bounds[name] = (int(low), int(high))
+        if not self.bounds:
+            raise ValueError('No limit to govern')
+        source = self.config['source']
+        self.source = TelemetryLoad(cpulist) if source == 'telemetry' else ProcStatLoad(cpulist)
+        self.log = log
+        self.load = None
+        self.current = {}
+        self.lastwrite = None
+        # When each limit's target first moved away from its applied value
+        self.pending = {}
+
+    def target(self, name, load):
+        low, high = self.bounds[name]
+        step = self.config['step']
+        return int(round((low + (high - low) * load) / step) * step)
+
+    def _moved(self, name, value):
+        if name not in self.current:
+            return True
+        low, high = self.bounds[name]
+        return abs(value - self.current[name]) >= max(self.config['hysteresis'] * (high - low), 1)
+
+    # One control iteration: sample, decide, write. Returns the decision.
+    def step(self, now=None):
+        start = time.perf_counter()
+        now = start if now is None else now
+        raw = self.source.sample()
+        alpha = self.config['alpha']
+        self.load = raw if self.load is None else alpha * raw + (1 - alpha) * self.load
+        sampled = time.perf_counter()
+
+        changes = {}
+        for name in self.bounds:
+            value = self.target(name, self.load)
+            if self._moved(name, value):
+                changes[name] = value
+                self.pending.setdefault(name, now)
+            else:
+                self.pending.pop(name, None)
+
+        action = 'hold'
+        latency = None
+        if changes:
+            if self.lastwrite is not None and now - self.lastwrite < self.config['min_write_interval']:
+                action = 'ratelimited'
+            else:
+                action = 'write'
+        decided = time.perf_counter()
+
+        if action == 'write':
+            commands = []
+            for name, cmd, scale in LIMITS:
+                if name in changes:
+                    commands.append((getattr(zs, cmd), [changes[name] * scale]))
+            zs.smutransact(commands)
+            latency = max(now - self.pending[name] for name in changes)
+            for name in changes:
+                self.current[name] = changes[name]
+                self.pending.pop(name, None)
+            self.lastwrite = now
+        done = time.perf_counter()
+
+        record = {
+            't': time.time(),
+            'raw': round(raw, 4),
+            'load': round(self.load, 4),
+            'action': action,
+            'targets': changes,
+            'applied': dict(self.current),
+            'sample_us': round((sampled - start) * 1e6, 1),
+            'decide_us': round((decided - sampled) * 1e6, 1),
+            'write_us': round((done - decided) * 1e6, 1),
+            'reaction_s': None if latency is None else round(latency, 4),
+        }
+        if self.log is not None:
+            self.log.write(json.dumps(record, separators=(',', ':')))
+            self.log.write('\n')
+            self.log.flush()
+        return record
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def run(config, count=0, cpulist=None, log=sys.stdout):
+    gov = Governor(config, cpulist, log)
+    interval = gov.config['interval']
+    deadline = time.perf_counter()
+    n = 0
+    try:
+        while count <= 0 or n < count:
+            deadline += interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.perf_counter()
+            gov.step()
+            n += 1
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    return gov
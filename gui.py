@@ -0,0 +1,429 @@
+import time
+import threading
+from queue import SimpleQueue
+
+import PySimpleGUI as sg
+
+import smu
+import monitor
+import zenstates as zs
+
+# Spin events arriving faster than this are folded into one label update
+REFRESH_MS = 50
+
+EVENT_PROGRESS = '-APPLY-PROGRESS-'
+EVENT_DONE = '-APPLY-DONE-'
+EVENT_MONITOR = '-MONITOR-'
+
+
+# Runs hardware operations off the event loop, one at a time, reporting
+# back to the window through write_event_value
+class Worker(object):
+    def __init__(self, window):
+        self.window = window
+        self.queue = SimpleQueue()
+        self.busy = False
+        t = threading.Thread(target=self._run, name='gui-worker')
+        t.daemon = True
+        t.start()
+
+    def _run(self):
+        while True:
+            name, fn, args = self.queue.get()
+            error = None
+            try:
+                fn(*args)
+            except Exception as e:
+                error = str(e)
+            self.window.write_event_value(EVENT_DONE, (name, error))
+
+    def progress(self, msg):
+        self.window.write_event_value(EVENT_PROGRESS, msg)
+
+    def submit(self, name, fn, *args):
+        self.busy = True
+        self.queue.put((name, fn, args))
+
+
+# Live view of the machine. A sampler thread takes one batched per-core
+# sample (and the PM table) per interval and posts the label texts as
+# EVENT_MONITOR; the event loop only pushes the texts that changed to Tk.
+class MonitorView(object):
+    COLUMNS = 4
+    LIMITS = ('PPT', 'TDC', 'EDC')
+
+    def __init__(self):
+        self.monitor = monitor.Monitor(depth=2)
+        self.shown = {}
+        self.active = False
+        self.interval = 1.0
+        # A posted sample not shown yet, the sampler waits for it
+        self.pending = False
+        self.stop = threading.Event()
+        self.thread = None
+        self.table = None
+        try:
+            import pmtable
+            self.table = pmtable.openTable()
+        except (OSError, ValueError, SystemError, smu.SmuError):
+            pass
+
+    def layout(self):
+        rows = [
+            [sg.Text(' Refresh', size=(8, 1)),
+             sg.Spin(values=[x for x in range(100, 5001, 100)], initial_value=1000, size=(5, 1), key='monInterval'),
+             sg.Text('ms'),
+             sg.CBox('Pause', default=False, key='monPause')],
+            [sg.Text(' Ratio', size=(8, 1)), sg.Text('', size=(8, 1), key='monRatio'),
+             sg.Text(' VID', size=(6, 1)), sg.Text('', size=(16, 1), key='monVid')],
+        ]
+        if self.table is not None:
+            for name in self.LIMITS:
+                rows.append([sg.Text(' %s' % name, size=(8, 1)), sg.Text('', size=(24, 1), key='mon%s' % name)])
+        cores = []
+        cpus = self.monitor.cpus
+        for i in range(0, len(cpus), self.COLUMNS):
+            row = []
+            for cpu in cpus[i:i + self.COLUMNS]:
+                row += [sg.Text('CPU%d' % cpu, size=(6, 1)), sg.Text('', size=(9, 1), key='monCpu%d' % cpu)]
+            cores.append(row)
+        rows.append([sg.Column(cores, scrollable=True, vertical_scroll_only=True, size=(520, 160))])
+        return rows
+
+    # Called by the event loop with the current values: sample only while
+    # the tab is showing and not paused
+    def configure(self, values):
+        try:
+            self.interval = int(values.get('monInterval') or 1000) / 1000.0
+        except ValueError:
+            pass
+        self.active = values.get('-TABGROUP-') == '-TAB4-' and not values.get('monPause')
+
+    def start(self, window):
+        self.thread = threading.Thread(target=self._run, args=(window,), name='gui-monitor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, window):
+        last = 0.0
+        while not self.stop.wait(REFRESH_MS / 1000.0):
+            now = time.perf_counter()
+            if not self.active or self.pending or now - last < self.interval:
+                continue
+            last = now
+            try:
+                texts = self.sample()
+            except Exception as e:
+                texts = {'monRatio': 'error', 'monVid': str(e)}
+            self.pending = True
+            window.write_event_value(EVENT_MONITOR, texts)
+
+    # Runs on the sampler thread, returns {key: text}
+    def sample(self):
+        mon = self.monitor
+        rec = mon.record(mon.sample())
+        vid = rec['vid'][0]
+        texts = {
+            'monRatio': '%.2f' % rec['ratio'][0],
+            'monVid': '%X - %.5f V' % (vid, zs.vidToVolts(vid)),
+        }
+        for cpu, mhz in zip(rec['cpu'], rec['mhz']):
+            texts['monCpu%d' % cpu] = '%.0f MHz' % mhz if mhz else '-'
+        if self.table is not None:
+            try:
+                values = self.table.refresh().read()
+            except smu.SmuError:
+                values = {}
+            for name in self.LIMITS:
+                limit, value = values.get(name + '_LIMIT'), values.get(name + '_VALUE')
+                texts['mon%s' % name] = '%.1f / %.1f' % (value, limit) if limit is not None else 'n/a'
+        return texts
+
+    def show(self, window, texts):
+        self.pending = False
+        for key, text in texts.items():
+            if self.shown.get(key) != text:
+                self.shown[key] = text
+                window[key].update(text)
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.table is not None:
+            self.table.close()
+
+
+def run():
+    zs.detect()
+
+    _oc_mode = zs.getOcMode()
+    if _oc_mode:
+        _default_vid = zs.getCurrentVid()
+        _ratio = zs.getRatio(zs.MSR_HW_PSTATE_STATUS)
+    else:
+        _default_vid = zs.getPstateVid(0)
+        _ratio = zs.getRatio(zs.PSTATES[0])
+
+    _current_freq = int(_ratio * 100)
+
+    #sg.theme('Dark Teal 9')
+    sg.set_options(icon='icon.png', element_padding=(5, 5), margins=(1, 1), border_width=0)
+
+    # The tab 1, 2, 3 layouts - what goes inside the tab
+    tab1_layout = [
+        [sg.CBox('OC Mode', default=_oc_mode, key='ocMode', enable_events=True)],
+        [
+            sg.Text(' All Core Frequency', size=(18, 1)),
+            sg.Spin(
+                values=[x for x in range(550, 7000, 25)],
+                initial_value=_current_freq,
+                enable_events=True,
+                disabled=not _oc_mode,
+                size=(5, 1),
+                key='cpuOcFrequency'),
+            sg.Text('MHz'),
+        ],
+        [
+            sg.Text(' Overclock VID', size=(18, 1)),
+            sg.Spin(
+                values=[x for x in range(zs.VID_MAX, zs.VID_MIN, -1)],
+                initial_value=_default_vid,
+                enable_events=True,
+                disabled=not _oc_mode,
+                size=(5, 1),
+                key='cpuOcVid'),
+            sg.Text("%.5f V" % zs.vidToVolts(_default_vid), key='cpuOcVoltageText'),
+        ],
+    ]
+
+    tab2_layout = [
+        [   
+            sg.Text('', size=(8, 1)),
+            sg.Text('FID', size=(6, 1)),
+            sg.Text('DID', size=(6, 1)),
+            sg.Text('VID', size=(6, 1))
+        ]
+    ]
+    for p in range(0, 3):
+        state = zs.readmsr(zs.PSTATES[p])
+        d = zs.getPstateDetails(state)
+        tab2_layout.append([
+            sg.Text(' P-State%s' % str(p), size=(8, 1)),
+            sg.Spin(
+                values=[x for x in range(zs.FID_MIN, zs.FID_MAX, 1)],
+                initial_value=d[0],
+                enable_events=True,
+                size=(5, 1),
+                key='pstate%sFid' % str(p)
+            ),
+            sg.Spin(
+                values=[x for x in range(zs.DID_MAX, zs.DID_MIN - 1, -2)],
+                initial_value=d[1],
+                enable_events=True,
+                size=(5, 1),
+                key='pstate%sDid' % str(p)
+            ),
+            sg.Spin(
+                values=[x for x in range(zs.VID_MAX, zs.VID_MIN - 1, -1)],
+                initial_value=d[2],
+                enable_events=True,
+                size=(5, 1),
+                key='pstate%sVid' % str(p)
+            ),
+            sg.Text(zs.pstateToGuiString(d[0], d[1], d[2]), key='pstateDetails%s' % str(p))
+        ])
+
+    tab3_layout = [
+        [sg.Text('C6 States')],
+        [sg.CBox(
+            'C6-State Package',
+            default=zs.getC6package(),
+            enable_events=True,
+            key='c6StatePackage')
+        ],
+        [sg.CBox(
+            'C6-State Core',
+            default=zs.getC6core(),
+            enable_events=True,
+            key='c6StateCore')
+        ],
+        [sg.Text('Experimental')],
+        [
+            sg.Text(' PPT', size=(6, 1)),
+            sg.Spin(
+                values=[x for x in range(-1, 1000, 1)],
+                initial_value=-1,
+                enable_events=True,
+                disabled=False,
+                size=(5, 1),
+                key='ppt'),
+            sg.Text('W', size=(4, 1)),
+            sg.Text(' TDC', size=(6, 1)),
+            sg.Spin(
+                values=[x for x in range(-1, 1000, 1)],
+                initial_value=-1,
+                enable_events=True,
+                disabled=False,
+                size=(5, 1),
+                key='tdc'),
+            sg.Text('A', size=(4, 1)),
+        ],
+        [
+            sg.Text(' EDC', size=(6, 1)),
+            sg.Spin(
+                values=[x for x in range(-1, 1000, 1)],
+                initial_value=-1,
+                enable_events=True,
+                disabled=False,
+                size=(5, 1),
+                key='edc'),
+            sg.Text('A', size=(4, 1)),
+            sg.Text(' Scalar', size=(6, 1)),
+            sg.Spin(
+                values=[x for x in range(0, 10, 1)],
+                initial_value=0,
+                enable_events=True,
+                disabled=True,
+                size=(5, 1),
+                key='scalar')
+        ],
+        [sg.Text(' * -1 = Auto / No change')]
+    ]
+
+    view = MonitorView()
+    tab4_layout = view.layout()
+
+    # The TabgGroup layout - it must contain only Tabs
+    if zs.isOcFreqSupported:
+        tab_group_layout = [
+            [
+                sg.Tab('CPU', tab1_layout, key='-TAB1-'),
+                sg.Tab('P-States', tab2_layout, key='-TAB2-'),
+                sg.Tab('Power', tab3_layout, key='-TAB3-'),
+                sg.Tab('Monitor', tab4_layout, key='-TAB4-')
+            ]
+        ]
+    else:
+        tab_group_layout = [
+            [
+                sg.Tab('P-States', tab2_layout, key='-TAB2-'),
+                sg.Tab('Power', tab3_layout, key='-TAB3-'),
+                sg.Tab('Monitor', tab4_layout, key='-TAB4-')
+            ]
+        ]
+
+    # The window layout - defines the entire window
+    layout = [
+        [sg.TabGroup(tab_group_layout,
+                     # selected_title_color='blue',
+                     # selected_background_color='red',
+                     # tab_background_color='green',
+                     enable_events=True,
+                     # font='Courier 18',
+                     key='-TABGROUP-')],
+        [sg.Button('Apply', key='applyBtn'), sg.Button('Cancel'), sg.Text('', size=(40, 1), key='status')]
+    ]
+
+    def applyCpuSettings(values):
+        worker.progress('Applying CPU settings')
+        if values['ocMode']:
+            zs.smutransact([
+                (zs.SMU_CMD_OC_ENABLE, [0]),
+                (zs.SMU_CMD_OC_FREQ_ALL_CORES, [values['cpuOcFrequency']]),
+                (zs.SMU_CMD_OC_VID, [values['cpuOcVid']]),
+            ])
+        else:
+            zs.writesmu(zs.SMU_CMD_OC_DISABLE)
+
+
+    def applyPstatesSettings(values):
+        for p in range(0, 3):
+            worker.progress('Applying P-State%d' % p)
+            zs.setPstateGui(p, values['pstate%sFid' % str(p)], values['pstate%sDid' % str(p)], values['pstate%sVid' % str(p)])
+
+
+    def applyPowerSettings(values):
+        worker.progress('Applying C6 states')
+        zs.setC6Core(values['c6StateCore'])
+        zs.setC6Package(values['c6StatePackage'])
+        worker.progress('Applying power limits')
+        zs.setPboLimits(values['ppt'], values['tdc'], values['edc'], values['scalar'])
+
+
+    def updatePstateLabels(values, pstates):
+        for p in pstates:
+            window['pstateDetails%s' % str(p)].update(
+                zs.pstateToGuiString(
+                    values['pstate%sFid' % str(p)],
+                    values['pstate%sDid' % str(p)],
+                    values['pstate%sVid' % str(p)]
+                )
+            )
+
+    window_title = "%s v%s" % (zs.APP_NAME, zs.APP_VERSION)
+    window = sg.Window(window_title, layout, finalize=True)
+    worker = Worker(window)
+    view.start(window)
+    print('GUI: %s initialized' % window_title)
+
+    # P-States whose labels are out of date, flushed once per refresh tick
+    dirty = set()
+    last_refresh = 0.0
+
+    while True:     # Event Loop
+        event, values = window.read(timeout=REFRESH_MS)
+        # print(event)
+        # print(values)
+
+        # Cancel or close event
+        if event in (None, 'Cancel'):
+            break
+
+        # Apply button events, run on the worker with a copy of the values
+        if event == 'applyBtn' and not worker.busy:
+            tab = values['-TABGROUP-']
+            apply = None
+            if tab == '-TAB1-' and zs.isOcFreqSupported:
+                apply = applyCpuSettings
+            elif tab == '-TAB2-':
+                apply = applyPstatesSettings
+            elif tab == '-TAB3-':
+                apply = applyPowerSettings
+            if apply is not None:
+                window['applyBtn'].update(disabled=True)
+                worker.submit(tab, apply, dict(values))
+
+        if event == EVENT_PROGRESS:
+            window['status'].update(values[EVENT_PROGRESS])
+        if event == EVENT_DONE:
+            worker.busy = False
+            name, error = values[EVENT_DONE]
+            window['status'].update('Error: %s' % error if error else 'Done')
+            window['applyBtn'].update(disabled=False)
+
+        # UI elements state change
+        if event == 'ocMode':
+            window['cpuOcFrequency'].update(disabled=(not values['ocMode']))
+            window['cpuOcVid'].update(disabled=(not values['ocMode']))
+        if event == 'cpuOcVid':
+            dirty.add('vid')
+
+        for p in range(0, 3):
+            if event in ['pstate%sFid' % str(p), 'pstate%sDid' % str(p), 'pstate%sVid' % str(p)]:
+                dirty.add(p)
+
+        now = time.perf_counter()
+        if dirty and (event == sg.TIMEOUT_KEY or now - last_refresh >= REFRESH_MS / 1000.0):
+            if 'vid' in dirty:
+                window['cpuOcVoltageText'].update("%.5f V" % zs.vidToVolts(values['cpuOcVid']))
+                dirty.discard('vid')
+            updatePstateLabels(values, dirty)
+            dirty.clear()
+            last_refresh = now
+
+        if event == EVENT_MONITOR:
+            view.show(window, values[EVENT_MONITOR])
+        view.configure(values)
+    view.close()
+    window.close()
@@ -0,0 +1,113 @@
+import sys
+import json
+import time
+from array import array
+
+import msrdev
+import zenstates as zs
+
+# Per-core registers read in one task on each core's MSR worker
+SAMPLE_MSRS = (zs.MSR_APERF, zs.MSR_MPERF, zs.MSR_HW_PSTATE_STATUS, zs.MSR_PSTATE_STATUS)
+
+
+def decodeRatio(val):
+    did = val >> 8 & 0x3f
+    return 2.0 * (val & 0xff) / did if did else 0.0
+
+
+# Samples every core into a preallocated ring buffer of `depth` samples.
+# Each field is a flat array indexed by slot * ncpus + core.
+class Monitor(object):
+    def __init__(self, cpulist=None, depth=256):
+        self.cpus = list(msrdev.cpus() if cpulist is None else cpulist)
+        self.depth = depth
+        n = len(self.cpus) * depth
+        self.time = array('d', bytes(8 * depth))
+        self.aperf = array('Q', bytes(8 * n))
+        self.mperf = array('Q', bytes(8 * n))
+        self.mhz = array('d', bytes(8 * n))
+        self.status = array('Q', bytes(8 * n))
+        self.pstate = array('B', bytes(n))
+        self.count = 0
+        self.last = None
+        # MPERF counts at the P0 frequency
+        self.p0mhz = zs.getRatio(zs.PSTATES[0]) * 100
+
+    def _span(self, index):
+        slot = index % self.depth
+        n = len(self.cpus)
+        return slot, slot * n, slot * n + n
+
+    def sample(self):
+        rows = msrdev.readmanyall(SAMPLE_MSRS, self.cpus)
+        slot, start, end = self._span(self.count)
+        self.time[slot] = time.time()
+        aperf, mperf, status, pstate = zip(*rows)
+        self.aperf[start:end] = array('Q', aperf)
+        self.mperf[start:end] = array('Q', mperf)
+        self.status[start:end] = array('Q', status)
+        self.pstate[start:end] = array('B', [p & 0x7 for p in pstate])
+        # Effective clock of every core since the previous sample, from the
+        # APERF/MPERF deltas of the two sets of rows in one pass
+        last = self.last
+        if last is not None:
+            p0 = self.p0mhz
+            self.mhz[start:end] = array('d', [p0 * (a - pa) / (m - pm) if m != pm else 0.0
+                                              for (a, m, _, _), (pa, pm, _, _) in zip(rows, last)])
+        self.last = rows
+        self.count += 1
+        return self.count - 1
+
+    # Effective clock of every core between sample `index` and the one
+    # before it
+    def effectiveMhz(self, index):
+        if index < 1 or self.count - index >= self.depth:
+            return [0.0] * len(self.cpus)
+        _, start, end = self._span(index)
+        return self.mhz[start:end].tolist()
+
+    def record(self, index):
+        slot, start, end = self._span(index)
+        status = self.status[start:end]
+        return {
+            't': self.time[slot],
+            'cpu': self.cpus,
+            'mhz': [round(f, 1) for f in self.effectiveMhz(index)],
+            'ratio': [decodeRatio(s) for s in status],
+            'vid': [s >> 14 & 0xff for s in status],
+            'pstate': self.pstate[start:end].tolist(),
+        }
+
+
+def writeNdjson(out, rec):
+    out.write(json.dumps(rec, separators=(',', ':')))
+    out.write('\n')
+
+
+def writeCsv(out, rec):
+    t = '%.6f' % rec['t']
+    out.write(''.join('%s,%d,%.1f,%.2f,%d,%d\n' % row for row in zip(
+        [t] * len(rec['cpu']), rec['cpu'], rec['mhz'], rec['ratio'], rec['vid'], rec['pstate'])))
+
+
+def run(rate=10.0, count=0, fmt='ndjson', cpulist=None, out=sys.stdout):
+    mon = Monitor(cpulist)
+    write = writeCsv if fmt == 'csv' else writeNdjson
+    if fmt == 'csv':
+        out.write('t,cpu,mhz,ratio,vid,pstate\n')
+    interval = 1.0 / rate
+    # The first sample only primes the APERF/MPERF deltas
+    mon.sample()
+    deadline = time.perf_counter()
+    try:
+        while count <= 0 or mon.count <= count:
+            deadline += interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.perf_counter()
+            write(out, mon.record(mon.sample()))
+            out.flush()
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
@@ -0,0 +1,187 @@
+import os
+import glob
+import struct
+import threading
+from functools import partial
+from queue import SimpleQueue
+
+MSR_DEV = '/dev/cpu/%d/msr'
+
+_Q = struct.Struct('Q')
+_fds = {}
+_lock = threading.Lock()
+_cpus = None
+_executor = None
+
+
+def cpus():
+    global _cpus
+    if _cpus is None:
+        paths = glob.glob(MSR_DEV.replace('%d', '[0-9]*'))
+        _cpus = sorted(int(p.split('/')[-2]) for p in paths)
+    return _cpus
+
+
+def _fd(cpu):
+    fd = _fds.get(cpu)
+    if fd is not None:
+        return fd
+    with _lock:
+        fd = _fds.get(cpu)
+        if fd is None:
+            try:
+                fd = os.open(MSR_DEV % cpu, os.O_RDWR)
+            except OSError:
+                raise OSError("msr module not loaded (run modprobe msr)")
+            _fds[cpu] = fd
+    return fd
+
+
+def read(msr, cpu=0):
+    return _Q.unpack(os.pread(_fd(cpu), 8, msr))[0]
+
+
+def write(msr, val, cpu=-1):
+    if cpu == -1:
+        writeall(msr, val)
+    else:
+        os.pwrite(_fd(cpu), _Q.pack(val), msr)
+
+
+def update(msr, cpu, setmask=0, clearmask=0):
+    old = read(msr, cpu)
+    new = (old & ~clearmask) | setmask
+    if new != old:
+        write(msr, new, cpu)
+    return old
+
+
+def readmany(msrs, cpu=0):
+    fd = _fd(cpu)
+    return tuple(_Q.unpack(os.pread(fd, 8, msr))[0] for msr in msrs)
+
+
+# One worker thread per logical CPU, pinned to it, so that MSR accesses
+# run on the target core instead of costing the kernel a cross-CPU IPI
+class Executor(object):
+    def __init__(self, cpulist=None):
+        self.cpus = list(cpus() if cpulist is None else cpulist)
+        self.queues = {}
+        for cpu in self.cpus:
+            q = self.queues[cpu] = SimpleQueue()
+            t = threading.Thread(target=self._worker, args=(cpu, q), name='msr%d' % cpu)
+            t.daemon = True
+            t.start()
+
+    @staticmethod
+    def _worker(cpu, q):
+        try:
+            os.sched_setaffinity(0, [cpu])
+        except OSError:
+            pass
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            fn, args, done = item
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                done(None, e)
+            else:
+                done(result, None)
+
+    def submit(self, cpu, fn, *args):
+        from concurrent.futures import Future
+        future = Future()
+        def done(result, error):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        self.queues[cpu].put((fn, args, done))
+        return future
+
+    # Run fn(*args, cpu) on each of the given CPUs concurrently, results
+    # are returned in the order of the CPU list. The whole batch is one
+    # wait for the caller rather than a Future per CPU.
+    def map(self, fn, args=(), cpulist=None):
+        cpulist = self.cpus if cpulist is None else cpulist
+        batch = _Batch(len(cpulist))
+        args = tuple(args)
+        queues = self.queues
+        for i, cpu in enumerate(cpulist):
+            queues[cpu].put((fn, args + (cpu,), partial(batch.done, i)))
+        return batch.wait()
+
+    def shutdown(self):
+        for q in self.queues.values():
+            q.put(None)
+        self.queues = {}
+
+
+# Results of one Executor.map(): each worker fills its slot and the last
+# one wakes the caller. The error of the first CPU in list order is raised.
+class _Batch(object):
+    def __init__(self, count):
+        self.results = [None] * count
+        self.errors = {}
+        self.pending = count
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not count:
+            self.finished.set()
+
+    def done(self, i, result, error):
+        if error is not None:
+            self.errors[i] = error
+        else:
+            self.results[i] = result
+        with self.lock:
+            self.pending -= 1
+            if not self.pending:
+                self.finished.set()
+
+    def wait(self):
+        self.finished.wait()
+        if self.errors:
+            raise self.errors[min(self.errors)]
+        return self.results
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = Executor()
+    return _executor
+
+
+def readall(msr, cpulist=None):
+    return executor().map(read, (msr,), cpulist)
+
+
+def readmanyall(msrs, cpulist=None):
+    return executor().map(readmany, (msrs,), cpulist)
+
+
+def writeall(msr, val, cpulist=None):
+    executor().map(write, (msr, val), cpulist)
+
+
+# Read-modify-write msr on every CPU, returns the previous values
+def updateall(msr, setmask=0, clearmask=0, cpulist=None):
+    return executor().map(lambda cpu: update(msr, cpu, setmask, clearmask), (), cpulist)
+
+
+def close():
+    global _cpus, _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+        for fd in _fds.values():
+            os.close(fd)
+        _fds.clear()
+        _cpus = None
@@ -0,0 +1,141 @@
+import os
+import mmap
+
+import smu
+import zenstates as zs
+
+# Per-version layout of the SMU PM table: total size in bytes and the
+# float32 fields we know about, as name -> (byte offset, count)
+_MATISSE_FIELDS = {
+    'PPT_LIMIT': (0x000, 1),
+    'PPT_VALUE': (0x004, 1),
+    'TDC_LIMIT': (0x008, 1),
+    'TDC_VALUE': (0x00C, 1),
+    'THM_LIMIT': (0x010, 1),
+    'THM_VALUE': (0x014, 1),
+    'FIT_LIMIT': (0x018, 1),
+    'FIT_VALUE': (0x01C, 1),
+    'EDC_LIMIT': (0x020, 1),
+    'EDC_VALUE': (0x024, 1),
+    'VID_LIMIT': (0x028, 1),
+    'VID_VALUE': (0x02C, 1),
+}
+
+# Per-core blocks of the desktop Matisse tables, 16 cores each
+MATISSE_CORES = 16
+_MATISSE_CORE_FIELDS = dict(_MATISSE_FIELDS, **{
+    'CORE_POWER': (0x24C, MATISSE_CORES),
+    'CORE_VOLTAGE': (0x28C, MATISSE_CORES),
+    'CORE_TEMP': (0x2CC, MATISSE_CORES),
+    'CORE_FIT': (0x30C, MATISSE_CORES),
+    'CORE_IDDMAX': (0x34C, MATISSE_CORES),
+    'CORE_FREQ': (0x38C, MATISSE_CORES),
+    'CORE_FREQEFF': (0x3CC, MATISSE_CORES),
+    'CORE_C0': (0x40C, MATISSE_CORES),
+    'CORE_CC1': (0x44C, MATISSE_CORES),
+    'CORE_CC6': (0x48C, MATISSE_CORES),
+})
+
+_RENOIR_FIELDS = {
+    'STAPM_LIMIT': (0x000, 1),
+    'STAPM_VALUE': (0x004, 1),
+    'PPT_LIMIT_FAST': (0x008, 1),
+    'PPT_VALUE_FAST': (0x00C, 1),
+    'PPT_LIMIT_SLOW': (0x010, 1),
+    'PPT_VALUE_SLOW': (0x014, 1),
+}
+
+LAYOUTS = {
+    0x240902: (0x514, _MATISSE_CORE_FIELDS),
+    0x240903: (0x518, _MATISSE_CORE_FIELDS),
+    0x240802: (0x7E0, _MATISSE_FIELDS),
+    0x240803: (0x7E4, _MATISSE_FIELDS),
+    0x370000: (0x794, _RENOIR_FIELDS),
+    0x370001: (0x884, _RENOIR_FIELDS),
+    0x370002: (0x88C, _RENOIR_FIELDS),
+    0x370003: (0x8AC, _RENOIR_FIELDS),
+    0x370004: (0x8AC, _RENOIR_FIELDS),
+    0x370005: (0x8C8, _RENOIR_FIELDS),
+}
+
+
+class PmTable(object):
+    # addr/version default to what the SMU reports. Any file can stand in
+    # for /dev/mem, with addr as the offset of the table inside it.
+    def __init__(self, addr=None, version=None, path='/dev/mem', transfer=True):
+        if addr is None or version is None:
+            addr, version = zs.getPmTableInfo()
+        if version not in LAYOUTS:
+            raise ValueError('Unsupported PM table version 0x%X' % version)
+        self.addr = addr
+        self.version = version
+        self.size, fields = LAYOUTS[version]
+        self.fields = dict((name, (offset // 4, count)) for name, (offset, count) in fields.items())
+        self.transfer = transfer and path == '/dev/mem'
+
+        start = addr & ~(mmap.PAGESIZE - 1)
+        delta = addr - start
+        fd = os.open(path, os.O_RDONLY | os.O_SYNC)
+        try:
+            self.map = mmap.mmap(fd, delta + self.size, mmap.MAP_SHARED, mmap.PROT_READ, offset=start)
+        finally:
+            os.close(fd)
+        self.view = memoryview(self.map)[delta:delta + self.size].cast('f')
+
+    # Ask the SMU to copy its current metrics into the table, a failed
+    # transfer raises its SmuError rather than leaving stale values
+    def refresh(self):
+        if self.transfer:
+            r = zs.smutransact([(zs.SMU_CMD_TRANSFER_TABLE, [0])])[0]
+            if r.error:
+                raise r.error
+        return self
+
+    def __getitem__(self, name):
+        index, count = self.fields[name]
+        if count == 1:
+            return self.view[index]
+        return self.view[index:index + count]
+
+    def read(self, names=None):
+        view = self.view
+        out = {}
+        for name in names or self.fields:
+            index, count = self.fields[name]
+            out[name] = view[index] if count == 1 else view[index:index + count].tolist()
+        return out
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+
+# PM table exported by the ryzen_smu driver: the driver refreshes the table
+# on every read, which lands in a preallocated buffer
+class DriverPmTable(PmTable):
+    def __init__(self, root=None):
+        addr, version = zs.getPmTableInfo()
+        if version not in LAYOUTS:
+            raise ValueError('Unsupported PM table version 0x%X' % version)
+        self.addr = addr
+        self.version = version
+        self.size, fields = LAYOUTS[version]
+        self.fields = dict((name, (offset // 4, count)) for name, (offset, count) in fields.items())
+        self.fd = os.open(os.path.join(root or smu.RYZEN_SMU_DRV, 'pm_table'), os.O_RDONLY)
+        self.buffer = bytearray(self.size)
+        self.view = memoryview(self.buffer).cast('f')
+
+    def refresh(self):
+        os.preadv(self.fd, [self.buffer], 0)
+        return self
+
+    def close(self):
+        self.view.release()
+        os.close(self.fd)
+
+
+def openTable():
+    zs.detect()
+    if zs.usingRyzenSmu():
+        return DriverPmTable()
+    return PmTable()
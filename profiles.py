@@ -0,0 +1,246 @@
+import json
+
+import msrdev
+import smu
+import zenstates as zs
+
+# Registers read from every core in one task on its MSR worker
+STATE_MSRS = tuple(zs.PSTATES) + (zs.MSR_HWCR, zs.MSR_CSTATE_CONFIG, zs.MSR_PMGT_MISC, zs.MSR_HW_PSTATE_STATUS)
+
+C6_CORE_MASK = (1 << 22) | (1 << 14) | (1 << 6)
+C6_PACKAGE_MASK = 1 << 32
+TSC_LOCK_MASK = 1 << 21
+
+LIMITS = (('ppt', zs.SMU_CMD_SET_PPT, 'PPT_LIMIT'), ('tdc', zs.SMU_CMD_SET_TDC, 'TDC_LIMIT'),
+          ('edc', zs.SMU_CMD_SET_EDC, 'EDC_LIMIT'))
+
+
+def _int(val):
+    if isinstance(val, str):
+        return int(val, 0)
+    return int(val)
+
+
+# Same bounds as the command line: high is excluded
+def _check(name, val, low, high):
+    if val not in range(low, high):
+        raise ValueError('%s 0x%X out of range [0x%X, 0x%X)' % (name, val, low, high))
+    return val
+
+
+# Desired machine state. Everything is optional, anything left out is
+# not touched:
+#
+#   {"pstates": {"0": {"fid": "0x88", "did": 8, "vid": "0x48", "enabled": true}},
+#    "c6": {"package": true, "core": true},
+#    "oc": {"enabled": true, "frequency": 4300, "vid": "0x48"},
+#    "limits": {"ppt": 142, "tdc": 95, "edc": 140}}
+class Profile(object):
+    def __init__(self, data):
+        self.pstates = {}
+        for p, fields in data.get('pstates', {}).items():
+            p = _check('P-state', int(p), 0, len(zs.PSTATES))
+            entry = {}
+            if 'fid' in fields:
+                entry['fid'] = _check('FID', _int(fields['fid']), zs.FID_MIN, zs.FID_MAX)
+            if 'did' in fields:
+                entry['did'] = _check('DID', _int(fields['did']), zs.DID_MIN, zs.DID_MAX)
+            if 'vid' in fields:
+                entry['vid'] = _check('VID', _int(fields['vid']), zs.VID_MIN, zs.VID_MAX)
+            if 'enabled' in fields:
+                entry['enabled'] = bool(fields['enabled'])
+            self.pstates[p] = entry
+        c6 = data.get('c6', {})
+        self.c6package = c6.get('package')
+        self.c6core = c6.get('core')
+        oc = data.get('oc', {})
+        self.oc = oc.get('enabled')
+        self.ocfrequency = _int(oc['frequency']) if 'frequency' in oc else None
+        self.ocvid = _check('OC VID', _int(oc['vid']), zs.VID_MIN, zs.VID_MAX) if 'vid' in oc else None
+        self.limits = dict((name, _int(val)) for name, val in data.get('limits', {}).items() if _int(val) > -1)
+        unknown = set(self.limits) - set(name for name, _, _ in LIMITS)
+        if unknown:
+            raise ValueError('Unknown limits: %s' % ', '.join(sorted(unknown)))
+
+
+def load(path):
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError('TOML profiles need Python 3.11+')
+        with open(path, 'rb') as f:
+            return Profile(tomllib.load(f))
+    with open(path) as f:
+        return Profile(json.load(f))
+
+
+# Current state of every core plus what can be read back from the SMU.
+# SMU values are None when this CPU has no way to read them, or when they
+# were not asked for. smureads counts every SMU command issued, per node.
+class State(object):
+    def __init__(self, cpulist=None, oc=True, limits=True):
+        zs.detect()
+        self.cpus = list(msrdev.cpus() if cpulist is None else cpulist)
+        self.msrs = dict(zip(self.cpus, (dict(zip(STATE_MSRS, row))
+                                         for row in msrdev.readmanyall(STATE_MSRS, self.cpus))))
+        self.smureads = 0
+        self.oc = None
+        self.limits = {}
+        if oc and zs.SMU_CMD_GET_PBO_SCALAR:
+            self.smureads += len(zs.smumailboxes())
+            try:
+                self.oc = zs.readsmu(zs.SMU_CMD_GET_PBO_SCALAR) == 0
+            except smu.SmuError:
+                pass
+        if limits:
+            self.limits = self._readlimits()
+
+    def _readlimits(self):
+        import pmtable
+        try:
+            if zs.usingRyzenSmu():
+                # The driver fetches the table itself on every read
+                table = pmtable.DriverPmTable()
+            else:
+                if not zs.SMU_CMD_GET_TABLE_BASE:
+                    return {}
+                # Table version and address, then the transfer
+                nodes = len(zs.smumailboxes())
+                self.smureads += 2 * nodes
+                addr, version = zs.getPmTableInfo()
+                table = pmtable.PmTable(addr, version)
+                self.smureads += nodes
+        except (OSError, ValueError, SystemError, smu.SmuError):
+            return {}
+        # Limits this table version does not carry stay unknown, so a
+        # profile that sets them always writes them
+        fields = [field for _, _, field in LIMITS if field in table.fields]
+        try:
+            values = table.refresh().read(fields) if fields else {}
+        except (OSError, smu.SmuError):
+            return {}
+        finally:
+            table.close()
+        return dict((name, int(round(values[field]))) for name, _, field in LIMITS if field in values)
+
+    def ocFrequency(self):
+        status = self.msrs[self.cpus[0]][zs.MSR_HW_PSTATE_STATUS]
+        fid, did = status & 0xff, status >> 8 & 0x3f
+        return int(round(200 * fid / did)) if did else 0
+
+    def ocVid(self):
+        return self.msrs[self.cpus[0]][zs.MSR_HW_PSTATE_STATUS] >> 14 & 0xff
+
+
+# The writes needed to go from a State to a Profile: per-core MSR writes,
+# in order, and one SMU session
+class Plan(object):
+    def __init__(self, profile, state):
+        self.state = state
+        self.msrwrites = {}
+        self.smucommands = []
+        for cpu in state.cpus:
+            writes = self._msrwrites(profile, state.msrs[cpu])
+            if writes:
+                self.msrwrites[cpu] = writes
+        self._smucommands(profile, state)
+
+    @staticmethod
+    def _msrwrites(profile, regs):
+        writes = []
+        for p, entry in sorted(profile.pstates.items()):
+            old = new = regs[zs.PSTATES[p]]
+            if 'fid' in entry:
+                new = zs.setfid(new, entry['fid'])
+            if 'did' in entry:
+                new = zs.setdid(new, entry['did'])
+            if 'vid' in entry:
+                new = zs.setvid(new, entry['vid'])
+            if 'enabled' in entry:
+                new = zs.setbits(new, 63, 1, int(entry['enabled']))
+            if new != old:
+                writes.append((zs.PSTATES[p], new))
+        # P-state changes need the TSC frequency locked first
+        hwcr = regs[zs.MSR_HWCR]
+        if writes and not hwcr & TSC_LOCK_MASK:
+            writes.insert(0, (zs.MSR_HWCR, hwcr | TSC_LOCK_MASK))
+        for enable, msr, mask in ((profile.c6core, zs.MSR_CSTATE_CONFIG, C6_CORE_MASK),
+                                  (profile.c6package, zs.MSR_PMGT_MISC, C6_PACKAGE_MASK)):
+            if enable is None:
+                continue
+            old = regs[msr]
+            new = old | mask if enable else old & ~mask
+            if new != old:
+                writes.append((msr, new))
+        return writes
+
+    def _smucommands(self, profile, state):
+        commands = self.smucommands
+        if profile.oc is False and state.oc is not False and zs.SMU_CMD_OC_DISABLE:
+            commands.append((zs.SMU_CMD_OC_DISABLE, [0]))
+        elif profile.oc:
+            if state.oc is not True and zs.SMU_CMD_OC_ENABLE:
+                commands.append((zs.SMU_CMD_OC_ENABLE, [0]))
+            if profile.ocfrequency is not None and (not state.oc or state.ocFrequency() != profile.ocfrequency):
+                commands.append((zs.SMU_CMD_OC_FREQ_ALL_CORES, [profile.ocfrequency]))
+            if profile.ocvid is not None and (not state.oc or state.ocVid() != profile.ocvid):
+                commands.append((zs.SMU_CMD_OC_VID, [profile.ocvid]))
+        for name, cmd, _ in LIMITS:
+            val = profile.limits.get(name)
+            if val is not None and state.limits.get(name) != val:
+                commands.append((cmd, [val * 1000]))
+
+    def msrtransactions(self):
+        return sum(len(w) for w in self.msrwrites.values())
+
+    def smutransactions(self):
+        return len(self.smucommands) * len(zs.smumailboxes())
+
+    def empty(self):
+        return not self.msrwrites and not self.smucommands
+
+    def report(self):
+        lines = []
+        # Group identical per-core write lists to keep the listing short
+        groups = {}
+        for cpu, writes in self.msrwrites.items():
+            groups.setdefault(tuple(writes), []).append(cpu)
+        for writes, cpus in groups.items():
+            for msr, val in writes:
+                lines.append('MSR 0x%08X <- 0x%016X on %d CPU(s): %s' % (
+                    msr, val, len(cpus), ','.join(str(c) for c in cpus)))
+        for cmd, args in self.smucommands:
+            lines.append('SMU 0x%X <- %s' % (cmd, ', '.join('0x%X' % a for a in args)))
+        lines.append('Reads: %d MSR, %d SMU' % (len(STATE_MSRS) * len(self.state.cpus), self.state.smureads))
+        lines.append('Writes: %d MSR, %d SMU' % (self.msrtransactions(), self.smutransactions()))
+        return '\n'.join(lines)
+
+    # With a thermal guard, nothing more is written once it tripped. An SMU
+    # command any node rejected raises its SmuError, the first in node order.
+    def execute(self, guard=None):
+        if guard is not None:
+            guard.check()
+        if self.msrwrites:
+            msrdev.executor().map(lambda cpu: [msrdev.write(msr, val, cpu) for msr, val in self.msrwrites[cpu]],
+                                  (), list(self.msrwrites))
+            for cpu, writes in self.msrwrites.items():
+                for msr, val in writes:
+                    zs.msrcache.put((cpu, msr), val)
+        if self.smucommands:
+            if guard is not None:
+                guard.check()
+            results = zs.smutransactall(self.smucommands)
+            for node in sorted(results):
+                for r in results[node]:
+                    if r.error:
+                        raise r.error
+
+
+# Only the SMU state the profile touches is read
+def apply(profile, dryrun=False, cpulist=None, guard=None):
+    oc = profile.oc is not None or profile.ocfrequency is not None or profile.ocvid is not None
+    plan = Plan(profile, State(cpulist, oc, bool(profile.limits)))
+    if not dryrun:
+        plan.execute(guard)
+    return plan
@@ -0,0 +1,59 @@
+import time
+import threading
+
+
+# Write-through cache of register values. Entries expire after `ttl`
+# seconds (0 disables caching), writes store the new value, invalidate()
+# drops entries explicitly.
+class RegisterCache(object):
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and now < entry[1]:
+            with self.lock:
+                self.hits += 1
+            return entry[0]
+        val = load()
+        with self.lock:
+            self.misses += 1
+            if self.ttl > 0:
+                self.entries[key] = (val, now + self.ttl)
+        return val
+
+    def put(self, key, val):
+        if self.ttl > 0:
+            with self.lock:
+                self.entries[key] = (val, time.monotonic() + self.ttl)
+
+    # Drop one key, every key matching `match(key)`, or everything
+    def invalidate(self, key=None, match=None):
+        with self.lock:
+            if key is not None:
+                self.entries.pop(key, None)
+            elif match is not None:
+                for k in [k for k in self.entries if match(k)]:
+                    del self.entries[k]
+            else:
+                self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitrate': self.hits / total if total else 0.0,
+            }
+
+    def resetstats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,380 @@
+import os
+import time
+import shutil
+import struct
+import tempfile
+import threading
+
+import cpuid
+import msrdev
+import smn
+import smu
+import pmtable
+import superio
+import thermal
+import topology
+import zenstates as zs
+
+# Simulated CPUs, one per branch of zenstates.detect():
+# name -> (CPUID Fn0000_0001 EAX, package type, PM table version)
+FAMILIES = {
+    'summitridge': (0x00800F11, 2, 0),
+    'naples': (0x00800F12, 4, 0),
+    'pinnacleridge': (0x00800F82, 2, 0),
+    'colfax': (0x00800F82, 7, 0),
+    'matisse': (0x00870F10, 2, 0x240903),
+    'rome': (0x00830F10, 4, 0x240903),
+    'ravenridge': (0x00810F10, 2, 0),
+    'picasso': (0x00810F81, 2, 0),
+    'renoir': (0x00860F01, 2, 0x370005),
+}
+
+# Default register contents: three enabled P-states (3.4/2.8/2.2 GHz),
+# C6 enabled
+DEFAULT_MSRS = {
+    zs.PSTATES[0]: (1 << 63) | (0x48 << 14) | (8 << 8) | 0x88,
+    zs.PSTATES[1]: (1 << 63) | (0x58 << 14) | (8 << 8) | 0x70,
+    zs.PSTATES[2]: (1 << 63) | (0x68 << 14) | (8 << 8) | 0x58,
+    zs.MSR_HWCR: 0,
+    zs.MSR_CSTATE_CONFIG: (1 << 22) | (1 << 14) | (1 << 6),
+    zs.MSR_PMGT_MISC: 1 << 32,
+    zs.MSR_HW_PSTATE_STATUS: (0x48 << 14) | (8 << 8) | 0x88,
+    zs.MSR_PSTATE_STATUS: 0,
+    zs.MSR_RAPL_PWR_UNIT: 0x000A1003, # 15.26 uJ energy unit
+    zs.MSR_CORE_ENERGY_STAT: 0,
+    zs.MSR_PKG_ENERGY_STAT: 0,
+}
+
+PM_TABLE_BASE = 0x1000
+
+# Die temperature and number of CCDs reporting theirs
+DEFAULT_TCTL = 45.0
+CCDS = {'matisse': 2, 'rome': 8}
+
+_Q = struct.Struct('Q')
+
+# The kernel's MSR device takes the register number as the file offset and
+# returns 8 bytes; the simulator's plain files need 8 bytes per register.
+# These replace msrdev's accessors while a Simulator is installed.
+MSR_SIZE = 8
+
+
+def msrRead(msr, cpu=0):
+    return _Q.unpack(os.pread(msrdev._fd(cpu), 8, msr * MSR_SIZE))[0]
+
+
+def msrWrite(msr, val, cpu=-1):
+    if cpu == -1:
+        msrdev.writeall(msr, val)
+    else:
+        os.pwrite(msrdev._fd(cpu), _Q.pack(val), msr * MSR_SIZE)
+
+
+def msrReadmany(msrs, cpu=0):
+    fd = msrdev._fd(cpu)
+    return tuple(_Q.unpack(os.pread(fd, 8, msr * MSR_SIZE))[0] for msr in msrs)
+
+
+def fakeCpuid(eax1, pkgtype):
+    leaves = {
+        0x00000000: (0x10, 0x68747541, 0x444D4163, 0x69746E65), # AuthenticAMD
+        0x00000001: (eax1, 0, 0, 0),
+        0x80000000: (0x80000020, 0x68747541, 0x444D4163, 0x69746E65),
+        0x80000001: (eax1, pkgtype << 28, 0, 0),
+    }
+    zero = (0, 0, 0, 0)
+    return lambda eax, ecx=0: leaves.get(eax, zero)
+
+
+# SMN register space of one node, with the SMU mailbox modeled: a write to
+# the command register completes `delay` seconds later, until then the
+# response register reads 0 (busy)
+class SimSmu(object):
+    def __init__(self, sim):
+        self.sim = sim
+        self.regs = {}
+        self.pending = None
+        self.ready = 0.0
+        self.commands = 0
+
+    def read(self, addr):
+        if addr == zs.SMU_RSP_ADDR and self.pending is not None:
+            if time.perf_counter() < self.ready:
+                return smu.SMU_RSP_BUSY
+            self.complete()
+        return self.regs.get(addr, 0)
+
+    def write(self, addr, value):
+        self.regs[addr] = value
+        if addr == zs.SMU_CMD_ADDR:
+            self.commands += 1
+            self.pending = value
+            delay = self.sim.delay(value) if callable(self.sim.delay) else self.sim.delay
+            self.ready = time.perf_counter() + delay
+
+    def complete(self):
+        cmd, self.pending = self.pending, None
+        base = zs.SMU_ARG_ADDR
+        args = [self.regs.get(base + 4 * i, 0) for i in range(smu.SMU_MAX_ARGS)]
+        rsp, args = self.sim.execute(cmd, args)
+        for i, arg in enumerate(args):
+            self.regs[base + 4 * i] = arg
+        self.regs[zs.SMU_RSP_ADDR] = rsp
+
+
+class SimPciConfig(object):
+    def __init__(self, sim, node):
+        self.space = sim.nodes[node]
+        self.config = {}
+
+    def read32(self, offset):
+        if offset == smn.SMN_DATA:
+            return self.space.read(self.config.get(smn.SMN_INDEX, 0))
+        return self.config.get(offset, 0)
+
+    def write32(self, offset, value):
+        if offset == smn.SMN_DATA:
+            self.space.write(self.config.get(smn.SMN_INDEX, 0), value)
+        else:
+            self.config[offset] = value
+
+    def close(self):
+        pass
+
+
+# The ryzen_smu driver on top of a fake sysfs tree: smu_args and rsmu_cmd
+# are plain files, and the write of a command plays the driver's part by
+# running it and storing the response and arguments back into them
+class SimRyzenSmuMailbox(smu.RyzenSmuMailbox):
+    def __init__(self, sim):
+        smu.RyzenSmuMailbox.__init__(self, sim.driver)
+        self.sim = sim
+        self.commands = 0
+
+    def _submit(self, cmd):
+        self.commands += 1
+        delay = self.sim.delay(cmd) if callable(self.sim.delay) else self.sim.delay
+        if delay:
+            time.sleep(delay)
+        args = list(smu._ARGS.unpack(os.pread(self.args_fd, smu._ARGS.size, 0)))
+        rsp, args = self.sim.execute(cmd, args)
+        os.pwrite(self.args_fd, smu._ARGS.pack(*args), 0)
+        os.pwrite(self.cmd_fd, smu._U32.pack(rsp), 0)
+        return smu._U32.unpack(os.pread(self.cmd_fd, 4, 0))[0]
+
+
+# An ITE IT8686E behind the superio port backend interface: the entry key
+# state machine, per-LDN configuration registers and the environment
+# controller at 0x290. Counts every port access.
+class SimSuperIo(object):
+    CHIP_ID = 0x8686
+    EC_BASE = 0x290
+
+    def __init__(self, index=superio.SIO_INDEX):
+        self.index = index
+        self.keyseq = []
+        self.entered = False
+        self.latch = 0
+        self.ldn = 0
+        self.config = {
+            superio.QCODE_LDN: {superio.QCODE_REG: 0x00},
+            superio.EC_LDN: {superio.REG_BASE: self.EC_BASE >> 8, superio.REG_BASE + 1: self.EC_BASE & 0xff},
+        }
+        self.ec = dict((reg, 0) for reg in range(0x100))
+        # 3 fans at 1000/1200/0 RPM, 40/35/-5 C, 1.2 V on every input
+        for i, rpm in enumerate((1000, 1200, 0)):
+            count = superio.EC_FAN_CLOCK // (rpm * 2) if rpm else 0
+            self.ec[superio.EC_FAN_LOW[i]] = count & 0xff
+            self.ec[superio.EC_FAN_HIGH[i]] = count >> 8
+        for reg, temp in zip(superio.EC_TEMPS, (40, 35, -5)):
+            self.ec[reg] = temp & 0xff
+        for reg in superio.EC_VOLTAGES:
+            self.ec[reg] = 100
+        self.eclatch = 0
+        self.accesses = 0
+
+    def _config(self, reg):
+        if reg == superio.REG_CHIP_ID:
+            return self.CHIP_ID >> 8
+        if reg == superio.REG_CHIP_ID + 1:
+            return self.CHIP_ID & 0xff
+        if reg == superio.REG_LDN:
+            return self.ldn
+        return self.config.setdefault(self.ldn, {}).get(reg, 0)
+
+    def inb(self, port):
+        self.accesses += 1
+        if port == self.index + 1:
+            return self._config(self.latch) if self.entered else 0xFF
+        if port == self.EC_BASE + superio.EC_DATA:
+            return self.ec[self.eclatch]
+        return 0xFF
+
+    def outb(self, value, port):
+        self.accesses += 1
+        if port == self.index:
+            if not self.entered:
+                self.keyseq = (self.keyseq + [value])[-4:]
+                self.entered = tuple(self.keyseq) == superio.ENTRY_KEYS['ite']
+            else:
+                self.latch = value
+        elif port == self.index + 1 and self.entered:
+            if self.latch == superio.REG_LDN:
+                self.ldn = value
+            elif self.latch == superio.ITE_REG_CONFIG_CTL and value & 0x02:
+                self.entered = False
+                self.keyseq = []
+            else:
+                self.config.setdefault(self.ldn, {})[self.latch] = value
+        elif port == self.EC_BASE + superio.EC_ADDR:
+            self.eclatch = value
+        elif port == self.EC_BASE + superio.EC_DATA:
+            self.ec[self.eclatch] = value
+
+    def close(self):
+        pass
+
+
+# In-memory/tmpfs stand-in for the hardware: one MSR file per CPU, a PCI
+# config space per socket with a modeled SMU, and a fake CPUID. With
+# backend='ryzen_smu' the SMU is reached through a fake ryzen_smu sysfs
+# tree instead. install() points msrdev, smn, smu, superio, cpuid and
+# zenstates at it.
+class Simulator(object):
+    def __init__(self, family='matisse', cpus=16, sockets=1, delay=0.0, unknown=(), root=None, backend='pci'):
+        self.eax1, self.pkgtype, self.pmversion = FAMILIES[family]
+        self.family = family
+        self.ncpus = cpus
+        self.sockets = sockets
+        self.delay = delay
+        self.unknown = set(unknown)
+        self.handlers = {}
+        self.root = root or tempfile.mkdtemp(prefix='zenstates-sim-')
+        self.nodes = {}
+        self.backend = backend
+        self.superio = SimSuperIo()
+        self.driver = os.path.join(self.root, 'ryzen_smu_drv')
+        self.saved = None
+        self.lock = threading.Lock()
+
+    def _mkpci(self):
+        pci = os.path.join(self.root, 'pci')
+        devices = []
+        for s in range(self.sockets):
+            devices.append(('0000:%02x:00.0' % (s * 0x80), 0x1480))
+            devices.append(('0000:00:%02x.3' % (0x18 + s), 0x1493))
+        for bdf, device in devices:
+            path = os.path.join(pci, bdf)
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, 'vendor'), 'w') as f:
+                f.write('0x%04x\n' % smn.PCI_VENDOR_AMD)
+            with open(os.path.join(path, 'device'), 'w') as f:
+                f.write('0x%04x\n' % device)
+            if device in smn.ROOT_IDS:
+                self.nodes[bdf] = SimSmu(self)
+        self.setTemperature(DEFAULT_TCTL)
+        return pci
+
+    # Tctl and, for the families that report them, every CCD at `ccds`
+    # (default: the same as Tctl) on every node
+    def setTemperature(self, tctl, ccds=None):
+        ccds = [tctl] * CCDS.get(self.family, 0) if ccds is None else ccds
+        for space in self.nodes.values():
+            space.regs[thermal.THM_TCON_CUR_TMP] = int(tctl * 8) << thermal.CUR_TEMP_SHIFT
+            for i, temp in enumerate(ccds):
+                raw = int((temp + thermal.RANGE_OFFSET) * 8) & thermal.CCD_TEMP_MASK
+                space.regs[thermal.THM_CCD_TEMP + 4 * i] = thermal.CCD_TEMP_VALID | raw
+
+    def _mkdriver(self):
+        os.makedirs(self.driver, exist_ok=True)
+        files = {
+            'version': b'SMU v46.54.0\n',
+            'drv_version': b'0.1.5\n',
+            'smu_args': smu._ARGS.pack(*[0] * smu.SMU_MAX_ARGS),
+            'rsmu_cmd': smu._U32.pack(smu.SMU_RSP_OK),
+            'pm_table_version': smu._U32.pack(self.pmversion),
+        }
+        if self.pmversion:
+            files['pm_table'] = bytes(pmtable.LAYOUTS[self.pmversion][0])
+        for name, data in files.items():
+            with open(os.path.join(self.driver, name), 'wb') as f:
+                f.write(data)
+
+    def execute(self, cmd, args):
+        handler = self.handlers.get(cmd)
+        if handler is not None:
+            return handler(args)
+        if cmd in self.unknown:
+            return smu.SMU_RSP_UNKNOWN_CMD, args
+        return smu.SMU_RSP_OK, args
+
+    # CPUs split evenly across sockets, four cores sharing each L3
+    def _mktopology(self):
+        percpu = max(self.ncpus // self.sockets, 1)
+        for cpu in range(self.ncpus):
+            path = os.path.join(self.root, 'sys', 'cpu%d' % cpu)
+            os.makedirs(os.path.join(path, 'topology'), exist_ok=True)
+            os.makedirs(os.path.join(path, 'cache', 'index3'), exist_ok=True)
+            first = cpu - cpu % 4
+            files = {
+                'topology/physical_package_id': cpu // percpu,
+                'topology/core_id': cpu % percpu,
+                'cache/index3/shared_cpu_list': '%d-%d' % (first, min(first + 3, self.ncpus - 1)),
+            }
+            for name, value in files.items():
+                with open(os.path.join(path, name), 'w') as f:
+                    f.write('%s\n' % value)
+        return os.path.join(self.root, 'sys')
+
+    def _mkmsr(self):
+        for cpu in range(self.ncpus):
+            path = os.path.join(self.root, 'cpu', str(cpu))
+            os.makedirs(path, exist_ok=True)
+            fd = os.open(os.path.join(path, 'msr'), os.O_RDWR | os.O_CREAT, 0o600)
+            for msr, val in DEFAULT_MSRS.items():
+                os.pwrite(fd, _Q.pack(val), msr * MSR_SIZE)
+            os.close(fd)
+        return os.path.join(self.root, 'cpu', '%d', 'msr')
+
+    def _pmtable(self):
+        if self.pmversion:
+            self.handlers[zs.SMU_CMD_GET_TABLE_VERSION] = lambda args: (smu.SMU_RSP_OK, [self.pmversion] + args[1:])
+            self.handlers[zs.SMU_CMD_GET_TABLE_BASE] = lambda args: (smu.SMU_RSP_OK, [PM_TABLE_BASE, 0] + args[2:])
+
+    def install(self):
+        self.saved = (msrdev.MSR_DEV, msrdev.read, msrdev.write, msrdev.readmany, smn.BACKEND, smn.PCI_DEVICES,
+                      smu.DRIVER, smu.RYZEN_SMU_DRV, zs.SMU_BACKEND, topology.SYSFS_CPU, superio.BACKEND)
+        msrdev.close()
+        smn.close()
+        msrdev.MSR_DEV = self._mkmsr()
+        msrdev.read, msrdev.write, msrdev.readmany = msrRead, msrWrite, msrReadmany
+        topology.SYSFS_CPU = self._mktopology()
+        superio.BACKEND = lambda: self.superio
+        smn.PCI_DEVICES = self._mkpci()
+        smn.BACKEND = lambda node: SimPciConfig(self, node)
+        if self.backend == 'ryzen_smu':
+            self._mkdriver()
+            smu.RYZEN_SMU_DRV = self.driver
+            smu.DRIVER = lambda: SimRyzenSmuMailbox(self)
+        zs.SMU_BACKEND = self.backend
+        cpuid.set_engine(fakeCpuid(self.eax1, self.pkgtype))
+        zs.reset()
+        zs.detect()
+        self._pmtable()
+        return self
+
+    def uninstall(self):
+        msrdev.close()
+        smn.close()
+        cpuid.set_engine(None)
+        zs.reset()
+        (msrdev.MSR_DEV, msrdev.read, msrdev.write, msrdev.readmany, smn.BACKEND, smn.PCI_DEVICES,
+         smu.DRIVER, smu.RYZEN_SMU_DRV, zs.SMU_BACKEND, topology.SYSFS_CPU, superio.BACKEND) = self.saved
+        topology.reset()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
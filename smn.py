@@ -0,0 +1,142 @@
+import os
+import glob
+import struct
+import threading
+from array import array
+
+PCI_DEVICES = '/sys/bus/pci/devices'
+PCI_CONFIG = PCI_DEVICES + '/%s/config'
+SMN_INDEX = 0xB8
+SMN_DATA = 0xBC
+
+PCI_VENDOR_AMD = 0x1022
+# Root complex device IDs: Zen/Zen+, Raven/Picasso, Matisse/Rome/Castle Peak, Renoir
+ROOT_IDS = (0x1450, 0x15D0, 0x1480, 0x1630)
+
+_L = struct.Struct('<I')
+_configs = {}
+_locks = {}
+_lock = threading.Lock()
+_nodes = None
+
+
+def _readhex(path):
+    with open(path) as f:
+        return int(f.read(), 16)
+
+
+def _isdfmisc(bdf):
+    # Data fabric function 3 sits at 00:18.3 + node
+    return bdf[5:8] == '00:' and 0x18 <= int(bdf[8:10], 16) <= 0x1F and bdf.endswith('.3')
+
+
+# SMU-bearing root complexes, one per node. Like the kernel's amd_nb, count
+# the nodes from the data fabric devices and pick every n-th root complex,
+# since Zen 2 has several root complexes per IO die.
+def nodes():
+    global _nodes
+    if _nodes is not None:
+        return _nodes
+    roots = []
+    dfs = 0
+    for path in sorted(glob.glob(os.path.join(PCI_DEVICES, '*'))):
+        bdf = os.path.basename(path)
+        try:
+            if _readhex(path + '/vendor') != PCI_VENDOR_AMD:
+                continue
+            device = _readhex(path + '/device')
+        except (OSError, ValueError):
+            continue
+        if bdf.endswith(':00.0') and device in ROOT_IDS:
+            roots.append(bdf)
+        elif _isdfmisc(bdf):
+            dfs += 1
+    if not roots:
+        roots = ['0000:00:00.0']
+    count = max(dfs, 1)
+    _nodes = roots[::max(len(roots) // count, 1)][:count]
+    return _nodes
+
+
+class PciConfig(object):
+    def __init__(self, node):
+        try:
+            self.fd = os.open(PCI_CONFIG % node, os.O_RDWR)
+        except OSError:
+            raise OSError("cannot open PCI config space of %s (run as root)" % node)
+
+    def read32(self, offset):
+        return _L.unpack(os.pread(self.fd, 4, offset))[0]
+
+    def write32(self, offset, value):
+        os.pwrite(self.fd, _L.pack(value), offset)
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Factory for the config space of a node, replaced by the simulator
+BACKEND = PciConfig
+
+
+def _open(node):
+    cfg = _configs.get(node)
+    if cfg is not None:
+        return cfg
+    with _lock:
+        cfg = _configs.get(node)
+        if cfg is None:
+            cfg = BACKEND(node)
+            _locks[node] = threading.Lock()
+            _configs[node] = cfg
+    return cfg
+
+
+def lock(node):
+    _open(node)
+    return _locks[node]
+
+
+def read(addr, node='0000:00:00.0'):
+    cfg = _open(node)
+    with _locks[node]:
+        cfg.write32(SMN_INDEX, addr)
+        return cfg.read32(SMN_DATA)
+
+
+def write(addr, value, node='0000:00:00.0'):
+    cfg = _open(node)
+    with _locks[node]:
+        cfg.write32(SMN_INDEX, addr)
+        cfg.write32(SMN_DATA, value)
+
+
+def readrange(addr, count, node='0000:00:00.0'):
+    cfg = _open(node)
+    out = array('I', bytes(4 * count))
+    with _locks[node]:
+        for i in range(count):
+            cfg.write32(SMN_INDEX, addr + 4 * i)
+            out[i] = cfg.read32(SMN_DATA)
+    return out
+
+
+# Any set of registers under one hold of the node lock
+def readmany(addrs, node='0000:00:00.0'):
+    cfg = _open(node)
+    out = []
+    with _locks[node]:
+        for addr in addrs:
+            cfg.write32(SMN_INDEX, addr)
+            out.append(cfg.read32(SMN_DATA))
+    return out
+
+
+def close():
+    global _nodes
+    with _lock:
+        for cfg in _configs.values():
+            cfg.close()
+        _configs.clear()
+        _locks.clear()
+        _nodes = None
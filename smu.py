@@ -0,0 +1,337 @@
+import os
+import time
+import struct
+import threading
+
+import smn
+
+SMU_RSP_BUSY =              0x00
+SMU_RSP_OK =                0x01
+SMU_RSP_FAILED =            0xFF
+SMU_RSP_UNKNOWN_CMD =       0xFE
+SMU_RSP_REJECTED_PREREQ =   0xFD
+SMU_RSP_REJECTED_BUSY =     0xFC
+
+# Wall-clock budget for one command, polls done back to back before the
+# first sleep, and the bounds of the exponential backoff (in seconds)
+SMU_TIMEOUT = 0.5
+SMU_SPIN = 64
+SMU_BACKOFF_MIN = 0.00001
+SMU_BACKOFF_MAX = 0.002
+
+SMU_MAX_ARGS = 6
+
+HISTOGRAM_BUCKETS = 24 # log2 buckets of microseconds, up to ~8s
+
+
+class SmuError(Exception):
+    def __init__(self, cmd, rsp, msg):
+        Exception.__init__(self, 'SMU command 0x%X: %s (response 0x%X)' % (cmd or 0, msg, rsp))
+        self.cmd = cmd
+        self.rsp = rsp
+
+
+class SmuTimeoutError(SmuError):
+    pass
+
+
+class SmuFailedError(SmuError):
+    pass
+
+
+class SmuUnknownCommandError(SmuError):
+    pass
+
+
+class SmuPrereqError(SmuError):
+    pass
+
+
+class SmuBusyError(SmuError):
+    pass
+
+
+_ERRORS = {
+    SMU_RSP_FAILED: (SmuFailedError, 'failed'),
+    SMU_RSP_UNKNOWN_CMD: (SmuUnknownCommandError, 'unknown command'),
+    SMU_RSP_REJECTED_PREREQ: (SmuPrereqError, 'rejected, prerequisite not met'),
+    SMU_RSP_REJECTED_BUSY: (SmuBusyError, 'rejected, SMU busy'),
+}
+
+
+def check(cmd, rsp):
+    if rsp == SMU_RSP_OK:
+        return rsp
+    if rsp == SMU_RSP_BUSY:
+        raise SmuTimeoutError(cmd, rsp, 'timed out')
+    error, msg = _ERRORS.get(rsp, (SmuError, 'unexpected response'))
+    raise error(cmd, rsp, msg)
+
+
+class LatencyHistogram(object):
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds, rsp=SMU_RSP_OK):
+        us = int(seconds * 1e6)
+        self.buckets[min(us.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        if rsp == SMU_RSP_BUSY:
+            self.timeouts += 1
+        elif rsp != SMU_RSP_OK:
+            self.errors += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # Upper bound of the bucket holding the p-th percentile, in seconds
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return (1 << i) / 1e6
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'min': self.min or 0.0,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max or 0.0,
+        }
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record(cmd, seconds, rsp=SMU_RSP_OK):
+    with _stats_lock:
+        hist = _stats.get(cmd)
+        if hist is None:
+            hist = _stats[cmd] = LatencyHistogram()
+        hist.record(seconds, rsp)
+
+
+def stats(cmd=None):
+    with _stats_lock:
+        if cmd is not None:
+            return _stats[cmd].summary() if cmd in _stats else LatencyHistogram().summary()
+        return dict((c, h.summary()) for c, h in _stats.items())
+
+
+def resetstats():
+    with _stats_lock:
+        _stats.clear()
+
+
+# Poll readrsp() until the SMU posts a response: a tight spin first since
+# most commands finish within a few register reads, then exponential
+# backoff until the deadline.
+def waitdone(readrsp, cmd=None, timeout=SMU_TIMEOUT):
+    start = time.perf_counter()
+    deadline = start + timeout
+    delay = SMU_BACKOFF_MIN
+    polls = 0
+    while True:
+        rsp = readrsp()
+        if rsp != SMU_RSP_BUSY:
+            break
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        polls += 1
+        if polls >= SMU_SPIN:
+            time.sleep(min(delay, deadline - now))
+            delay = min(delay * 2, SMU_BACKOFF_MAX)
+    record(cmd, time.perf_counter() - start, rsp)
+    return check(cmd, rsp)
+
+
+class SmuResult(object):
+    __slots__ = ('cmd', 'rsp', 'args', 'error')
+
+    def __init__(self, cmd, rsp, args, error=None):
+        self.cmd = cmd
+        self.rsp = rsp
+        self.args = args
+        self.error = error
+
+    def __repr__(self):
+        return 'SmuResult(cmd=0x%X, rsp=0x%X, args=%s)' % (self.cmd, self.rsp, ['0x%X' % a for a in self.args])
+
+
+def _padargs(cmd, args):
+    args = list(args)
+    if len(args) > SMU_MAX_ARGS:
+        raise ValueError('SMU command 0x%X takes at most %d arguments' % (cmd, SMU_MAX_ARGS))
+    return args + [0] * (SMU_MAX_ARGS - len(args))
+
+
+class Mailbox(object):
+    def __init__(self, cmd_addr, rsp_addr, arg_addr, node='0000:00:00.0'):
+        self.cmd_addr = cmd_addr
+        self.rsp_addr = rsp_addr
+        self.arg_addr = arg_addr
+        self.node = node
+        self.lock = threading.Lock()
+
+    def _readrsp(self):
+        return smn.read(self.rsp_addr, self.node)
+
+    # Run [(cmd, [args...]), ...] back to back while holding the mailbox,
+    # returning one SmuResult per command with the argument registers
+    # read back after completion
+    def transact(self, commands, timeout=SMU_TIMEOUT, stoponerror=False):
+        results = []
+        with self.lock:
+            for cmd, args in commands:
+                args = _padargs(cmd, args)
+                smn.write(self.rsp_addr, 0, self.node)
+                for i, arg in enumerate(args):
+                    smn.write(self.arg_addr + 4 * i, arg, self.node)
+                smn.write(self.cmd_addr, cmd, self.node)
+                try:
+                    rsp = waitdone(self._readrsp, cmd, timeout)
+                    error = None
+                except SmuError as e:
+                    rsp = e.rsp
+                    error = e
+                readback = list(smn.readrange(self.arg_addr, SMU_MAX_ARGS, self.node))
+                results.append(SmuResult(cmd, rsp, readback, error))
+                if error is not None and stoponerror:
+                    break
+        return results
+
+    def close(self):
+        pass
+
+
+class Transaction(object):
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+        self.commands = []
+
+    def add(self, cmd, *args):
+        self.commands.append((cmd, _padargs(cmd, args)))
+        return self
+
+    def __len__(self):
+        return len(self.commands)
+
+    def run(self, timeout=SMU_TIMEOUT, stoponerror=False):
+        return self.mailbox.transact(self.commands, timeout, stoponerror)
+
+
+_pool = None
+
+
+# Run the same commands on every mailbox concurrently, returns
+# {node: [SmuResult, ...]}
+def fanout(mailboxes, commands, timeout=SMU_TIMEOUT, stoponerror=False):
+    global _pool
+    if len(mailboxes) == 1:
+        m = mailboxes[0]
+        return {m.node: m.transact(commands, timeout, stoponerror)}
+    if _pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _pool = ThreadPoolExecutor(max_workers=len(mailboxes), thread_name_prefix='smu')
+    futures = [(m.node, _pool.submit(m.transact, commands, timeout, stoponerror)) for m in mailboxes]
+    return dict((node, f.result()) for node, f in futures)
+
+
+RYZEN_SMU_DRV = '/sys/kernel/ryzen_smu_drv'
+# Oldest driver with the rsmu_cmd/smu_args/pm_table interface used here,
+# and the major version it belongs to
+RYZEN_SMU_MIN_VERSION = (0, 1, 0)
+
+_ARGS = struct.Struct('<%dI' % SMU_MAX_ARGS)
+_U32 = struct.Struct('<I')
+
+
+def ryzenSmuVersion(root=None):
+    try:
+        with open(os.path.join(root or RYZEN_SMU_DRV, 'drv_version')) as f:
+            return tuple(int(v) for v in f.read().strip().split('.'))
+    except (OSError, ValueError):
+        return None
+
+
+# The driver is loaded and speaks the interface this module expects
+def ryzenSmuAvailable():
+    version = ryzenSmuVersion()
+    return (os.path.exists(os.path.join(RYZEN_SMU_DRV, 'rsmu_cmd')) and version is not None
+            and version[0] == RYZEN_SMU_MIN_VERSION[0] and version >= RYZEN_SMU_MIN_VERSION)
+
+
+# Mailbox backed by the ryzen_smu kernel driver: the driver serializes SMU
+# access with any other kernel user and waits for the response in kernel
+# space. Same interface as Mailbox.
+class RyzenSmuMailbox(object):
+    def __init__(self, root=None, cmdfile='rsmu_cmd'):
+        self.root = root or RYZEN_SMU_DRV
+        self.node = 'ryzen_smu'
+        self.lock = threading.Lock()
+        self.args_fd = os.open(os.path.join(self.root, 'smu_args'), os.O_RDWR)
+        self.cmd_fd = os.open(os.path.join(self.root, cmdfile), os.O_RDWR)
+
+    # Writing the command blocks until the SMU answers, the response is
+    # then read back from the same file
+    def _submit(self, cmd):
+        os.pwrite(self.cmd_fd, _U32.pack(cmd), 0)
+        return _U32.unpack(os.pread(self.cmd_fd, 4, 0))[0]
+
+    def transact(self, commands, timeout=SMU_TIMEOUT, stoponerror=False):
+        results = []
+        with self.lock:
+            for cmd, args in commands:
+                args = _padargs(cmd, args)
+                start = time.perf_counter()
+                os.pwrite(self.args_fd, _ARGS.pack(*args), 0)
+                try:
+                    rsp = self._submit(cmd)
+                except OSError:
+                    # The driver fails the write when the SMU does not answer
+                    rsp = SMU_RSP_BUSY
+                record(cmd, time.perf_counter() - start, rsp)
+                try:
+                    check(cmd, rsp)
+                    error = None
+                except SmuError as e:
+                    error = e
+                readback = list(_ARGS.unpack(os.pread(self.args_fd, _ARGS.size, 0)))
+                results.append(SmuResult(cmd, rsp, readback, error))
+                if error is not None and stoponerror:
+                    break
+        return results
+
+    def readfile(self, name, size=None):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read() if size is None else f.read(size)
+
+    def close(self):
+        os.close(self.args_fd)
+        os.close(self.cmd_fd)
+
+
+# Factory for the driver mailbox, replaced by the simulator
+DRIVER = RyzenSmuMailbox
@@ -0,0 +1,44 @@
+import numpy as np
+
+import msrdev
+import zenstates as zs
+
+
+# All eight P-state MSRs of every core, decoded with array operations.
+# Every field is a (cores x 8) array.
+class Snapshot(object):
+    def __init__(self, cpulist=None):
+        self.cpus = list(msrdev.cpus() if cpulist is None else cpulist)
+        rows = msrdev.readmanyall(zs.PSTATES, self.cpus)
+        self.raw = np.array(rows, dtype=np.uint64).reshape(len(self.cpus), len(zs.PSTATES))
+        self.decode()
+
+    def decode(self):
+        raw = self.raw
+        self.enabled = (raw >> 63).astype(bool)
+        self.fid = (raw & 0xff).astype(np.int32)
+        self.did = (raw >> 8 & 0x3f).astype(np.int32)
+        self.vid = (raw >> 14 & 0xff).astype(np.int32)
+        self.ratio = np.where(self.did > 0, 2.0 * self.fid / np.maximum(self.did, 1), 0.0)
+        self.volts = 1.55 - self.vid * 0.00625
+
+        # The most common P-state table and which cores differ from it
+        rows, counts = np.unique(raw, axis=0, return_counts=True)
+        self.majority = rows[counts.argmax()]
+        self.mismatch = raw != self.majority
+        self.divergent = np.nonzero(self.mismatch.any(axis=1))[0]
+
+    def divergentCores(self):
+        return [(self.cpus[i], np.nonzero(self.mismatch[i])[0].tolist()) for i in self.divergent]
+
+    def report(self):
+        lines = []
+        for p, val in enumerate(self.majority.tolist()):
+            lines.append('P%d - %s' % (p, zs.pstate2str(val)))
+        if not len(self.divergent):
+            lines.append('All %d cores match' % len(self.cpus))
+        for cpu, pstates in self.divergentCores():
+            i = self.cpus.index(cpu)
+            for p in pstates:
+                lines.append('CPU %d P%d differs: %s' % (cpu, p, zs.pstate2str(int(self.raw[i, p]))))
+        return '\n'.join(lines)
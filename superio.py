@@ -0,0 +1,218 @@
+import os
+import threading
+
+SIO_INDEX = 0x2E
+SIO_DATA = 0x2F
+
+# Configuration mode entry keys, written to the index port
+ENTRY_KEYS = {
+    'ite': (0x87, 0x01, 0x55, 0x55),
+    'nuvoton': (0x87, 0x87),
+}
+
+REG_LDN = 0x07
+REG_CHIP_ID = 0x20 # 0x20 high byte, 0x21 low byte
+REG_BASE = 0x60    # 0x60 high byte, 0x61 low byte of the LDN's I/O base
+ITE_REG_CONFIG_CTL = 0x02 # [1] exit configuration mode
+
+# ITE: LDN and bit that enable the POST/Q-Code display
+QCODE_LDN = 0x03
+QCODE_REG = 0xF0
+QCODE_BIT = 0x08
+
+# ITE environment controller (hardware monitor): LDN 4, registers reached
+# through an address/data pair at its base + 5/6
+EC_LDN = 0x04
+EC_ADDR = 0x05
+EC_DATA = 0x06
+EC_FAN_LOW = (0x0D, 0x0E, 0x0F, 0x80, 0x82)
+EC_FAN_HIGH = (0x18, 0x19, 0x1A, 0x81, 0x83)
+EC_TEMPS = (0x29, 0x2A, 0x2B)
+EC_VOLTAGES = (0x20, 0x21, 0x22, 0x23, 0x24, 0x25, 0x26, 0x27, 0x28)
+EC_ADC_LSB = 0.012 # volts per ADC count on the IT86xx parts
+EC_FAN_CLOCK = 1350000
+
+
+class PortioBackend(object):
+    def __init__(self):
+        import portio
+        self.portio = portio
+        if portio.iopl(3):
+            raise OSError('iopl(3) failed (run as root)')
+
+    def inb(self, port):
+        return self.portio.inb(port)
+
+    def outb(self, value, port):
+        self.portio.outb(value, port)
+
+    def close(self):
+        pass
+
+
+# /dev/port, where the file offset is the port number. Slower per access
+# than portio but needs no extra module.
+class DevPortBackend(object):
+    def __init__(self, path='/dev/port'):
+        try:
+            self.fd = os.open(path, os.O_RDWR)
+        except OSError:
+            raise OSError('cannot open %s (run as root)' % path)
+
+    def inb(self, port):
+        return os.pread(self.fd, 1, port)[0]
+
+    def outb(self, value, port):
+        os.pwrite(self.fd, bytes((value,)), port)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _defaultbackend():
+    try:
+        return PortioBackend()
+    except ImportError:
+        return DevPortBackend()
+
+
+# Factory for the port I/O backend, replaced by the simulator
+BACKEND = _defaultbackend
+
+
+# One configuration mode session with a Super I/O chip: the entry key is
+# sent once, the selected LDN is remembered so reselecting it is free, and
+# exit() (or leaving the with block) hands the chip back
+class SuperIo(object):
+    def __init__(self, vendor='ite', index=SIO_INDEX, backend=None):
+        self.vendor = vendor
+        self.index = index
+        self.data = index + 1
+        self.io = backend or BACKEND()
+        self.lock = threading.Lock()
+        self.ldn = None
+        self.entered = False
+
+    def enter(self):
+        if not self.entered:
+            for key in ENTRY_KEYS[self.vendor]:
+                self.io.outb(key, self.index)
+            self.entered = True
+            self.ldn = None
+        return self
+
+    def exit(self):
+        if self.entered:
+            if self.vendor == 'ite':
+                self._write(ITE_REG_CONFIG_CTL, 0x02)
+            else:
+                self.io.outb(0xAA, self.index)
+            self.entered = False
+            self.ldn = None
+
+    def close(self):
+        self.exit()
+        self.io.close()
+
+    def __enter__(self):
+        return self.enter()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self, reg):
+        self.io.outb(reg, self.index)
+        return self.io.inb(self.data)
+
+    def _write(self, reg, value):
+        self.io.outb(reg, self.index)
+        self.io.outb(value, self.data)
+
+    def _select(self, ldn):
+        if ldn is not None and ldn != self.ldn:
+            self._write(REG_LDN, ldn)
+            self.ldn = ldn
+
+    def read(self, reg, ldn=None):
+        with self.lock:
+            self.enter()
+            self._select(ldn)
+            return self._read(reg)
+
+    def write(self, reg, value, ldn=None):
+        with self.lock:
+            self.enter()
+            self._select(ldn)
+            self._write(reg, value)
+
+    def readmany(self, regs, ldn=None):
+        with self.lock:
+            self.enter()
+            self._select(ldn)
+            return [self._read(reg) for reg in regs]
+
+    def chipId(self):
+        high, low = self.readmany((REG_CHIP_ID, REG_CHIP_ID + 1))
+        return high << 8 | low
+
+    def baseAddress(self, ldn):
+        high, low = self.readmany((REG_BASE, REG_BASE + 1), ldn)
+        return high << 8 | low
+
+    # The Q-Code bit and the environment controller are only mapped for ITE
+    # chips, other vendors keep unrelated registers there
+    def _requireite(self, what):
+        if self.vendor != 'ite':
+            raise ValueError('%s is only supported on ITE chips, not %s' % (what, self.vendor))
+
+    def qcode(self):
+        self._requireite('The Q-Code display')
+        return bool(self.read(QCODE_REG, QCODE_LDN) & QCODE_BIT)
+
+    # Flip the POST/Q-Code display enable bit, returns the new state
+    def toggleQcode(self):
+        self._requireite('The Q-Code display')
+        with self.lock:
+            self.enter()
+            self._select(QCODE_LDN)
+            val = self._read(QCODE_REG) ^ QCODE_BIT
+            self._write(QCODE_REG, val)
+        return bool(val & QCODE_BIT)
+
+    def hardwareMonitor(self):
+        self._requireite('The hardware monitor')
+        return HardwareMonitor(self.io, self.baseAddress(EC_LDN))
+
+
+# The ITE environment controller. Its registers sit behind a plain I/O
+# port pair, so polling needs no configuration mode at all.
+class HardwareMonitor(object):
+    def __init__(self, io, base, adc_lsb=EC_ADC_LSB):
+        if not base:
+            raise OSError('Hardware monitor is not enabled')
+        self.io = io
+        self.addr = base + EC_ADDR
+        self.data = base + EC_DATA
+        self.adc_lsb = adc_lsb
+        self.lock = threading.Lock()
+        self.regs = EC_FAN_LOW + EC_FAN_HIGH + EC_TEMPS + EC_VOLTAGES
+
+    def readmany(self, regs):
+        io, addr, data = self.io, self.addr, self.data
+        out = []
+        with self.lock:
+            for reg in regs:
+                io.outb(reg, addr)
+                out.append(io.inb(data))
+        return out
+
+    # All fans, temperatures and voltages in one pass over the registers
+    def poll(self):
+        values = dict(zip(self.regs, self.readmany(self.regs)))
+        fans = []
+        for low, high in zip(EC_FAN_LOW, EC_FAN_HIGH):
+            count = values[high] << 8 | values[low]
+            fans.append(0 if count in (0, 0xFFFF) else EC_FAN_CLOCK // (count * 2))
+        temps = [values[r] - 256 if values[r] & 0x80 else values[r] for r in EC_TEMPS]
+        volts = [round(values[r] * self.adc_lsb, 3) for r in EC_VOLTAGES]
+        return {'fans': fans, 'temps': temps, 'volts': volts}
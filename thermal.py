@@ -0,0 +1,227 @@
+import sys
+import json
+import time
+import threading
+from collections import namedtuple
+
+import smn
+import cpuid
+import zenstates as zs
+
+THM_TCON_CUR_TMP = 0x00059800 # [31:21] CUR_TEMP (1/8 C) [19] CUR_TEMP_RANGE_SEL [17:16] CUR_TEMP_TJ_SEL
+CUR_TEMP_SHIFT = 21
+CUR_TEMP_RANGE_SEL = 1 << 19
+CUR_TEMP_TJ_SEL = 3 << 16
+THM_CCD_TEMP = 0x00059954 # one per CCD: [11] valid [10:0] temperature (1/8 C, -49 C)
+CCD_TEMP_VALID = 1 << 11
+CCD_TEMP_MASK = 0x7FF
+RANGE_OFFSET = 49.0
+
+# Number of CCD temperature registers per CPUID, for the families that
+# have them (Zen 2 | Matisse, Rome, Castle Peak)
+CCD_REGISTERS = {
+    0x00870F10: 8,
+    0x00870F00: 8,
+    0x00830F00: 8,
+    0x00830F10: 8,
+}
+
+# Tctl runs this many degrees above the real die temperature on these
+# parts (brand string prefix -> offset), as in the kernel's k10temp
+TCTL_OFFSETS = (
+    ('AMD Ryzen 5 1600X', 20.0),
+    ('AMD Ryzen 7 1700X', 20.0),
+    ('AMD Ryzen 7 1800X', 20.0),
+    ('AMD Ryzen 7 2700X', 10.0),
+    ('AMD Ryzen Threadripper 19', 27.0),
+    ('AMD Ryzen Threadripper 29', 27.0),
+)
+
+Reading = namedtuple('Reading', 't tctl tdie ccds')
+
+
+class ThermalTrip(Exception):
+    def __init__(self, limit, reading):
+        Exception.__init__(self, 'Temperature %.1f C reached the %.1f C limit' % (hottest(reading), limit))
+        self.limit = limit
+        self.reading = reading
+
+
+def brand():
+    words = []
+    for leaf in (0x80000002, 0x80000003, 0x80000004):
+        words.extend(cpuid.cpuid(leaf))
+    raw = b''.join(w.to_bytes(4, 'little') for w in words)
+    return raw.split(b'\0')[0].decode('ascii', 'replace').strip()
+
+
+def tctlOffset(name=None):
+    name = brand() if name is None else name
+    for prefix, offset in TCTL_OFFSETS:
+        if name.startswith(prefix):
+            return offset
+    return 0.0
+
+
+def decodeTctl(val):
+    temp = (val >> CUR_TEMP_SHIFT) * 0.125
+    if val & CUR_TEMP_RANGE_SEL or val & CUR_TEMP_TJ_SEL == CUR_TEMP_TJ_SEL:
+        temp -= RANGE_OFFSET
+    return temp
+
+
+def decodeCcd(val):
+    return (val & CCD_TEMP_MASK) * 0.125 - RANGE_OFFSET
+
+
+# Hottest of Tctl and the CCDs, what the safety trip compares against
+def hottest(reading):
+    return max((reading.tctl,) + reading.ccds)
+
+
+# Temperature registers of one node. The CCDs present are found once, by
+# their valid bit, so a sample is a single pass over a fixed register list
+# under one hold of the SMN lock.
+class Sensor(object):
+    def __init__(self, node=None, offset=None):
+        zs.detect()
+        self.node = node or smn.nodes()[0]
+        self.offset = tctlOffset() if offset is None else offset
+        count = CCD_REGISTERS.get(zs.getCpuid(), 0)
+        ccds = smn.readrange(THM_CCD_TEMP, count, self.node) if count else ()
+        self.ccdaddrs = tuple(THM_CCD_TEMP + 4 * i for i, val in enumerate(ccds) if val & CCD_TEMP_VALID)
+        self.addrs = (THM_TCON_CUR_TMP,) + self.ccdaddrs
+
+    def read(self):
+        regs = smn.readmany(self.addrs, self.node)
+        tctl = decodeTctl(regs[0])
+        return Reading(time.time(), tctl, tctl - self.offset, tuple(decodeCcd(v) for v in regs[1:]))
+
+
+# Running min/max/avg of every channel
+class Stats(object):
+    def __init__(self):
+        self.count = 0
+        self.low = None
+        self.high = None
+        self.total = None
+
+    def update(self, reading):
+        values = (reading.tctl, reading.tdie) + reading.ccds
+        if self.count == 0:
+            self.low = list(values)
+            self.high = list(values)
+            self.total = list(values)
+        else:
+            for i, v in enumerate(values):
+                if v < self.low[i]:
+                    self.low[i] = v
+                elif v > self.high[i]:
+                    self.high[i] = v
+                self.total[i] += v
+        self.count += 1
+
+    def channels(self):
+        return ['tctl', 'tdie'] + ['ccd%d' % i for i in range(len(self.low or ()) - 2)]
+
+    def report(self):
+        lines = ['Samples: %d' % self.count]
+        for i, name in enumerate(self.channels()):
+            lines.append('%-5s min %6.2f C  max %6.2f C  avg %6.2f C' % (
+                name, self.low[i], self.high[i], self.total[i] / self.count))
+        return '\n'.join(lines)
+
+
+# Samples every node's sensor each `interval` seconds in a background
+# thread and trips once the hottest reading reaches `limit`. Long
+# operations call check() between steps, which raises ThermalTrip from
+# then on.
+class Guard(object):
+    def __init__(self, limit, interval=0.05, sensors=None):
+        self.limit = limit
+        self.interval = interval
+        self.sensors = sensors or [Sensor(node) for node in smn.nodes()]
+        self.tripped = None
+        self.last = None
+        self.stop = threading.Event()
+        self.thread = None
+
+    def poll(self):
+        self.last = [sensor.read() for sensor in self.sensors]
+        if self.tripped is None:
+            for reading in self.last:
+                if hottest(reading) >= self.limit:
+                    self.tripped = reading
+        return self.last
+
+    def check(self):
+        if self.thread is None:
+            self.poll()
+        if self.tripped is not None:
+            raise ThermalTrip(self.limit, self.tripped)
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            self.poll()
+
+    def start(self):
+        self.poll()
+        self.thread = threading.Thread(target=self._run, name='thermal-guard', daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def record(reading):
+    return {
+        't': reading.t,
+        'tctl': round(reading.tctl, 3),
+        'tdie': round(reading.tdie, 3),
+        'ccd': [round(c, 3) for c in reading.ccds],
+    }
+
+
+def writeNdjson(out, reading):
+    out.write(json.dumps(record(reading), separators=(',', ':')))
+    out.write('\n')
+
+
+def writeCsv(out, reading):
+    out.write(','.join(['%.6f' % reading.t] + ['%.3f' % v for v in (reading.tctl, reading.tdie) + reading.ccds]))
+    out.write('\n')
+
+
+def run(rate=10.0, count=0, fmt='ndjson', out=sys.stdout):
+    sensor = Sensor()
+    stats = Stats()
+    write = writeCsv if fmt == 'csv' else writeNdjson
+    if fmt == 'csv':
+        out.write(','.join(['t', 'tctl', 'tdie'] + ['ccd%d' % i for i in range(len(sensor.ccdaddrs))]) + '\n')
+    interval = 1.0 / rate
+    deadline = time.perf_counter()
+    try:
+        while count <= 0 or stats.count < count:
+            deadline += interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.perf_counter()
+            reading = sensor.read()
+            stats.update(reading)
+            write(out, reading)
+            out.flush()
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    return stats
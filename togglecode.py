@@ -1,16 +1,45 @@
 #!/usr/bin/python
-import portio
-
-portio.iopl(3)
-portio.ioperm(0x2E, 2, 1)
-
-portio.outb_p(0x87, 0x2E)
-portio.outb_p(0x01, 0x2E)
-portio.outb_p(0x55, 0x2E)
-portio.outb_p(0x55, 0x2E)
-portio.outb_p(0x07, 0x2E)
-portio.outb_p(0x03, 0x2F)
-portio.outb_p(0xF0, 0x2E)
-f = portio.inb_p(0x2F)
-f ^= 0x08
-portio.outb_p(f, 0x2F)
+import time
+import argparse
+
+import superio
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Toggle the POST/Q-Code display and read the Super I/O hardware monitor')
+    parser.add_argument('--status', action='store_true', help='Print the Q-Code display state without changing it')
+    parser.add_argument('--hwmon', action='store_true', help='Print fans, temperatures and voltages')
+    parser.add_argument('--rate', default=1.0, type=float, help='Hardware monitor polling rate (in Hz)')
+    parser.add_argument('--count', default=1, type=int, help='Number of hardware monitor samples (0 = until interrupted)')
+    parser.add_argument('--vendor', default='ite', choices=sorted(superio.ENTRY_KEYS), help='Super I/O vendor')
+    args = parser.parse_args(argv)
+
+    try:
+        run(args)
+    except (OSError, ValueError) as e:
+        exit(str(e))
+
+
+def run(args):
+    with superio.SuperIo(args.vendor) as sio:
+        if args.hwmon:
+            hwmon = sio.hardwareMonitor()
+            # The environment controller needs no configuration mode
+            sio.exit()
+            n = 0
+            try:
+                while args.count <= 0 or n < args.count:
+                    if n:
+                        time.sleep(1.0 / args.rate)
+                    print(hwmon.poll())
+                    n += 1
+            except KeyboardInterrupt:
+                pass
+        elif args.status:
+            print('Q-Code display: %s' % ('on' if sio.qcode() else 'off'))
+        else:
+            print('Q-Code display: %s' % ('on' if sio.toggleQcode() else 'off'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import os
+import glob
+from collections import namedtuple
+
+SYSFS_CPU = '/sys/devices/system/cpu'
+
+# Zen, Zen+ and Zen 2 put two core complexes (CCX, one L3 each) on every
+# CCD/die
+CCX_PER_CCD = 2
+
+Cpu = namedtuple('Cpu', 'cpu socket core ccx ccd')
+
+
+# "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+def parselist(text):
+    out = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            out.extend(range(int(first), int(last) + 1))
+        else:
+            out.append(int(part))
+    return out
+
+
+def _readint(path, default=0):
+    try:
+        with open(path) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return default
+
+
+def _readlist(path):
+    try:
+        with open(path) as f:
+            return parselist(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+# Only online CPUs count: an offline one keeps its cpuN directory but has
+# no topology or cache entries to place it by
+def _online(root, cpu):
+    path = os.path.join(root, 'cpu%d' % cpu)
+    return os.path.isdir(os.path.join(path, 'topology')) and _readint(os.path.join(path, 'online'), 1) == 1
+
+
+class Topology(object):
+    def __init__(self, root=None):
+        root = root or SYSFS_CPU
+        paths = glob.glob(os.path.join(root, 'cpu[0-9]*'))
+        ids = sorted(cpu for cpu in (int(os.path.basename(p)[3:]) for p in paths) if _online(root, cpu))
+        # A CCX is the set of CPUs sharing one L3, numbered machine-wide in
+        # order of their first CPU. A CPU without L3 information is a CCX of
+        # its own.
+        l3 = {}
+        for cpu in ids:
+            shared = _readlist(os.path.join(root, 'cpu%d' % cpu, 'cache', 'index3', 'shared_cpu_list'))
+            l3[cpu] = min(shared) if shared else cpu
+        ccx_index = dict((g, i) for i, g in enumerate(sorted(set(l3.values()))))
+        self.cpus = []
+        for cpu in ids:
+            topo = os.path.join(root, 'cpu%d' % cpu, 'topology')
+            socket = _readint(os.path.join(topo, 'physical_package_id'))
+            ccx = ccx_index[l3[cpu]]
+            self.cpus.append(Cpu(cpu, socket, _readint(os.path.join(topo, 'core_id'), cpu), ccx, ccx // CCX_PER_CCD))
+
+    def sockets(self):
+        return sorted(set(c.socket for c in self.cpus))
+
+    def ccxs(self):
+        return sorted(set(c.ccx for c in self.cpus))
+
+    def ccds(self):
+        return sorted(set(c.ccd for c in self.cpus))
+
+    # CPUs matching every selector given, each a list of ids. None when no
+    # selector is given, meaning all CPUs.
+    def select(self, cpus=None, ccx=None, ccd=None, socket=None):
+        if cpus is None and ccx is None and ccd is None and socket is None:
+            return None
+        selected = []
+        for c in self.cpus:
+            if cpus is not None and c.cpu not in cpus:
+                continue
+            if ccx is not None and c.ccx not in ccx:
+                continue
+            if ccd is not None and c.ccd not in ccd:
+                continue
+            if socket is not None and c.socket not in socket:
+                continue
+            selected.append(c.cpu)
+        if not selected:
+            raise ValueError('No CPU matches the selection')
+        return selected
+
+    def describe(self):
+        lines = []
+        for ccx in self.ccxs():
+            members = [c for c in self.cpus if c.ccx == ccx]
+            lines.append('Socket %d CCD %d CCX %d: CPUs %s' % (
+                members[0].socket, members[0].ccd, ccx, ','.join(str(c.cpu) for c in members)))
+        return '\n'.join(lines)
+
+
+_topology = None
+
+
+def get():
+    global _topology
+    if _topology is None:
+        _topology = Topology()
+    return _topology
+
+
+def reset():
+    global _topology
+    _topology = None
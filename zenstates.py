@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 import struct
-import os
-import glob
-import argparse
 import cpuid
+import msrdev
+import smn
+import smu
+import regcache
+import topology
 
 APP_NAME = 'ZenStates for Linux'
 APP_VERSION = '1.3'
@@ -20,6 +22,13 @@ PSTATES = range(0xC0010064, 0xC001006C)
 MSR_PMGT_MISC =             0xC0010292 # [32] PC6En
 MSR_CSTATE_CONFIG =         0xC0010296 # [22] CCR2_CC6EN [14] CCR1_CC6EN [6] CCR0_CC6EN
 MSR_HWCR =                  0xC0010015
+MSR_PSTATE_STATUS =         0xC0010063 # [2:0] CurPstate
+MSR_HW_PSTATE_STATUS =      0xC0010293 # [21:14] CurCpuVid [13:8] CurCpuDfsId [7:0] CurCpuFid
+MSR_MPERF =                 0x000000E7
+MSR_APERF =                 0x000000E8
+MSR_RAPL_PWR_UNIT =         0xC0010299 # [12:8] ESU, energy unit 1/2^ESU J
+MSR_CORE_ENERGY_STAT =      0xC001029A # [31:0] core energy counter
+MSR_PKG_ENERGY_STAT =       0xC001029B # [31:0] package energy counter
 SMU_CMD_ADDR =              0
 SMU_RSP_ADDR =              0
 SMU_ARG_ADDR =              0
@@ -27,90 +36,147 @@ SMU_CMD_OC_ENABLE =         0
 SMU_CMD_OC_DISABLE =        0
 SMU_CMD_OC_FREQ_ALL_CORES = 0
 SMU_CMD_OC_VID =            0
+SMU_CMD_GET_PBO_SCALAR =    0
+SMU_CMD_TRANSFER_TABLE =    0
+SMU_CMD_GET_TABLE_BASE =    0
+SMU_CMD_GET_TABLE_VERSION = 0
+SMU_CMD_SET_PPT =           0x53
+SMU_CMD_SET_TDC =           0x54
+SMU_CMD_SET_EDC =           0x55
+
+# SMU transport: 'auto' uses the ryzen_smu driver when it is loaded and
+# PCI config space otherwise, 'pci' or 'ryzen_smu' force one
+SMU_BACKEND = 'auto'
+
+# Registers the hardware changes on its own, never served from the cache
+VOLATILE_MSRS = frozenset((MSR_PSTATE_STATUS, MSR_HW_PSTATE_STATUS, MSR_MPERF, MSR_APERF,
+                           MSR_CORE_ENERGY_STAT, MSR_PKG_ENERGY_STAT))
+
+# Last known register values, keyed by (cpu, msr) and (node, SMN address)
+msrcache = regcache.RegisterCache()
+smncache = regcache.RegisterCache()
 
 isOcFreqSupported = False
-cpu_sockets = int(os.popen('cat /proc/cpuinfo | grep "physical id" | sort -u | wc -l').read())
+cpu_sockets = 0
+_cpuid = None
+_pkgtype = None
+_detected = False
+_smu_mailboxes = None
+
+
+def getSockets():
+    return len(topology.get().sockets())
+
 
 def writesmureg(reg, value=0):
-    os.popen('setpci -v -s 0:0.0 b8.l={:08X}'.format(reg)).read()
-    os.popen('setpci -v -s 0:0.0 bc.l={:08X}'.format(value)).read()
+    for node in smn.nodes():
+        smn.write(reg, value, node)
+        smncache.put((node, reg), value)
+
+
+# SMN registers are mostly live (mailbox, thermal, PM table address), so
+# reads go to the hardware unless the caller knows the register only
+# changes through writesmureg() and asks for cached=True
+def readsmureg(reg, cached=False):
+    node = smn.nodes()[0]
+    if not cached:
+        return smn.read(reg, node)
+    return smncache.get((node, reg), lambda: smn.read(reg, node))
+
+
+def readsmuregall(reg, cached=False):
+    if not cached:
+        return dict((node, smn.read(reg, node)) for node in smn.nodes())
+    return dict((node, smncache.get((node, reg), lambda: smn.read(reg, node))) for node in smn.nodes())
+
+
+def _ismailbox(key):
+    reg = key[1]
+    return reg in (SMU_CMD_ADDR, SMU_RSP_ADDR) or SMU_ARG_ADDR <= reg < SMU_ARG_ADDR + 4 * smu.SMU_MAX_ARGS
+
+
+def smumailboxes():
+    global _smu_mailboxes
+    if _smu_mailboxes is None:
+        detect()
+        if usingRyzenSmu():
+            _smu_mailboxes = [smu.DRIVER()]
+        else:
+            _smu_mailboxes = [smu.Mailbox(SMU_CMD_ADDR, SMU_RSP_ADDR, SMU_ARG_ADDR, n) for n in smn.nodes()]
+    return _smu_mailboxes
 
-    if cpu_sockets == 2:
-        os.popen('setpci -v -s A0:0.0 b8.l={:08X}'.format(reg)).read()
-        os.popen('setpci -v -s A0:0.0 bc.l={:08X}'.format(value)).read()
 
+# 'auto' falls back to PCI config space when the driver is missing or
+# too old, an explicit 'ryzen_smu' fails instead
+def usingRyzenSmu():
+    if SMU_BACKEND == 'auto':
+        return smu.ryzenSmuAvailable()
+    if SMU_BACKEND == 'ryzen_smu' and not smu.ryzenSmuAvailable():
+        raise SystemError('ryzen_smu driver not loaded or unsupported version (need %s)' %
+                          '.'.join(str(v) for v in smu.RYZEN_SMU_MIN_VERSION))
+    return SMU_BACKEND == 'ryzen_smu'
 
-def readsmureg(reg):
-    os.popen('setpci -v -s 0:0.0 b8.l={:08X}'.format(reg)).read()
-    output = os.popen('setpci -v -s 0:0.0 bc.l').read()
 
-    if cpu_sockets == 2:
-        os.popen('setpci -v -s A0:0.0 b8.l={:08X}'.format(reg)).read()
-        os.popen('setpci -v -s A0:0.0 bc.l').read()
+# Send [(cmd, [args...]) ...] to every node in parallel, one mailbox
+# session each, returns {node: [SmuResult, ...]}
+def smutransactall(commands):
+    results = smu.fanout(smumailboxes(), commands)
+    # The mailbox wrote its registers behind the cache's back
+    smncache.invalidate(match=_ismailbox)
+    for node, node_results in results.items():
+        for r in node_results:
+            if r.error:
+                print('%s: %s' % (node, r.error))
+    return results
 
-    return hex(output[-9:][0:8])
+
+# Same as smutransactall() but returns the results of the first node only
+def smutransact(commands):
+    return smutransactall(commands)[smumailboxes()[0].node]
 
 
 def writesmu(cmd, value=0):
-    res = False
-    # clear the response register
-    writesmureg(SMU_RSP_ADDR, 0)
-    # write the value
-    writesmureg(SMU_ARG_ADDR, value)
-    writesmureg(SMU_ARG_ADDR + 4, 0)
-    # send the command
-    writesmureg(SMU_CMD_ADDR, cmd)
-    res = smuwaitdone()
-    if res:
-        return readsmureg(SMU_RSP_ADDR)
-    else:
-        return 0
+    return smutransact([(cmd, [value])])[0].rsp
 
 
 def readsmu(cmd):
-    writesmureg(SMU_RSP_ADDR, 0)
-    writesmureg(SMU_CMD_ADDR, cmd)
-    return readsmureg(SMU_ARG_ADDR)
-
-def smuwaitdone():
-    res = False
-    timeout = 1000
-    data = 0
-    while ((not res or data != 1) and timeout > 0):
-        timeout-=1
-        data = readsmureg(SMU_RSP_ADDR)
-        if data == 1:
-            res = True
-        if (timeout == 0 or data != 1):
-            res = False
-    return res
-
-def writemsr(msr, val, cpu=-1):
-    try:
-        if cpu == -1:
-            for c in glob.glob('/dev/cpu/[0-9]*/msr'):
-                f = os.open(c, os.O_WRONLY)
-                os.lseek(f, msr, os.SEEK_SET)
-                os.write(f, struct.pack('Q', val))
-                os.close(f)
-        else:
-            f = os.open('/dev/cpu/%d/msr' % (cpu), os.O_WRONLY)
-            os.lseek(f, msr, os.SEEK_SET)
-            os.write(f, struct.pack('Q', val))
-            os.close(f)
-    except:
-        raise OSError("msr module not loaded (run modprobe msr)")
+    r = smutransact([(cmd, [])])[0]
+    if r.error:
+        raise r.error
+    return r.args[0]
 
 
-def readmsr(msr, cpu=0):
-    try:
-        f = os.open('/dev/cpu/%d/msr' % cpu, os.O_RDONLY)
-        os.lseek(f, msr, os.SEEK_SET)
-        val = struct.unpack('Q', os.read(f, 8))[0]
-        os.close(f)
-        return val
-    except:
-        raise OSError("msr module not loaded (run modprobe msr)")
+def smuwaitdone(cmd=None, timeout=smu.SMU_TIMEOUT):
+    return smu.waitdone(lambda: readsmureg(SMU_RSP_ADDR, cached=False), cmd, timeout)
+
+
+# cpu=-1 writes every CPU, or only those in cpulist when given
+def writemsr(msr, val, cpu=-1, cpulist=None):
+    if cpu == -1 and cpulist is not None:
+        msrdev.writeall(msr, val, cpulist)
+    else:
+        msrdev.write(msr, val, cpu)
+        cpulist = msrdev.cpus() if cpu == -1 else [cpu]
+    for c in cpulist:
+        msrcache.put((c, msr), val)
+
+
+def readmsr(msr, cpu=0, cached=True):
+    if not cached or msr in VOLATILE_MSRS:
+        return msrdev.read(msr, cpu)
+    return msrcache.get((cpu, msr), lambda: msrdev.read(msr, cpu))
+
+
+# Read-modify-write msr on every CPU, or only those in cpulist
+def updatemsrall(msr, setmask=0, clearmask=0, cpulist=None):
+    msrdev.updateall(msr, setmask, clearmask, cpulist)
+    msrcache.invalidate(match=lambda key: key[1] == msr)
+
+
+# Forget cached register values, e.g. after another tool wrote them
+def invalidate():
+    msrcache.invalidate()
+    smncache.invalidate()
 
 
 def pstate2str(val):
@@ -144,7 +210,7 @@ def getPstateVid(index):
 
 
 def getCurrentVid():
-    return readmsr(0xC0010293) >> 14 & 0xff
+    return readmsr(MSR_HW_PSTATE_STATUS) >> 14 & 0xff
 
 
 def getPstateDetails(val):
@@ -177,20 +243,41 @@ def voltsToVid(volts):
 
 
 def getCpuid():
-    eax, ebx, ecx, edx = cpuid.CPUID()(0x00000001)
-    print("CPUID: %08X" % eax)
+    eax, ebx, ecx, edx = cpuid.cpuid(0x00000001)
     return eax
 
 
 def getPkgType():
-    eax, ebx, ecx, edx = cpuid.CPUID()(0x80000001)
+    eax, ebx, ecx, edx = cpuid.cpuid(0x80000001)
     type = ebx >> 28
-    print("Package Type: %01d" % type)
     return type
 
 
+# False where the PBO scalar cannot be read (no command ID, or the SMU
+# rejects it)
 def getOcMode():
-    return readsmu(SMU_CMD_GET_PBO_SCALAR) == 0
+    detect()
+    if not SMU_CMD_GET_PBO_SCALAR:
+        return False
+    try:
+        return readsmu(SMU_CMD_GET_PBO_SCALAR) == 0
+    except smu.SmuError:
+        return False
+
+
+# Physical address and version of the SMU PM table
+def getPmTableInfo():
+    detect()
+    if usingRyzenSmu():
+        version = smumailboxes()[0].readfile('pm_table_version', 4)
+        return 0, struct.unpack('<I', version)[0]
+    if not SMU_CMD_GET_TABLE_BASE:
+        raise SystemError('PM table not supported on this CPU')
+    version, base = smutransact([(SMU_CMD_GET_TABLE_VERSION, []), (SMU_CMD_GET_TABLE_BASE, [])])
+    for r in (version, base):
+        if r.error:
+            raise r.error
+    return base.args[0] | base.args[1] << 32, version.args[0]
 
 
 def getC6core():
@@ -202,33 +289,30 @@ def getC6package():
 
 
 def setC6Core(enable):
-    if not getC6core() and enable:
-        writemsr(MSR_CSTATE_CONFIG, readmsr(MSR_CSTATE_CONFIG) | ((1 << 22) | (1 << 14) | (1 << 6)))
-        print('GUI: Set C6-Core: %s' % str(enable))
-    elif getC6core() and not enable:
-        writemsr(MSR_CSTATE_CONFIG, readmsr(MSR_CSTATE_CONFIG) & ~ ((1 << 22) | (1 << 14) | (1 << 6)))
+    mask = (1 << 22) | (1 << 14) | (1 << 6)
+    val = readmsr(MSR_CSTATE_CONFIG)
+    if (val & mask == mask) != bool(enable):
+        writemsr(MSR_CSTATE_CONFIG, val | mask if enable else val & ~mask)
         print('GUI: Set C6-Core: %s' % str(enable))
 
 
 def setC6Package(enable):
-    if not getC6package() and enable:
-        writemsr(MSR_PMGT_MISC, readmsr(MSR_PMGT_MISC) | (1 << 32))
-        print('GUI: Set C6-Package: %s' % str(enable))
-    elif getC6package() and  not enable:
-        writemsr(MSR_PMGT_MISC, readmsr(MSR_PMGT_MISC) & ~(1 << 32))
+    val = readmsr(MSR_PMGT_MISC)
+    if bool(val & (1 << 32)) != bool(enable):
+        writemsr(MSR_PMGT_MISC, val | (1 << 32) if enable else val & ~(1 << 32))
         print('GUI: Set C6-Package: %s' % str(enable))
 
 
 def setPPT(val):
-    if int(val) > -1: writesmu(0x53, int(val) * 1000)
+    if int(val) > -1: writesmu(SMU_CMD_SET_PPT, int(val) * 1000)
 
 
 def setTDC(val):
-    if int(val) > -1: writesmu(0x54, int(val) * 1000)
+    if int(val) > -1: writesmu(SMU_CMD_SET_TDC, int(val) * 1000)
 
 
 def setEDC(val):
-    if int(val) > -1: writesmu(0x55, int(val) * 1000)
+    if int(val) > -1: writesmu(SMU_CMD_SET_EDC, int(val) * 1000)
 
 
 # Not supported yet
@@ -237,9 +321,10 @@ def setScalar(val):
 
 
 def setPboLimits(ppt, tdc, edc, scalar):
-    setPPT(ppt)
-    setTDC(tdc)
-    setEDC(edc)
+    limits = [(SMU_CMD_SET_PPT, ppt), (SMU_CMD_SET_TDC, tdc), (SMU_CMD_SET_EDC, edc)]
+    commands = [(cmd, [int(val) * 1000]) for cmd, val in limits if int(val) > -1]
+    if commands:
+        smutransact(commands)
     setScalar(scalar)
 
 
@@ -274,420 +359,473 @@ def setPstateGui(index, fid, did, vid):
     if new != old:
         if not (readmsr(MSR_HWCR) & (1 << 21)):
             print('GUI: Locking TSC frequency')
-            for c in range(len(glob.glob('/dev/cpu/[0-9]*/msr'))):
-                writemsr(MSR_HWCR, readmsr(MSR_HWCR, c) | (1 << 21), c)
+            updatemsrall(MSR_HWCR, setmask=1 << 21)
         print('GUI: Set Pstate%s: %s' % (index, getPstateDetails(new)))
         writemsr(PSTATES[index], new)
 
 
-print('CPUs: %d' % cpu_sockets)
+# Identify the CPU and pick the SMU mailbox and command IDs for its family.
+# Runs once, on the first call that needs them.
+def detect():
+    global SMU_CMD_ADDR, SMU_RSP_ADDR, SMU_ARG_ADDR, SMU_CMD_OC_ENABLE, SMU_CMD_OC_DISABLE
+    global SMU_CMD_OC_FREQ_ALL_CORES, SMU_CMD_OC_VID, SMU_CMD_GET_PBO_SCALAR
+    global SMU_CMD_TRANSFER_TABLE, SMU_CMD_GET_TABLE_BASE, SMU_CMD_GET_TABLE_VERSION
+    global isOcFreqSupported, cpu_sockets, _cpuid, _pkgtype, _detected
+
+    if _detected:
+        return
+
+    cpu_sockets = getSockets()
+    _cpuid = getCpuid()
+    _pkgtype = getPkgType()
+
+    # Zen | Summit Ridge, Threadripper
+    if _cpuid in [0x00800F11, 0x00800F00]:
+        SMU_CMD_ADDR = 0x03B10528
+        SMU_RSP_ADDR = 0x03B10564
+        SMU_ARG_ADDR = 0x03B10598
+        SMU_CMD_OC_ENABLE = 0x23
+        SMU_CMD_OC_DISABLE = 0x24
+        SMU_CMD_OC_FREQ_ALL_CORES = 0x26
+        SMU_CMD_OC_VID = 0x28
+        # depends on SMU version. Need to find which version disables the manual OC
+        # turn it off for now
+        isOcFreqSupported = False
+
+    # Zen | Naples - P-States only
+    elif _cpuid == 0x00800F12:
+        SMU_CMD_ADDR = 0x03B10528
+        SMU_RSP_ADDR = 0x03B10564
+        SMU_ARG_ADDR = 0x03B10598
+        isOcFreqSupported = False
+
+    # Zen+ | Pinnacle Ridge, Colfax
+    elif _cpuid == 0x00800F82:
+        SMU_CMD_ADDR = 0x03B1051C
+        SMU_RSP_ADDR = 0x03B10568
+        SMU_ARG_ADDR = 0x03B10590
+        # SMU_CMD_OC_ENABLE = 0x63
+        # SMU_CMD_OC_DISABLE = 0x64
+        isOcFreqSupported = True
+
+        if _pkgtype == 7: # Colfax
+            SMU_CMD_OC_ENABLE = 0x67 # based on assumption
+            SMU_CMD_OC_FREQ_ALL_CORES = 0x68
+            SMU_CMD_OC_VID = 0x6A
+            SMU_CMD_GET_PBO_SCALAR = 0x70
+        else:
+            SMU_CMD_OC_ENABLE = 0x6B
+            SMU_CMD_OC_FREQ_ALL_CORES = 0x6C
+            SMU_CMD_OC_VID = 0x6E
+            SMU_CMD_GET_PBO_SCALAR = 0x6F
+
+    # Zen 2 | Matisse, Rome, Castle Peak
+    elif _cpuid in [0x00870F10, 0x00870F00, 0x00830F00, 0x00830F10]:
+        SMU_CMD_ADDR = 0x03B10524
+        SMU_RSP_ADDR = 0x03B10570
+        SMU_ARG_ADDR = 0x03B10A40
+        isOcFreqSupported = True
+
+        if _pkgtype == 7: # Rome ES
+            SMU_CMD_OC_FREQ_ALL_CORES = 0x18
+            SMU_CMD_OC_VID = 0x12
+        else:
+            SMU_CMD_OC_ENABLE = 0x5A
+            SMU_CMD_OC_DISABLE = 0x5B
+            SMU_CMD_OC_FREQ_ALL_CORES = 0x5C
+            SMU_CMD_OC_VID = 0x61
+            SMU_CMD_GET_PBO_SCALAR = 0x6C
+            SMU_CMD_TRANSFER_TABLE = 0x05
+            SMU_CMD_GET_TABLE_BASE = 0x06
+            SMU_CMD_GET_TABLE_VERSION = 0x08
+
+    # RavenRidge, RavenRidge2
+    elif _cpuid in [0x00810F00, 0x00810F10, 0x00820F00]:
+        SMU_CMD_ADDR = 0x03B10528
+        SMU_RSP_ADDR = 0x03B10564
+        SMU_ARG_ADDR = 0x03B10998
+        isOcFreqSupported = False
+
+    # Picasso, Fenghuang
+    elif _cpuid in [0x00810F81, 0x00850F00]:
+        SMU_CMD_ADDR = 0x03B10A20
+        SMU_RSP_ADDR = 0x03B10A80
+        SMU_ARG_ADDR = 0x03B10A88
+        SMU_CMD_OC_ENABLE = 0x69
+        SMU_CMD_OC_DISABLE = 0x6A
+        SMU_CMD_OC_FREQ_ALL_CORES = 0x7D
+        SMU_CMD_OC_VID = 0x7F
+        SMU_CMD_GET_PBO_SCALAR = 0x62
+        isOcFreqSupported = True
+
+    # Renoir
+    elif _cpuid in [0x00860F01]:
+        SMU_CMD_ADDR = 0x03B10A20
+        SMU_RSP_ADDR = 0x03B10A80
+        SMU_ARG_ADDR = 0x03B10A88
+        SMU_CMD_GET_PBO_SCALAR = 0xF
+        SMU_CMD_TRANSFER_TABLE = 0x65
+        SMU_CMD_GET_TABLE_BASE = 0x66
+        SMU_CMD_GET_TABLE_VERSION = 0x06
+        isOcFreqSupported = False
 
-_cpuid = getCpuid()
-_pkgtype = getPkgType()
+    else:
+        raise SystemError('CPU not supported!')
+
+    _detected = True
 
-# Zen | Summit Ridge, Threadripper
-if _cpuid in [0x00800F11, 0x00800F00]:
-    SMU_CMD_ADDR = 0x03B10528
-    SMU_RSP_ADDR = 0x03B10564
-    SMU_ARG_ADDR = 0x03B10598
-    SMU_CMD_OC_ENABLE = 0x23
-    SMU_CMD_OC_DISABLE = 0x24
-    SMU_CMD_OC_FREQ_ALL_CORES = 0x26
-    SMU_CMD_OC_VID = 0x28
-    # depends on SMU version. Need to find which version disables the manual OC
-    # turn it off for now
-    isOcFreqSupported = False
 
-# Zen | Naples - P-States only
-elif _cpuid == 0x00800F12:
-    SMU_CMD_ADDR = 0x03B10528
-    SMU_RSP_ADDR = 0x03B10564
-    SMU_ARG_ADDR = 0x03B10598
+# Forget the detection result and mailboxes, e.g. after switching backends
+def reset():
+    global isOcFreqSupported, _detected, _smu_mailboxes
+    for name in ('SMU_CMD_ADDR', 'SMU_RSP_ADDR', 'SMU_ARG_ADDR', 'SMU_CMD_OC_ENABLE', 'SMU_CMD_OC_DISABLE',
+                 'SMU_CMD_OC_FREQ_ALL_CORES', 'SMU_CMD_OC_VID', 'SMU_CMD_GET_PBO_SCALAR',
+                 'SMU_CMD_TRANSFER_TABLE', 'SMU_CMD_GET_TABLE_BASE', 'SMU_CMD_GET_TABLE_VERSION'):
+        globals()[name] = 0
     isOcFreqSupported = False
+    _detected = False
+    invalidate()
+    topology.reset()
+    for m in _smu_mailboxes or ():
+        m.close()
+    _smu_mailboxes = None
+
+
+# The one-shot commands of main(), run while the thermal guard (if any)
+# samples in the background
+def _commands(args, cpulist, guard):
+    import thermal
+
+    if args.topology:
+        print(topology.get().describe())
+
+    if args.list:
+        for p in range(len(PSTATES)):
+            print('P' + str(p) + " - " + pstate2str(readmsr(PSTATES[p])))
+        print('C6 State - Package - ' +
+              ('Enabled' if getC6package() else 'Disabled'))
+        print('C6 State - Core - ' + ('Enabled' if getC6core() else 'Disabled'))
+
+    if args.snapshot:
+        try:
+            import snapshot
+        except ImportError:
+            exit('--snapshot requires numpy')
+        print(snapshot.Snapshot(cpulist).report())
+
+    if args.pm_table:
+        import pmtable
+        try:
+            table = pmtable.openTable().refresh()
+        except (OSError, ValueError, SystemError, smu.SmuError) as e:
+            exit('Cannot read the PM table: %s' % e)
+        print('PM table version: %X' % table.version)
+        for name, value in table.read().items():
+            print('%s = %s' % (name, value))
+        table.close()
+
+    if args.profile:
+        import profiles
+        try:
+            plan = profiles.apply(profiles.load(args.profile), args.dry_run, cpulist, guard)
+        except (ValueError, smu.SmuError, thermal.ThermalTrip) as e:
+            exit('%s: %s' % (args.profile, e))
+        print(plan.report())
+
+    if args.stress > 0:
+        import autotune
+        try:
+            ok, results = autotune.stress(args.stress, cpulist, guard=guard)
+        except thermal.ThermalTrip as e:
+            exit('Stress test stopped: %s' % e)
+        for cpu, cpuok, rounds, error in results:
+            print('CPU %s: %d rounds, %s' % (cpu, rounds, 'OK' if cpuok else error))
+        print('Stress test %s' % ('passed' if ok else 'FAILED'))
+
+    if args.autotune:
+        import autotune
+        pstates = [args.pstate] if args.pstate >= 0 else None
+        try:
+            result = autotune.run(args.autotune, seconds=args.autotune_seconds, pstates=pstates,
+                                  cpulist=cpulist, searchrange=args.autotune_range, guard=guard)
+        except thermal.ThermalTrip as e:
+            exit('Autotune stopped: %s' % e)
+        print('Wrote %s: %s' % (args.autotune, ', '.join('%s VID %X' % kv for kv in sorted(result.items()))))
+
+    # With --autotune, --pstate only picks the P-state to tune
+    if args.pstate >= 0 and not args.autotune and cpulist is not None:
+        # Each selected core keeps its own values for the fields not given
+        import profiles
+        entry = {}
+        if args.enable or args.disable:
+            entry['enabled'] = args.enable
+        if args.fid in range(FID_MIN, FID_MAX):
+            entry['fid'] = args.fid
+        if args.did >= 0:
+            entry['did'] = args.did
+        if args.vid in range(VID_MIN, VID_MAX):
+            entry['vid'] = args.vid
+        print('Setting P%d on CPUs %s: %s' % (args.pstate, ','.join(str(c) for c in cpulist), entry))
+        try:
+            plan = profiles.apply(profiles.Profile({'pstates': {str(args.pstate): entry}}), cpulist=cpulist, guard=guard)
+        except (ValueError, thermal.ThermalTrip) as e:
+            exit(str(e))
+        print(plan.report())
+
+    elif args.pstate >= 0 and not args.autotune:
+        new = old = readmsr(PSTATES[args.pstate])
+        print('Current P' + str(args.pstate) + ': ' + pstate2str(old))
+        if args.enable:
+            new = setbits(new, 63, 1, 1)
+            print('Enabling state')
+        if args.disable:
+            new = setbits(new, 63, 1, 0)
+            print('Disabling state')
+        if args.fid in range(FID_MIN, FID_MAX):
+            new = setfid(new, args.fid)
+            print('Setting FID to %X' % args.fid)
+        if args.did >= 0:
+            new = setdid(new, args.did)
+            print('Setting DID to %X' % args.did)
+        if args.vid in range(VID_MIN, VID_MAX):
+            new = setvid(new, args.vid)
+            print('Setting VID to %X' % args.vid)
+        if new != old:
+            try:
+                if guard is not None:
+                    guard.check()
+            except thermal.ThermalTrip as e:
+                exit(str(e))
+            if not (readmsr(MSR_HWCR) & (1 << 21)):
+                print('Locking TSC frequency')
+                updatemsrall(MSR_HWCR, setmask=1 << 21)
+            print('New P' + str(args.pstate) + ': ' + pstate2str(new))
+            writemsr(PSTATES[args.pstate], new)
+
+    if (args.c6_enable or args.c6_disable) and cpulist is not None:
+        import profiles
+        enable = bool(args.c6_enable)
+        profiles.apply(profiles.Profile({'c6': {'package': enable, 'core': enable}}), cpulist=cpulist)
+        print('%s C6 state on CPUs %s' % ('Enabling' if enable else 'Disabling', ','.join(str(c) for c in cpulist)))
 
-# Zen+ | Pinnacle Ridge, Colfax
-elif _cpuid == 0x00800F82:
-    SMU_CMD_ADDR = 0x03B1051C
-    SMU_RSP_ADDR = 0x03B10568
-    SMU_ARG_ADDR = 0x03B10590
-    # SMU_CMD_OC_ENABLE = 0x63
-    # SMU_CMD_OC_DISABLE = 0x64
-    isOcFreqSupported = True
-
-    if _pkgtype == 7: # Colfax
-        SMU_CMD_OC_ENABLE = 0x67 # based on assumption
-        SMU_CMD_OC_FREQ_ALL_CORES = 0x68
-        SMU_CMD_OC_VID = 0x6A
-        SMU_CMD_GET_PBO_SCALAR = 0x70
     else:
-        SMU_CMD_OC_ENABLE = 0x6B
-        SMU_CMD_OC_FREQ_ALL_CORES = 0x6C
-        SMU_CMD_OC_VID = 0x6E
-        SMU_CMD_GET_PBO_SCALAR = 0x6F
-
-# Zen 2 | Matisse, Rome, Castle Peak
-elif _cpuid in [0x00870F10, 0x00870F00, 0x00830F00, 0x00830F10]:
-    SMU_CMD_ADDR = 0x03B10524
-    SMU_RSP_ADDR = 0x03B10570
-    SMU_ARG_ADDR = 0x03B10A40
-    isOcFreqSupported = True
-
-    if _pkgtype == 7: # Rome ES
-        SMU_CMD_OC_FREQ_ALL_CORES = 0x18
-        SMU_CMD_OC_VID = 0x12
-    else:
-        SMU_CMD_OC_ENABLE = 0x5A
-        SMU_CMD_OC_DISABLE = 0x5B
-        SMU_CMD_OC_FREQ_ALL_CORES = 0x5C
-        SMU_CMD_OC_VID = 0x61
-        SMU_CMD_GET_PBO_SCALAR = 0x6C
-
-# RavenRidge, RavenRidge2
-elif _cpuid in [0x00810F00, 0x00810F10, 0x00820F00]:
-    SMU_CMD_ADDR = 0x03B10528
-    SMU_RSP_ADDR = 0x03B10564
-    SMU_ARG_ADDR = 0x03B10998
-    isOcFreqSupported = False
+        if args.c6_enable:
+            setC6Package(True)
+            setC6Core(True)
+            print('Enabling C6 state')
+
+        if args.c6_disable:
+            setC6Package(False)
+            setC6Core(False)
+            print('Disabling C6 state')
+
+    if args.smu_test_message:
+        print('Sending test SMU message')
+        print('SMU response: %X' % writesmu(0x1))
+
+    smu_commands = []
+
+    if args.oc_vid >= 0:
+        smu_commands.append((SMU_CMD_OC_VID, [args.oc_vid]))
+        print('Set OC VID to %X' % args.oc_vid)
+
+    if args.oc_frequency > 550:
+        smu_commands.append((SMU_CMD_OC_FREQ_ALL_CORES, [args.oc_frequency]))
+        print('Set OC frequency to %sMHz' % args.oc_frequency)
+
+    if args.ppt > -1:
+        smu_commands.append((SMU_CMD_SET_PPT, [args.ppt * 1000]))
+        print('Set PPT to %sW' % args.ppt)
+
+    if args.tdc > -1:
+        smu_commands.append((SMU_CMD_SET_TDC, [args.tdc * 1000]))
+        print('Set TDC to %sA' % args.tdc)
+
+    if args.edc > -1:
+        smu_commands.append((SMU_CMD_SET_EDC, [args.edc * 1000]))
+        print('Set EDC to %sA' % args.edc)
+
+    if smu_commands:
+        try:
+            if guard is not None:
+                guard.check()
+        except thermal.ThermalTrip as e:
+            exit(str(e))
+        smutransact(smu_commands)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Dynamically edit AMD Ryzen processor parameters')
+    parser.add_argument('-l', '--list', action='store_true', help='List all P-States')
+    parser.add_argument('--no-gui', action='store_true', help='Run in CLI without GUI')
+    parser.add_argument('-p', '--pstate', default=-1, type=int, choices=range(8), help='P-State to set')
+    toggle = parser.add_mutually_exclusive_group()
+    toggle.add_argument('--enable', action='store_true', help='Enable P-State')
+    toggle.add_argument('--disable', action='store_true', help='Disable P-State')
+    parser.add_argument('-f', '--fid', default=-1, type=hex, help='FID to set (in hex)')
+    parser.add_argument('-d', '--did', default=-1, type=hex, help='DID to set (in hex)')
+    parser.add_argument('-v', '--vid', default=-1, type=hex, help='VID to set (in hex)')
+    parser.add_argument('--c6-enable', action='store_true', help='Enable C-State C6')
+    parser.add_argument('--c6-disable', action='store_true', help='Disable C-State C6')
+    parser.add_argument('--smu-test-message', action='store_true', help='Send test message to the SMU (response 1 means "success")')
+    parser.add_argument('--oc-frequency', default=550, type=int, help='Set overclock frequency (in MHz)')
+    parser.add_argument('--oc-vid', default=-1, type=hex, help='Set overclock VID')
+    parser.add_argument('--ppt', default=-1, type=int, help='Set PPT limit (in W)')
+    parser.add_argument('--tdc', default=-1, type=int, help='Set TDC limit (in A)')
+    parser.add_argument('--edc', default=-1, type=int, help='Set EDC limit (in A)')
+    parser.add_argument('--snapshot', action='store_true', help='Compare the P-States of all cores')
+    parser.add_argument('--profile', help='Apply a JSON or TOML (Python 3.11+) settings profile')
+    parser.add_argument('--dry-run', action='store_true', help='Print the writes a profile needs without doing them')
+    parser.add_argument('--autotune', metavar='PROFILE', help='Search the lowest stable VIDs and write them as a profile')
+    parser.add_argument('--autotune-seconds', default=60, type=int, help='Stress test length per autotune step (in s)')
+    parser.add_argument('--autotune-range', default=0x20, type=hex, help='VID steps to search below the current voltage (in hex)')
+    parser.add_argument('--stress', default=0, type=int, help='Run the verifying stress test for this many seconds')
+    parser.add_argument('--governor', metavar='CONFIG', help='Adjust power limits to the load, as set in a JSON config')
+    parser.add_argument('--measure', metavar='CMD', help='Run CMD and print the energy used per core and package')
+    parser.add_argument('--exporter', metavar='[ADDR:]PORT', help='Serve Prometheus metrics over HTTP')
+    parser.add_argument('--exporter-interval', default=5.0, type=float, help='Seconds a metrics snapshot is reused')
+    parser.add_argument('--pm-table', action='store_true', help='Print the SMU power/metrics table')
+    parser.add_argument('--smu-backend', choices=['auto', 'pci', 'ryzen_smu'], help='SMU access method')
+    parser.add_argument('--daemon', action='store_true', help='Serve requests on a Unix socket')
+    parser.add_argument('--connect', action='store_true', help='Run the other arguments in a running daemon')
+    parser.add_argument('--daemon-socket', default='/run/zenstates.sock', help='Daemon socket path')
+    parser.add_argument('--cpus', type=topology.parselist, help='Only act on these CPUs (e.g. 0-3,8)')
+    parser.add_argument('--ccx', type=topology.parselist, help='Only act on the CPUs of these CCXs')
+    parser.add_argument('--ccd', type=topology.parselist, help='Only act on the CPUs of these CCDs')
+    parser.add_argument('--socket', type=topology.parselist, help='Only act on the CPUs of these sockets')
+    parser.add_argument('--topology', action='store_true', help='Print the socket/CCD/CCX layout')
+    parser.add_argument('--monitor', action='store_true', help='Stream per-core frequency and P-state telemetry')
+    parser.add_argument('--thermal', action='store_true', help='Stream Tctl/Tdie and CCD temperatures')
+    parser.add_argument('--thermal-limit', type=float, help='Stop applying OC/voltage changes at this temperature (in C)')
+    parser.add_argument('--rate', default=10.0, type=float, help='Monitor or thermal sampling rate (in Hz)')
+    parser.add_argument('--count', default=0, type=int, help='Number of samples or governor steps (0 = until interrupted)')
+    parser.add_argument('--format', default='ndjson', choices=['ndjson', 'csv'], help='Monitor or thermal output format')
+
+    args = parser.parse_args(argv)
+
+    global SMU_BACKEND
+    if args.smu_backend:
+        SMU_BACKEND = args.smu_backend
+        try:
+            usingRyzenSmu()
+        except SystemError as e:
+            exit(str(e))
+
+    if args.connect:
+        import sys
+        import daemon
+        forward = [a for a in (sys.argv[1:] if argv is None else argv) if a != '--connect']
+        if '--daemon-socket' in forward:
+            i = forward.index('--daemon-socket')
+            del forward[i:i + 2]
+        forward = [a for a in forward if not a.startswith('--daemon-socket=')]
+        try:
+            client = daemon.Client(args.daemon_socket)
+        except OSError as e:
+            exit('Cannot connect to %s: %s' % (args.daemon_socket, e))
+        sys.stdout.write(client.call('cli', argv=forward))
+        client.close()
+        return
+
+    if args.daemon:
+        import daemon
+        try:
+            detect()
+        except SystemError as e:
+            exit(str(e))
+        daemon.serve(args.daemon_socket)
+        return
 
-# Picasso, Fenghuang
-elif _cpuid in [0x00810F81, 0x00850F00]:
-    SMU_CMD_ADDR = 0x03B10A20
-    SMU_RSP_ADDR = 0x03B10A80
-    SMU_ARG_ADDR = 0x03B10A88
-    SMU_CMD_OC_ENABLE = 0x69
-    SMU_CMD_OC_DISABLE = 0x6A
-    SMU_CMD_OC_FREQ_ALL_CORES = 0x7D
-    SMU_CMD_OC_VID = 0x7F
-    SMU_CMD_GET_PBO_SCALAR = 0x62
-    isOcFreqSupported = True
-
-# Renoir
-elif _cpuid in [0x00860F01]:
-    SMU_CMD_ADDR = 0x03B10A20
-    SMU_RSP_ADDR = 0x03B10A80
-    SMU_ARG_ADDR = 0x03B10A88
-    SMU_CMD_GET_PBO_SCALAR = 0xF
-    isOcFreqSupported = False
+    try:
+        cpulist = topology.get().select(args.cpus, args.ccx, args.ccd, args.socket)
+    except ValueError as e:
+        exit(str(e))
+
+    if args.monitor:
+        import monitor
+        monitor.run(args.rate, args.count, args.format, cpulist)
+        return
+
+    if args.thermal:
+        import sys
+        import thermal
+        try:
+            stats = thermal.run(args.rate, args.count, args.format)
+        except SystemError as e:
+            exit(str(e))
+        if stats.count:
+            sys.stderr.write(stats.report() + '\n')
+        return
+
+    if args.measure:
+        import energy
+        import shlex
+        try:
+            meter, status = energy.measure(shlex.split(args.measure), cpulist=cpulist)
+        except OSError as e:
+            exit('%s: %s' % (args.measure, e))
+        print(meter.report())
+        exit(status)
+
+    if args.exporter:
+        import exporter
+        address, _, port = args.exporter.rpartition(':')
+        try:
+            exporter.serve(address or '127.0.0.1', int(port), args.exporter_interval, cpulist)
+        except (OSError, ValueError, SystemError) as e:
+            exit('%s: %s' % (args.exporter, e))
+        return
+
+    if args.governor:
+        import governor
+        try:
+            governor.run(governor.load(args.governor), args.count, cpulist)
+        except (ValueError, SystemError) as e:
+            exit('%s: %s' % (args.governor, e))
+        return
 
-else:
-    exit('CPU not supported!')
-
-parser = argparse.ArgumentParser(description='Dynamically edit AMD Ryzen processor parameters')
-parser.add_argument('-l', '--list', action='store_true', help='List all P-States')
-parser.add_argument('--no-gui', action='store_true', help='Run in CLI without GUI')
-parser.add_argument('-p', '--pstate', default=-1, type=int, choices=range(8), help='P-State to set')
-parser.add_argument('--enable', action='store_true', help='Enable P-State')
-parser.add_argument('--disable', action='store_true', help='Disable P-State')
-parser.add_argument('-f', '--fid', default=-1, type=hex, help='FID to set (in hex)')
-parser.add_argument('-d', '--did', default=-1, type=hex, help='DID to set (in hex)')
-parser.add_argument('-v', '--vid', default=-1, type=hex, help='VID to set (in hex)')
-parser.add_argument('--c6-enable', action='store_true', help='Enable C-State C6')
-parser.add_argument('--c6-disable', action='store_true', help='Disable C-State C6')
-parser.add_argument('--smu-test-message', action='store_true', help='Send test message to the SMU (response 1 means "success")')
-parser.add_argument('--oc-frequency', default=550, type=int, help='Set overclock frequency (in MHz)')
-parser.add_argument('--oc-vid', default=-1, type=hex, help='Set overclock VID')
-parser.add_argument('--ppt', default=-1, type=int, help='Set PPT limit (in W)')
-parser.add_argument('--tdc', default=-1, type=int, help='Set TDC limit (in A)')
-parser.add_argument('--edc', default=-1, type=int, help='Set EDC limit (in A)')
-
-args = parser.parse_args()
-
-if args.list:
-    for p in range(len(PSTATES)):
-        print('P' + str(p) + " - " + pstate2str(readmsr(PSTATES[p])))
-    print('C6 State - Package - ' +
-          ('Enabled' if getC6package() else 'Disabled'))
-    print('C6 State - Core - ' + ('Enabled' if getC6core() else 'Disabled'))
-
-if args.pstate >= 0:
-    new = old = readmsr(PSTATES[args.pstate])
-    print('Current P' + str(args.pstate) + ': ' + pstate2str(old))
-    if args.enable:
-        new = setbits(new, 63, 1, 1)
-        print('Enabling state')
-    if args.disable:
-        new = setbits(new, 63, 1, 0)
-        print('Disabling state')
-    if args.fid in range(FID_MIN, FID_MAX):
-        new = setfid(new, args.fid)
-        print('Setting FID to %X' % args.fid)
-    if args.did >= 0:
-        new = setdid(new, args.did)
-        print('Setting DID to %X' % args.did)
-    if args.vid in range(VID_MIN, VID_MAX):
-        new = setvid(new, args.vid)
-        print('Setting VID to %X' % args.vid)
-    if new != old:
-        if not (readmsr(MSR_HWCR) & (1 << 21)):
-            print('Locking TSC frequency')
-            for c in range(len(glob.glob('/dev/cpu/[0-9]*/msr'))):
-                writemsr(MSR_HWCR, readmsr(MSR_HWCR, c) | (1 << 21), c)
-        print('New P' + str(args.pstate) + ': ' + pstate2str(new))
-        writemsr(PSTATES[args.pstate], new)
-
-if args.c6_enable:
-    setC6Package(True)
-    setC6Core(True)
-    print('Enabling C6 state')
-
-if args.c6_disable:
-    setC6Package(False)
-    setC6Core(False)
-    print('Disabling C6 state')
-
-if args.smu_test_message:
-    print('Sending test SMU message')
-    print('SMU response: %X' % writesmu(0x1))
-
-if args.oc_vid >= 0:
-    writesmu(SMU_CMD_OC_VID, args.oc_vid)
-    print('Set OC VID to %X' % args.oc_vid)
-
-if args.oc_frequency > 550:
-    writesmu(SMU_CMD_OC_FREQ_ALL_CORES, args.oc_frequency)
-    print('Set OC frequency to %sMHz' % args.oc_frequency)
-
-if args.ppt > -1:
-    setPPT(args.ppt)
-    print('Set PPT to %sW' % args.ppt)
-
-if args.tdc > -1:
-    setTDC(args.tdc)
-    print('Set TDC to %sA' % args.tdc)
-
-if args.edc > -1:
-    setEDC(args.edc)
-    print('Set EDC to %sA' % args.edc)
-
-if (not args.list and args.pstate == -1 and not args.c6_enable and not args.c6_disable
-    and not args.smu_test_message and args.no_gui and args.edc == -1 and args.ppt == -1 
-    and args.tdc == -1):
-    parser.print_help()
-
-
-###############################
-# GUI
-if not args.no_gui:
-    import PySimpleGUI as sg
-
-    _oc_mode = getOcMode()
-    if _oc_mode:
-        _default_vid = getCurrentVid()
-        _ratio = getRatio(0xC0010293)
-    else:
-        _default_vid = getPstateVid(0)
-        _ratio = getRatio(PSTATES[0])
-
-    _current_freq = int(_ratio * 100)
-
-    #sg.theme('Dark Teal 9')
-    sg.set_options(icon='icon.png', element_padding=(5, 5), margins=(1, 1), border_width=0)
-
-    # The tab 1, 2, 3 layouts - what goes inside the tab
-    tab1_layout = [
-        [sg.CBox('OC Mode', default=_oc_mode, key='ocMode', enable_events=True)],
-        [
-            sg.Text(' All Core Frequency', size=(18, 1)),
-            sg.Spin(
-                values=[x for x in range(550, 7000, 25)],
-                initial_value=_current_freq,
-                enable_events=True,
-                disabled=not _oc_mode,
-                size=(5, 1),
-                key='cpuOcFrequency'),
-            sg.Text('MHz'),
-        ],
-        [
-            sg.Text(' Overclock VID', size=(18, 1)),
-            sg.Spin(
-                values=[x for x in range(VID_MAX, VID_MIN, -1)],
-                initial_value=_default_vid,
-                enable_events=True,
-                disabled=not _oc_mode,
-                size=(5, 1),
-                key='cpuOcVid'),
-            sg.Text("%.5f V" % vidToVolts(_default_vid), key='cpuOcVoltageText'),
-        ],
-    ]
-
-    tab2_layout = [
-        [   
-            sg.Text('', size=(8, 1)),
-            sg.Text('FID', size=(6, 1)),
-            sg.Text('DID', size=(6, 1)),
-            sg.Text('VID', size=(6, 1))
-        ]
-    ]
-    for p in range(0, 3):
-        state = readmsr(PSTATES[p])
-        d = getPstateDetails(state)
-        tab2_layout.append([
-            sg.Text(' P-State%s' % str(p), size=(8, 1)),
-            sg.Spin(
-                values=[x for x in range(FID_MIN, FID_MAX, 1)],
-                initial_value=d[0],
-                enable_events=True,
-                size=(5, 1),
-                key='pstate%sFid' % str(p)
-            ),
-            sg.Spin(
-                values=[x for x in range(DID_MAX, DID_MIN - 1, -2)],
-                initial_value=d[1],
-                enable_events=True,
-                size=(5, 1),
-                key='pstate%sDid' % str(p)
-            ),
-            sg.Spin(
-                values=[x for x in range(VID_MAX, VID_MIN - 1, -1)],
-                initial_value=d[2],
-                enable_events=True,
-                size=(5, 1),
-                key='pstate%sVid' % str(p)
-            ),
-            sg.Text(pstateToGuiString(d[0], d[1], d[2]), key='pstateDetails%s' % str(p))
-        ])
-
-    tab3_layout = [
-        [sg.Text('C6 States')],
-        [sg.CBox(
-            'C6-State Package',
-            default=getC6package(),
-            enable_events=True,
-            key='c6StatePackage')
-        ],
-        [sg.CBox(
-            'C6-State Core',
-            default=getC6core(),
-            enable_events=True,
-            key='c6StateCore')
-        ],
-        [sg.Text('Experimental')],
-        [
-            sg.Text(' PPT', size=(6, 1)),
-            sg.Spin(
-                values=[x for x in range(-1, 1000, 1)],
-                initial_value=-1,
-                enable_events=True,
-                disabled=False,
-                size=(5, 1),
-                key='ppt'),
-            sg.Text('W', size=(4, 1)),
-            sg.Text(' TDC', size=(6, 1)),
-            sg.Spin(
-                values=[x for x in range(-1, 1000, 1)],
-                initial_value=-1,
-                enable_events=True,
-                disabled=False,
-                size=(5, 1),
-                key='tdc'),
-            sg.Text('A', size=(4, 1)),
-        ],
-        [
-            sg.Text(' EDC', size=(6, 1)),
-            sg.Spin(
-                values=[x for x in range(-1, 1000, 1)],
-                initial_value=-1,
-                enable_events=True,
-                disabled=False,
-                size=(5, 1),
-                key='edc'),
-            sg.Text('A', size=(4, 1)),
-            sg.Text(' Scalar', size=(6, 1)),
-            sg.Spin(
-                values=[x for x in range(0, 10, 1)],
-                initial_value=0,
-                enable_events=True,
-                disabled=True,
-                size=(5, 1),
-                key='scalar')
-        ],
-        [sg.Text(' * -1 = Auto / No change')]
-    ]
-
-    # The TabgGroup layout - it must contain only Tabs
-    if isOcFreqSupported:
-        tab_group_layout = [
-            [
-                sg.Tab('CPU', tab1_layout, key='-TAB1-'),
-                sg.Tab('P-States', tab2_layout, key='-TAB2-'),
-                sg.Tab('Power', tab3_layout, key='-TAB3-')
-            ]
-        ]
-    else:
-        tab_group_layout = [
-            [
-                sg.Tab('P-States', tab2_layout, key='-TAB2-'),
-                sg.Tab('Power', tab3_layout, key='-TAB3-')
-            ]
-        ]
-
-    # The window layout - defines the entire window
-    layout = [
-        [sg.TabGroup(tab_group_layout,
-                     # selected_title_color='blue',
-                     # selected_background_color='red',
-                     # tab_background_color='green',
-                     enable_events=True,
-                     # font='Courier 18',
-                     key='-TABGROUP-')],
-        [sg.Button('Apply', key='applyBtn'), sg.Button('Cancel')]
-    ]
-
-    def applyCpuSettings():
-        if values['ocMode']:
-            writesmu(SMU_CMD_OC_ENABLE)
-            writesmu(SMU_CMD_OC_FREQ_ALL_CORES, values['cpuOcFrequency'])
-            writesmu(SMU_CMD_OC_VID, values['cpuOcVid'])
-        else:
-            writesmu(SMU_CMD_OC_DISABLE)
-
-
-    def applyPstatesSettings():
-        for p in range(0, 3):
-            setPstateGui(p, values['pstate%sFid' % str(p)], values['pstate%sDid' % str(p)], values['pstate%sVid' % str(p)])
-
-
-    def applyPowerSettings():
-        setC6Core(values['c6StateCore'])
-        setC6Package(values['c6StatePackage'])
-        setPboLimits(values['ppt'], values['tdc'], values['edc'], values['scalar'])
-
-
-    window_title = "%s v%s" % (APP_NAME, APP_VERSION)
-    window = sg.Window(window_title, layout)
-    print('GUI: %s initialized' % window_title)
-
-    while True:     # Event Loop
-        event, values = window.read()
-        # print(event)
-        # print(values)
-
-        # Cancel or close event
-        if event in (None, 'Cancel'):
-            break
-
-        # Apply button events
-        if event == 'applyBtn' and values['-TABGROUP-'] == '-TAB1-':
-            if isOcFreqSupported: applyCpuSettings()
-        if event == 'applyBtn' and values['-TABGROUP-'] == '-TAB2-':
-            applyPstatesSettings()
-        if event == 'applyBtn' and values['-TABGROUP-'] == '-TAB3-':
-            applyPowerSettings()
-
-        # UI elements state change
-        if event == 'ocMode':
-            window['cpuOcFrequency'].update(disabled=(not values['ocMode']))
-            window['cpuOcVid'].update(disabled=(not values['ocMode']))
-        if event == 'cpuOcVid':
-            window['cpuOcVoltageText'].update("%.5f V" % vidToVolts(values['cpuOcVid']))
-
-        for p in range(0, 3):
-            if event in ['pstate%sFid' % str(p), 'pstate%sDid' % str(p), 'pstate%sVid' % str(p)]:
-                window['pstateDetails%s' % str(p)].update(
-                    pstateToGuiString(
-                        values['pstate%sFid' % str(p)],
-                        values['pstate%sDid' % str(p)],
-                        values['pstate%sVid' % str(p)]
-                    )
-                )
-    window.close()
+    try:
+        detect()
+    except SystemError as e:
+        exit(str(e))
+
+    print('CPUs: %d' % cpu_sockets)
+    print('CPUID: %08X' % _cpuid)
+    print('Package Type: %01d' % _pkgtype)
+
+    # With --thermal-limit every profile, P-state, OC and limit write and the
+    # stress tests are stopped once a temperature reaches the limit
+    import thermal
+    guard = None
+    if args.thermal_limit is not None:
+        guard = thermal.Guard(args.thermal_limit).start()
+    # The guard's sampling thread stops on every way out, exit() included
+    try:
+        if guard is not None:
+            try:
+                guard.check()
+            except thermal.ThermalTrip as e:
+                exit(str(e))
+        _commands(args, cpulist, guard)
+    finally:
+        if guard is not None:
+            guard.close()
+
+    if (not args.list and not args.snapshot and not args.pm_table and not args.profile and not args.topology
+        and not args.autotune and not args.stress and args.pstate == -1 and not args.c6_enable and not args.c6_disable
+        and not args.smu_test_message and args.no_gui and args.edc == -1 and args.ppt == -1 
+        and args.tdc == -1):
+        parser.print_help()
+
+    if not args.no_gui:
+        import gui
+        gui.run()
+
+
+if __name__ == '__main__':
+    # Import ourselves so that the GUI and any other module share this
+    # module's state instead of a second copy living in __main__
+    import zenstates
+    zenstates.main()